@@ -1,5 +1,6 @@
 import datetime
 import logging
+import os
 from pathlib import Path
 
 import azure.functions as func
@@ -25,5 +26,11 @@ def main(mytimer: func.TimerRequest) -> None:
             two_weeks_before.strftime(fmt),
             two_days_ago.strftime(fmt),
             fdir="/mounted/",
+            page_size=500,
+            # Incremental 14-day mean when an Earth Engine folder is configured
+            asset_root=os.environ.get("METHANE_ASSET_ROOT"),
+            formats=("geojson", "parquet", "fgb"),
+            history_dir="/mounted/history",
+            context_top_n=50,
         )
     )
@@ -0,0 +1,182 @@
+"""
+Backfill
+------------------------------
+
+Run the hotspot detection over a range of past windows, in parallel and resumable
+
+    python -m methane.backfill 2021-01-01 2022-01-01 --window 14 --stride 1 --fdir /mounted/
+
+Every completed window is recorded in a manifest, a rerun only processes the windows
+that are missing or failed. The windows share one infrastructure snapshot.
+"""
+import argparse
+import datetime
+import itertools
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from methane.history import HotspotHistory
+from methane.methane_hotspots import HOTSPOTS_DIR, run
+from methane.output import PARQUET_NAME, partition_path, read_geoparquet
+from methane.registry import get_infrastructure
+
+logger = logging.getLogger(__name__)
+
+FMT = "%Y-%m-%d"
+MANIFEST_NAME = "backfill_manifest.json"
+
+
+def make_windows(start_date, end_date, window_days=14, stride_days=1):
+    """
+    Windows of `window_days` days starting every `stride_days` days and ending by end_date
+
+    :param start_date: start of the first window (str: 'YYYY-MM-dd')
+    :param end_date: latest end of a window (str: 'YYYY-MM-dd')
+    :return: list of (start_date, end_date) str pairs
+    """
+    start = datetime.datetime.strptime(start_date, FMT).date()
+    end = datetime.datetime.strptime(end_date, FMT).date()
+    window, stride = datetime.timedelta(days=window_days), datetime.timedelta(days=stride_days)
+    windows = []
+    while start + window <= end:
+        windows.append((start.strftime(FMT), (start + window).strftime(FMT)))
+        start += stride
+    return windows
+
+
+class Manifest:
+    """
+    Status of the windows of a backfill, saved to disk after every change
+
+    :param path: path of the JSON manifest
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.windows = json.loads(self.path.read_text()) if self.path.exists() else {}
+
+    @staticmethod
+    def key(window):
+        return "{}_{}".format(*window)
+
+    def is_done(self, window):
+        return self.windows.get(self.key(window), {}).get("status") == "done"
+
+    def record(self, window, status, error=None):
+        with self._lock:
+            self.windows[self.key(window)] = {
+                "status": status,
+                "error": error,
+                "updated_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            }
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(self.windows, indent=1, sort_keys=True))
+            os.replace(tmp, self.path)
+
+
+def backfill(start_date, end_date, window_days=14, stride_days=1, fdir='/mounted/', max_workers=4,
+             history_dir=None, formats=('geojson',), **run_kwargs):
+    """
+    Run the detection for every window of a date range
+
+    :param start_date: start of the first window (str: 'YYYY-MM-dd')
+    :param end_date: latest end of a window (str: 'YYYY-MM-dd')
+    :param window_days: length of the windows, in days
+    :param stride_days: days between the starts of two windows
+    :param fdir: output directory, also holding the manifest
+    :param max_workers: number of windows processed at the same time
+    :param history_dir: optional hotspot history the windows are appended to, in
+        chronological order once they are all processed
+    :param formats: output formats, see methane.methane_hotspots.write_outputs
+    :param run_kwargs: forwarded to methane.methane_hotspots.run, e.g. page_size or tile_size
+    :return: list of the windows that failed
+    """
+    windows = make_windows(start_date, end_date, window_days, stride_days)
+    manifest = Manifest(Path(fdir) / MANIFEST_NAME)
+    pending = [w for w in windows if not manifest.is_done(w)]
+    logger.info("%d windows, %d to process", len(windows), len(pending))
+
+    if history_dir is not None and 'parquet' not in formats:
+        # The history is built from the parquet outputs
+        formats = tuple(formats) + ('parquet',)
+
+    # Loaded once, shared by the windows running in parallel threads
+    infrastructure = get_infrastructure()
+
+    def process(window):
+        try:
+            run(*window, fdir=fdir, formats=formats, infrastructure=infrastructure, **run_kwargs)
+        except Exception as e:
+            logger.exception("Window %s failed", Manifest.key(window))
+            manifest.record(window, "failed", repr(e))
+            return window
+        manifest.record(window, "done")
+        logger.info("Window %s done", Manifest.key(window))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        failed = [w for w in executor.map(process, pending) if w is not None]
+
+    if history_dir is not None:
+        # The history is append-only: stop at the first window not done, a rerun continues from it
+        append_history(history_dir, fdir, list(itertools.takewhile(manifest.is_done, windows)))
+    return failed
+
+
+def append_history(history_dir, fdir, windows):
+    """
+    Append the outputs of completed windows to a hotspot history, skipping the archived ones
+
+    Windows are appended in order up to the first one without output.
+    """
+    history = HotspotHistory(history_dir)
+    archived = history.run_dates()
+    for window_start, window_end in sorted(windows, key=lambda w: w[1]):
+        if archived and window_end <= archived[-1]:
+            continue
+        path = partition_path(Path(fdir) / HOTSPOTS_DIR, window_end) / PARQUET_NAME
+        if not path.exists():
+            logger.warning("No output for window ending %s, history stopped before it", window_end)
+            break
+        history.append(read_geoparquet(path), window_end)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Detect methane hotspots over a range of past windows")
+    parser.add_argument("start_date", help="start of the first window, YYYY-MM-dd")
+    parser.add_argument("end_date", help="latest end of a window, YYYY-MM-dd")
+    parser.add_argument("--window", type=int, default=14, help="length of the windows in days")
+    parser.add_argument("--stride", type=int, default=1, help="days between two windows")
+    parser.add_argument("--fdir", default="/mounted/", help="output directory")
+    parser.add_argument("--workers", type=int, default=4, help="windows processed in parallel")
+    parser.add_argument("--formats", nargs="+", default=["geojson"], choices=["geojson", "parquet", "fgb"])
+    parser.add_argument("--history-dir", default=None, help="hotspot history to append the windows to")
+    parser.add_argument("--page-size", type=int, default=None, help="see methane_hotspots.fcToGdf")
+    parser.add_argument("--tile-size", type=float, default=None, help="see methane_hotspots.tiled_methane_hotspots")
+    parser.add_argument("--credentials", default=None, help="service account key, see earth_engine")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(levelname)s %(message)s")
+    if args.credentials is not None:
+        from methane.earth_engine import authenticate_google_service_account
+        authenticate_google_service_account(args.credentials)
+    else:
+        import ee
+        ee.Initialize()
+
+    failed = backfill(
+        args.start_date, args.end_date, window_days=args.window, stride_days=args.stride, fdir=args.fdir,
+        max_workers=args.workers, history_dir=args.history_dir, formats=tuple(args.formats),
+        page_size=args.page_size, tile_size=args.tile_size,
+    )
+    if failed:
+        raise SystemExit(f"{len(failed)} windows failed, rerun to retry them")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Incremental composites
+------------------------------
+
+Rolling-window methane means maintained from persisted per-day partial aggregates
+
+Each day of the collection is reduced once to a `sum` and `count` image stored as an
+Earth Engine asset. The window aggregate of the previous run is then updated by adding
+the new day and subtracting the expired one, so a daily run only reads a few days of raw
+data. The window mean is sum / count.
+
+Exports are started without waiting for them, the daily function cannot block for
+hours: until the aggregates are stored the mean is computed from the collection. The
+last REFRESH_DAYS days are aggregated from the collection and exported again at every
+run, since OFFL observations can be published days late.
+"""
+import datetime
+import logging
+import time
+
+import ee
+
+from methane.ee_client import get_info
+
+logger = logging.getLogger(__name__)
+
+METHANE_COLLECTION = 'COPERNICUS/S5P/OFFL/L3_CH4'
+METHANE_BAND = 'CH4_column_volume_mixing_ratio_dry_air'
+
+FMT = "%Y-%m-%d"
+# OFFL observations of a day can be published a few days later
+REFRESH_DAYS = 3
+
+
+def _date(value):
+    if isinstance(value, str):
+        return datetime.datetime.strptime(value, FMT).date()
+    return value
+
+
+def daily_asset_id(asset_root, day):
+    return f"{asset_root}/daily_{day:%Y%m%d}"
+
+
+def window_asset_id(asset_root, start_date, end_date):
+    return f"{asset_root}/window_{start_date:%Y%m%d}_{end_date:%Y%m%d}"
+
+
+def asset_exists(asset_id):
+    try:
+        ee.data.getAsset(asset_id)
+        return True
+    except ee.EEException:
+        return False
+
+
+def daily_aggregate(day):
+    """
+    Per-pixel sum and count of the methane observations of one day
+
+    :param day: datetime.date
+    :return: ee.Image with bands `sum` and `count`, 0 where there is no observation
+    """
+    images = (
+        ee.ImageCollection(METHANE_COLLECTION)
+        .select([METHANE_BAND])
+        .filterDate(day.strftime(FMT), (day + datetime.timedelta(days=1)).strftime(FMT))
+    )
+    return ee.Image.cat([
+        images.sum().rename('sum'),
+        images.count().rename('count'),
+    ]).unmask(0).toFloat()
+
+
+def export_aggregate(image, asset_id, bounds):
+    """
+    Start storing an aggregate image as an asset in the native projection of the collection
+
+    The export runs in Earth Engine, this does not wait for it: see wait_for_export.
+
+    :param image: ee.Image with bands `sum` and `count`
+    :param asset_id: id of the asset to create
+    :param bounds: region exported as (west, south, east, north)
+    :return: ee.batch.Task
+    """
+    projection = get_info(ee.ImageCollection(METHANE_COLLECTION).first().select([METHANE_BAND]).projection())
+    west, south, east, north = bounds
+    task = ee.batch.Export.image.toAsset(
+        image=image,
+        description=export_name(asset_id),
+        assetId=asset_id,
+        region=ee.Geometry.Rectangle([west, south, east, north], None, False),
+        crs=projection['crs'],
+        crsTransform=projection['transform'],
+        # Coarser pyramid levels keep sums and counts, so sum / count stays a mean
+        pyramidingPolicy={'.default': 'sum'},
+        maxPixels=10e10,
+    )
+    task.start()
+    logger.info("Started the export of %s", asset_id)
+    return task
+
+
+def wait_for_export(task, poll_interval=30, timeout=3 * 3600):
+    """
+    Wait for an export to complete, for callers that can block (not the daily function)
+    """
+    started = time.monotonic()
+    while True:
+        status = task.status()
+        if status['state'] == 'COMPLETED':
+            return
+        if status['state'] in ('FAILED', 'CANCELLED'):
+            raise RuntimeError(f"Export {status.get('description')} {status['state'].lower()}: {status.get('error_message')}")
+        if time.monotonic() - started > timeout:
+            raise TimeoutError(f"Export {status.get('description')} did not complete in {timeout}s")
+        time.sleep(poll_interval)
+
+
+def export_name(asset_id):
+    return asset_id.rsplit('/', 1)[-1]
+
+
+def pending_exports():
+    """
+    Return the names of the exports waiting or running in Earth Engine
+    """
+    return {task['description'] for task in ee.data.getTaskList() if task['state'] in ('READY', 'RUNNING')}
+
+
+def schedule_daily(asset_root, days, bounds, refresh_from, pending):
+    """
+    Start the exports of the daily aggregates that are missing or recent
+
+    Days from refresh_from on are exported again at every run: their asset is replaced
+    so observations published late are included.
+
+    :param days: iterable of datetime.date
+    :param refresh_from: first day exported again even if its aggregate exists
+    :param pending: names of the exports in progress, see pending_exports, not started twice
+    """
+    for day in days:
+        asset_id = daily_asset_id(asset_root, day)
+        if export_name(asset_id) in pending:
+            continue
+        if asset_exists(asset_id):
+            if day < refresh_from:
+                continue
+            ee.data.deleteAsset(asset_id)
+        export_aggregate(daily_aggregate(day), asset_id, bounds)
+
+
+def update_window(asset_root, start_date, end_date, bounds, pending=()):
+    """
+    Return the sum and count aggregate of [start_date, end_date) if it is stored, starting its export otherwise
+
+    When the aggregate of the window one day earlier exists, only the new day is added and
+    the expired day subtracted. Otherwise the window is built from its daily aggregates.
+    The export starts once the aggregates it reads exist.
+
+    :param asset_root: folder of the aggregate assets, e.g. 'projects/<project>/assets/methane'
+    :param start_date: first day of the window (str: 'YYYY-MM-dd' or date)
+    :param end_date: day after the last day of the window (str: 'YYYY-MM-dd' or date)
+    :param bounds: region covered by the aggregates as (west, south, east, north)
+    :param pending: names of the exports in progress, see pending_exports
+    :return: ee.Image with bands `sum` and `count`, None while the aggregate is not stored
+    """
+    start_date, end_date = _date(start_date), _date(end_date)
+    one_day = datetime.timedelta(days=1)
+    asset_id = window_asset_id(asset_root, start_date, end_date)
+    if asset_exists(asset_id):
+        return ee.Image(asset_id)
+    if export_name(asset_id) in pending:
+        return None
+
+    def daily(day):
+        day_id = daily_asset_id(asset_root, day)
+        return ee.Image(day_id) if asset_exists(day_id) and export_name(day_id) not in pending else None
+
+    previous_id = window_asset_id(asset_root, start_date - one_day, end_date - one_day)
+    added, expired = daily(end_date - one_day), daily(start_date - one_day)
+    if asset_exists(previous_id) and added is not None and expired is not None:
+        logger.info("Updating %s from %s", asset_id, previous_id)
+        window = ee.Image(previous_id).add(added).subtract(expired)
+    else:
+        days = [daily(start_date + i * one_day) for i in range((end_date - start_date).days)]
+        if any(day is None for day in days):
+            return None
+        logger.info("Building %s from daily aggregates", asset_id)
+        window = ee.ImageCollection(days).sum()
+
+    export_aggregate(window.rename(['sum', 'count']), asset_id, bounds)
+    return None
+
+
+def window_mean(aggregate):
+    """
+    Mean methane image of a window aggregate, masked where there is no observation
+
+    :param aggregate: ee.Image with bands `sum` and `count`
+    :return: ee.Image with band `ch4`
+    """
+    count = aggregate.select('count')
+    return aggregate.select('sum').divide(count).updateMask(count.gt(0)).rename('ch4')
+
+
+def prune(asset_root, keep_from):
+    """
+    Delete the daily and window aggregates that ended before a date
+
+    :param asset_root: folder of the aggregate assets
+    :param keep_from: oldest day still needed (str: 'YYYY-MM-dd' or date)
+    """
+    keep_from = _date(keep_from)
+    for asset in ee.data.listAssets({'parent': asset_root}).get('assets', []):
+        name = asset['id'].rsplit('/', 1)[-1]
+        last_day = name.rsplit('_', 1)[-1]
+        try:
+            last_day = datetime.datetime.strptime(last_day, "%Y%m%d").date()
+        except ValueError:
+            continue
+        if last_day < keep_from:
+            ee.data.deleteAsset(asset['id'])
+
+
+def incremental_methane_mean(start_date, end_date, asset_root, bounds, refresh_days=REFRESH_DAYS):
+    """
+    Mean methane over [start_date, end_date) maintained incrementally from stored aggregates
+
+    Days older than refresh_days come from the stored window aggregate, the recent ones,
+    which can still receive late observations, are aggregated from the collection. Missing
+    or recent aggregates are exported in the background and aggregates no longer needed
+    are deleted, nothing waits for Earth Engine exports.
+
+    :param refresh_days: number of recent days exported again at every run
+    :return: ee.Image with band `ch4`, None while the aggregates are not stored yet: the
+        mean is then to be computed from the collection
+    """
+    start_date, end_date = _date(start_date), _date(end_date)
+    one_day = datetime.timedelta(days=1)
+    stable_end = max(start_date, end_date - refresh_days * one_day)
+
+    pending = pending_exports()
+    days = [start_date - one_day + i * one_day for i in range((end_date - start_date).days + 1)]
+    schedule_daily(asset_root, days, bounds, stable_end, pending)
+    aggregate = update_window(asset_root, start_date, stable_end, bounds, pending) if stable_end > start_date else None
+    prune(asset_root, start_date - one_day)
+
+    if aggregate is None:
+        logger.info("Aggregates of %s - %s not stored yet, the mean is computed from the collection", start_date, end_date)
+        return None
+    recent = [daily_aggregate(stable_end + i * one_day) for i in range((end_date - stable_end).days)]
+    if recent:
+        aggregate = aggregate.add(ee.ImageCollection(recent).sum())
+    return window_mean(aggregate)
@@ -0,0 +1,184 @@
+"""
+Hotspot context
+------------------------------
+
+Context bundles of the most critical hotspots of a run, precomputed by the daily job so
+the web application reads them instead of querying Earth Engine and scanning the
+infrastructure when a hotspot is selected
+
+Bundles are stored next to the run outputs (see methane.output), one table per kind of
+context sorted by hotspot:
+
+    <root>/run_date=YYYY-MM-DD/context_stats.parquet    one row per hotspot
+    <root>/run_date=YYYY-MM-DD/context_series.parquet   daily methane statistics
+    <root>/run_date=YYYY-MM-DD/context_assets.parquet   nearby assets with their distance
+"""
+import datetime
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import ee
+import numpy as np
+import pandas as pd
+import shapely
+import shapely.geometry
+
+from methane.output import partition_path
+from methane.registry import get_infrastructure
+from methane.timeseries import methane_time_series
+
+logger = logging.getLogger(__name__)
+
+FMT = "%Y-%m-%d"
+CONTEXT_TABLES = ("stats", "series", "assets")
+
+# Days of the methane series of a hotspot, precomputed or queried by the app
+SERIES_DAYS = 90
+ASSET_COLUMNS = ["name", "lat", "lng", "status", "country"]
+
+
+def hotspot_ids(geometries):
+    """
+    Stable identifiers of hotspots from the position of their centroid, e.g. "+5026+1316"
+
+    Centroids are rounded to 0.01 degree, hotspots sharing a position after the first get
+    a suffix in their order, e.g. "+5026+1316-1", so pass them sorted by criticality.
+
+    :param geometries: array-like of shapely geometries
+    :return: np.ndarray of str
+    """
+    centroids = shapely.centroid(np.asarray(geometries, dtype=object))
+    lat = np.round(shapely.get_y(centroids) * 100).astype(int)
+    lng = np.round(shapely.get_x(centroids) * 100).astype(int)
+    ids = pd.Series([f"{y:+05d}{x:+05d}" for y, x in zip(lat, lng)], dtype=object)
+    duplicate = ids.groupby(ids).cumcount()
+    return ids.where(duplicate == 0, ids + "-" + duplicate.astype(str)).to_numpy(dtype=object)
+
+
+def context_path(root, run_date, table):
+    return partition_path(root, run_date) / f"context_{table}.parquet"
+
+
+def nearby_assets(hotspots, infrastructure=None, max_distance=50000, k=25):
+    """
+    Assets within max_distance of each hotspot, nearest first
+
+    :param hotspots: gpd.GeoDataFrame of hotspots with an `id` column
+    :param max_distance: radius in metres
+    :param k: maximum number of plants and of pipelines per hotspot
+    :return: pd.DataFrame with hotspot_id, asset_id, asset_type, distance (m) and the asset attributes
+    """
+    infrastructure = infrastructure or get_infrastructure()
+    frames = []
+    for index, assets in [(infrastructure.plants_index, infrastructure.plants),
+                          (infrastructure.pipelines_index, infrastructure.pipelines)]:
+        nearest = index.nearest(hotspots.geometry, k=k, max_distance=max_distance, geodesic=True)
+        attributes = pd.DataFrame(assets.drop(columns=assets.geometry.name)).set_index("asset_id")
+        attributes = attributes[[c for c in ASSET_COLUMNS if c in attributes]].astype(object)
+        frames.append(nearest.join(attributes, on="asset_id"))
+    assets = pd.concat(frames, ignore_index=True)
+    assets = assets.assign(hotspot_id=hotspots["id"].to_numpy()[assets["hotspot"].to_numpy(dtype=int)])
+    return (assets
+        .sort_values(["hotspot_id", "distance"], kind="stable")
+        .drop(columns=["hotspot", "rank"])
+        .reset_index(drop=True)
+    )
+
+
+def hotspot_series(hotspots, end_date, days=SERIES_DAYS, max_workers=4):
+    """
+    Daily methane statistics over each hotspot for the `days` days before end_date
+
+    :return: pd.DataFrame with hotspot_id, date and the columns of methane.timeseries.stats_to_df
+    """
+    end = datetime.datetime.strptime(end_date, FMT).date()
+    start_date = (end - datetime.timedelta(days=days)).strftime(FMT)
+
+    def series(row):
+        geometry = ee.Geometry(shapely.geometry.mapping(row.geometry))
+        return methane_time_series(geometry, start_date, end_date).reset_index().assign(hotspot_id=row.id)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        frames = list(executor.map(series, hotspots[["id", "geometry"]].itertuples()))
+    if not frames:
+        return pd.DataFrame(columns=["hotspot_id", "date"])
+    return pd.concat(frames, ignore_index=True)
+
+
+def hotspot_stats(hotspots, series, assets):
+    """
+    Summary of each hotspot: its scores, and aggregates of its series and nearby assets
+
+    :return: pd.DataFrame with one row per hotspot_id
+    """
+    columns = [c for c in ["id", "criticality", "area_m2", "min_dist_plant", "min_dist_pipeline",
+                           "min_dist_infra", "start_date", "end_date"] if c in hotspots]
+    centroids = shapely.centroid(np.asarray(hotspots.geometry.values, dtype=object))
+    stats = pd.DataFrame(hotspots[columns]).rename(columns={"id": "hotspot_id"}).assign(
+        lat=shapely.get_y(centroids), lng=shapely.get_x(centroids),
+    )
+    if "mean" in series:
+        valid = series[series["count"] > 0]
+        stats = stats.merge(
+            valid.groupby("hotspot_id").agg(
+                methane_mean=("mean", "mean"), methane_max=("mean", "max"), valid_days=("mean", "size"),
+            ).reset_index(),
+            on="hotspot_id", how="left",
+        )
+    stats = stats.merge(
+        assets.groupby("hotspot_id").agg(nearby_assets=("asset_id", "size")).reset_index(),
+        on="hotspot_id", how="left",
+    )
+    return stats.assign(nearby_assets=stats["nearby_assets"].fillna(0).astype(np.int64))
+
+
+def _write(df, path):
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    # Rows are sorted by hotspot, the row group statistics let a read skip other hotspots
+    df.sort_values("hotspot_id", kind="stable").to_parquet(tmp, index=False, row_group_size=1024)
+    os.replace(tmp, path)
+
+
+def write_context(hotspots, root, run_date, top_n=50, days=SERIES_DAYS, infrastructure=None):
+    """
+    Precompute and store the context bundles of the top_n most critical hotspots of a run
+
+    :param hotspots: gpd.GeoDataFrame of hotspots with an `id` column, sorted by criticality
+    :param root: directory of the run partitions
+    :param run_date: date of the run (str: 'YYYY-MM-dd'), the end of the series
+    :param top_n: number of hotspots with a bundle
+    :param days: length of the daily series
+    :return: dict of the paths written per table
+    """
+    top = hotspots.head(top_n)
+    assets = nearby_assets(top, infrastructure)
+    series = hotspot_series(top, run_date, days)
+    stats = hotspot_stats(top, series, assets)
+
+    partition_path(root, run_date).mkdir(parents=True, exist_ok=True)
+    paths = {}
+    for table, df in zip(CONTEXT_TABLES, (stats, series, assets)):
+        paths[table] = context_path(root, run_date, table)
+        _write(df, paths[table])
+    return paths
+
+
+def load_context(root, run_date, hotspot_id):
+    """
+    Read the context bundle of one hotspot
+
+    :return: dict with the `stats` (pd.Series), `series` and `assets` (pd.DataFrame) of
+        the hotspot, None if the run has no bundle for it
+    """
+    if not context_path(root, run_date, "stats").exists():
+        return None
+    bundle = {
+        table: pd.read_parquet(context_path(root, run_date, table), filters=[("hotspot_id", "==", hotspot_id)])
+        for table in CONTEXT_TABLES
+    }
+    if bundle["stats"].empty:
+        return None
+    bundle["stats"] = bundle["stats"].iloc[0]
+    bundle["series"] = bundle["series"].set_index("date") if "date" in bundle["series"] else bundle["series"]
+    return bundle
@@ -4,11 +4,16 @@ Earth Engine loading utils
 
 Function to load and export from earth engine
 """
+from operator import itemgetter
 from pathlib import Path
 
 import ee
+import numpy as np
 import pandas as pd
 
+GEO_COLUMNS = ['longitude', 'latitude']
+REGION_COLUMNS = ['id', 'longitude', 'latitude', 'time']
+
 
 def authenticate_google_service_account(
         json_path: Path,
@@ -33,33 +38,56 @@ def load_collection(collection):
         raise ValueError('Unknown collection')
 
 
-def ee_array_to_df(arr, list_of_bands):
-    """Transforms client-side ee.Image.getRegion array to pandas.DataFrame.
-    
-    :param arr: ee.Array
-    :list_of_bands: List[str]
-    :return: pd.DataFrame
-    """
-    df = pd.DataFrame(arr)
-
-    # Rearrange the header.
-    headers = df.iloc[0]
-    df = pd.DataFrame(df.values[1:], columns=headers)
-
-    # Remove rows without data inside.
-    df = df[['longitude', 'latitude', 'time', *list_of_bands]].dropna()
+def region_columns(arr, list_of_bands=None, keep_geo=False):
+    """Decodes a client-side ee.Image.getRegion array into typed numpy columns.
 
-    # Convert the data to numeric values.
-    for band in list_of_bands:
-        df[band] = pd.to_numeric(df[band], errors='coerce')
+    Rows missing their coordinates, time or any band are dropped.
 
-    # Convert the time field into a datetime.
-    df['datetime'] = pd.to_datetime(df['time'], unit='ms')
-
-    # Keep the columns of interest.
-    df = df[['time','datetime',  *list_of_bands]]
+    :param arr: getRegion payload, a header row followed by one row per pixel and image
+    :param list_of_bands: bands to decode, defaults to every band of the payload
+    :param keep_geo: also return the longitude and latitude columns
+    :return: dict of np.ndarray: time (int64 ms), datetime (datetime64[ns]), the bands
+        (float64) and optionally longitude and latitude (float64)
+    """
+    header = list(arr[0])
+    if list_of_bands is None:
+        list_of_bands = [c for c in header if c not in REGION_COLUMNS]
+    rows = arr[1:]
+    decoded = {
+        name: _column(rows, header.index(name))
+        for name in ['longitude', 'latitude', 'time', *list_of_bands]
+    }
+    valid = np.logical_and.reduce([~np.isnan(values) for values in decoded.values()])
+
+    time = decoded['time'][valid].astype(np.int64)
+    result = {
+        'time': time,
+        'datetime': time.astype('datetime64[ms]').astype('datetime64[ns]'),
+    }
+    result.update({band: decoded[band][valid] for band in list_of_bands})
+    if keep_geo:
+        result.update({name: decoded[name][valid] for name in GEO_COLUMNS})
+    return result
+
+
+def _column(rows, position):
+    values = map(itemgetter(position), rows)
+    try:
+        return np.fromiter(values, dtype=float, count=len(rows))
+    except TypeError:
+        # Masked values are None, which only the slower list conversion turns into NaN
+        return np.array([row[position] for row in rows], dtype=float)
+
+
+def ee_array_to_df(arr, list_of_bands=None, keep_geo=False):
+    """Transforms client-side ee.Image.getRegion array to pandas.DataFrame.
 
-    return df
+    :param arr: getRegion payload, see region_columns
+    :param list_of_bands: List[str], defaults to every band of the payload
+    :param keep_geo: keep the longitude and latitude columns
+    :return: pd.DataFrame with columns time, datetime, the bands and optionally longitude and latitude
+    """
+    return pd.DataFrame(region_columns(arr, list_of_bands, keep_geo), copy=False)
 
 
 def load_methane_data(start_date, end_date):
@@ -0,0 +1,178 @@
+"""
+Earth Engine result cache
+------------------------------
+
+On-disk cache of Earth Engine results keyed by the hash of the serialized expression
+
+Two calls computing the same expression, in the same process or not, share one request.
+Entries expire after a time to live, and the least recently used ones are evicted when
+the cache grows over its size budget. The size of the cache is kept as a running total,
+the directory is only listed when the total goes over the budget.
+
+The cache is opt-in, enabled with `enabled=True` or the METHANE_EE_CACHE=on environment
+variable. Expressions over recent days keep changing while late Sentinel-5P OFFL data
+arrives (see methane.composites.REFRESH_DAYS), so only enable it where the expressions
+cover settled data, e.g. backfills of past windows. Any object exposing `serialize()` and `getInfo()` can be cached, which lets
+tests use a local fake instead of Earth Engine. Requests go through the cache with
+methane.ee_client.get_info.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import threading
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_DIR = os.environ.get("METHANE_EE_CACHE_DIR", str(Path.home() / ".cache" / "methane" / "ee"))
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_MAX_BYTES = 1 << 30
+
+
+def expression_key(obj, namespace=""):
+    """
+    Key of an Earth Engine expression, the sha256 of its serialized graph
+
+    :param obj: ee.ComputedObject, or any object exposing serialize()
+    :param namespace: distinguishes different results of the same expression, e.g. the operation
+    :return: str
+    """
+    sha = hashlib.sha256(namespace.encode())
+    sha.update(obj.serialize().encode())
+    return sha.hexdigest()
+
+
+class ResultCache:
+    """
+    Directory of pickled results with a time to live and a size-bounded LRU eviction
+
+    :param cache_dir: directory of the entries
+    :param ttl: seconds after which an entry is recomputed, None to keep entries forever
+    :param max_bytes: size of the cache over which the least recently used entries are evicted
+    :param enabled: True to store the results, defaults to True when METHANE_EE_CACHE=on
+    """
+
+    def __init__(self, cache_dir=DEFAULT_DIR, ttl=DEFAULT_TTL, max_bytes=DEFAULT_MAX_BYTES, enabled=None):
+        self.cache_dir = Path(cache_dir)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.enabled = enabled if enabled is not None else os.environ.get("METHANE_EE_CACHE", "off") == "on"
+        self._lock = threading.Lock()
+        # Bytes in the cache, counted on the first write, None until then
+        self._total = None
+
+    def _path(self, key):
+        return self.cache_dir / key[:2] / f"{key}.pkl"
+
+    def get(self, key):
+        """
+        Return the value of an entry, or None if it is missing or expired
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                created_at, value = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        if self.ttl is not None and time.time() - created_at > self.ttl:
+            return None
+        # The modification time of an entry is its last access, for the LRU eviction
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return value
+
+    def put(self, key, value):
+        path = self._path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            pickle.dump((time.time(), value), f, protocol=pickle.HIGHEST_PROTOCOL)
+        size = tmp.stat().st_size
+        with self._lock:
+            if self._total is None:
+                self._total = self._scan_size()
+            try:
+                replaced = path.stat().st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp, path)
+            self._total += size - replaced
+            over_budget = self._total > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def get_or_compute(self, key, compute, refresh=False):
+        """
+        Return the cached value of a key, computing and storing it if needed
+
+        :param key: key of the entry, see expression_key
+        :param compute: function without argument returning the value
+        :param refresh: recompute and overwrite the entry even if it is valid
+        """
+        if not self.enabled:
+            return compute()
+        if not refresh:
+            value = self.get(key)
+            if value is not None:
+                return value
+        value = compute()
+        if value is not None:
+            self.put(key, value)
+        return value
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in max_bytes
+        """
+        with self._lock:
+            entries = self._entries()
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+                total -= size
+            # Other processes may share the directory, the listing resets the running total
+            self._total = total
+
+    def _entries(self):
+        entries = []
+        for path in self.cache_dir.glob("*/*.pkl"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+
+    def clear(self):
+        with self._lock:
+            for path in self.cache_dir.glob("*/*.pkl"):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            self._total = 0
+
+
+_default_cache = None
+
+
+def default_cache():
+    """
+    Return the cache shared by the process, under METHANE_EE_CACHE_DIR
+    """
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResultCache()
+    return _default_cache
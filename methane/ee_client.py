@@ -0,0 +1,231 @@
+"""
+Earth Engine client
+------------------------------
+
+Shared client for Earth Engine requests: a bounded pool of workers, a token bucket
+limiting the request rate, exponential backoff on transient errors (429, 5xx, connection errors)
+and coalescing of identical requests in flight
+
+    from methane.ee_client import get_info
+    features = get_info(fc)
+
+    future = default_client().get_info_async(fc)
+"""
+import json
+import logging
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from methane.ee_cache import default_cache, expression_key
+
+logger = logging.getLogger(__name__)
+
+TRANSIENT_STATUS = {429, 500, 502, 503, 504}
+# Status codes in the message of errors without response, e.g. ee.EEException
+TRANSIENT_MESSAGE = re.compile(
+    r"\b(429|50[0234])\b|too many requests|rate limit|service unavailable|backend error|"
+    r"internal error|deadline exceeded|connection (reset|aborted|refused)",
+    re.IGNORECASE,
+)
+# Limits of the computation itself, which fail again on every attempt
+PERMANENT_MESSAGE = re.compile(
+    r"computation timed out|memory limit exceeded|out of memory|accumulating over \d+ elements|"
+    r"too many (pixels|elements|features)|maxpixels",
+    re.IGNORECASE,
+)
+
+
+def is_transient(error):
+    """
+    Whether an error of an Earth Engine request is worth retrying
+
+    The HTTP status of the response decides when the error has one (HttpError). Otherwise
+    only rate limiting, 5xx status codes and connection errors are retried: Earth Engine
+    computation timeouts and memory or element limits fail the same way every time.
+
+    :param error: exception raised by the request
+    :return: bool
+    """
+    status = getattr(getattr(error, "resp", None), "status", None)
+    if status is not None:
+        return int(status) in TRANSIENT_STATUS
+    message = str(error)
+    if PERMANENT_MESSAGE.search(message):
+        return False
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    return bool(TRANSIENT_MESSAGE.search(message))
+
+
+class TokenBucket:
+    """
+    Token bucket: `rate` tokens per second, at most `capacity` accumulated
+
+    :param rate: tokens added per second
+    :param capacity: maximum number of tokens, the size of a burst
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1., rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Take a token, waiting until one is available
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class EEClient:
+    """
+    Runs Earth Engine requests on a bounded pool with rate limiting, retries and coalescing
+
+    :param max_workers: maximum number of requests in flight
+    :param rate: maximum number of requests started per second
+    :param burst: number of requests that can start at once after an idle period
+    :param retries: number of attempts of a request failing with a transient error
+    :param backoff: seconds before the first retry, doubled at each retry, with jitter
+    :param max_backoff: maximum seconds between two attempts
+    """
+
+    def __init__(self, max_workers=8, rate=10., burst=None, retries=5, backoff=1., max_backoff=60.):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="ee")
+        self.bucket = TokenBucket(rate, burst)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def call(self, fn, *args, **kwargs):
+        """
+        Run a request in the current thread, rate limited and retried on transient errors
+        """
+        for attempt in range(self.retries):
+            self.bucket.acquire()
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                if attempt == self.retries - 1 or not is_transient(e):
+                    raise
+                delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(.5, 1.)
+                logger.warning("Transient Earth Engine error, retrying in %.1fs (%d/%d): %s",
+                               delay, attempt + 1, self.retries, e)
+                time.sleep(delay)
+
+    def submit(self, fn, *args, key=None, **kwargs):
+        """
+        Run a request on the pool
+
+        :param key: optional key of the request, a request submitted while another one with
+            the same key is in flight gets the future of the latter
+        :return: concurrent.futures.Future
+        """
+        return self._spawn(lambda: self.call(fn, *args, **kwargs), key)
+
+    def _spawn(self, task, key):
+        if key is None:
+            return self.executor.submit(task)
+
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                return future
+            future = self.executor.submit(task)
+            self._inflight[key] = future
+        future.add_done_callback(lambda _: self._forget(key, future))
+        return future
+
+    def _forget(self, key, future):
+        with self._lock:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def get_info_async(self, obj, cache=None, refresh=False):
+        """
+        obj.getInfo() on the pool, through the result cache (see methane.ee_cache)
+
+        :param obj: ee.ComputedObject, or any object exposing serialize() and getInfo()
+        :param cache: methane.ee_cache.ResultCache, defaults to the shared one
+        :param refresh: recompute and overwrite the cached result
+        :return: concurrent.futures.Future
+        """
+        if not hasattr(obj, "serialize"):
+            return self.submit(obj.getInfo)
+        key = expression_key(obj, "getInfo")
+        cache = cache or default_cache()
+
+        # Only requests missing from the cache take a token
+        def compute():
+            return cache.get_or_compute(key, lambda: self.call(obj.getInfo), refresh=refresh)
+
+        return self._spawn(compute, key)
+
+    def get_info(self, obj, cache=None, refresh=False):
+        return self.get_info_async(obj, cache, refresh).result()
+
+    def get_map_id_async(self, image, vis_params=None):
+        """
+        image.getMapId(vis_params) on the pool
+
+        :return: concurrent.futures.Future of the map id dict
+        """
+        key = expression_key(image, "getMapId" + json.dumps(vis_params or {}, sort_keys=True))
+        return self.submit(image.getMapId, vis_params, key=key)
+
+    def get_map_id(self, image, vis_params=None):
+        return self.get_map_id_async(image, vis_params).result()
+
+    def map(self, fn, items):
+        """
+        fn applied to every item on the pool, results in the order of the items
+        """
+        return [f.result() for f in [self.submit(fn, item) for item in items]]
+
+
+_default_client = None
+_default_lock = threading.Lock()
+
+
+def default_client():
+    """
+    Return the client shared by the process
+    """
+    global _default_client
+    with _default_lock:
+        if _default_client is None:
+            _default_client = EEClient()
+        return _default_client
+
+
+def get_info(obj, cache=None, refresh=False):
+    """
+    obj.getInfo() through the shared client and result cache
+
+    :param obj: ee.ComputedObject, or any object exposing getInfo()
+    :param cache: methane.ee_cache.ResultCache, defaults to the shared one
+    :param refresh: recompute and overwrite the cached result
+    """
+    return default_client().get_info(obj, cache, refresh)
+
+
+def get_map_id(image, vis_params=None):
+    """
+    image.getMapId(vis_params) through the shared client
+    """
+    return default_client().get_map_id(image, vis_params)
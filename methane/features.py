@@ -0,0 +1,101 @@
+"""
+Feature collections
+------------------------------
+
+Download Earth Engine feature collections and decode them into geopandas dataframes
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+import shapely.geometry
+from shapely import GeometryType
+
+from methane.ee_client import get_info
+
+
+def _coordinates(rings):
+    return np.concatenate([np.asarray(ring, dtype=float)[:, :2] for ring in rings])
+
+
+def _offsets(sizes):
+    return np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+
+
+def geojson_to_geometries(geometries):
+    """
+    Build shapely geometries from GeoJSON geometry dicts
+
+    Polygons and MultiPolygons, the output of reduceToVectors, are built in bulk from
+    ragged coordinate arrays, other geometry types one by one.
+
+    :param geometries: list of GeoJSON geometry dicts (or None)
+    :return: np.ndarray of shapely geometries
+    """
+    geometries = list(geometries)
+    result = np.full(len(geometries), None, dtype=object)
+    types = np.array([g["type"] if g else None for g in geometries], dtype=object)
+
+    polygons = np.flatnonzero(types == "Polygon")
+    if len(polygons):
+        rings = [ring for i in polygons for ring in geometries[i]["coordinates"]]
+        result[polygons] = shapely.from_ragged_array(
+            GeometryType.POLYGON,
+            _coordinates(rings),
+            (_offsets([len(ring) for ring in rings]),
+             _offsets([len(geometries[i]["coordinates"]) for i in polygons])),
+        )
+
+    multipolygons = np.flatnonzero(types == "MultiPolygon")
+    if len(multipolygons):
+        parts = [part for i in multipolygons for part in geometries[i]["coordinates"]]
+        rings = [ring for part in parts for ring in part]
+        result[multipolygons] = shapely.from_ragged_array(
+            GeometryType.MULTIPOLYGON,
+            _coordinates(rings),
+            (_offsets([len(ring) for ring in rings]),
+             _offsets([len(part) for part in parts]),
+             _offsets([len(geometries[i]["coordinates"]) for i in multipolygons])),
+        )
+
+    for i in np.flatnonzero((types != None) & (types != "Polygon") & (types != "MultiPolygon")):  # noqa: E711
+        result[i] = shapely.geometry.shape(geometries[i])
+
+    return result
+
+
+def features_to_gdf(features, crs="EPSG:4326"):
+    """
+    Decode a list of GeoJSON features into a geopandas dataframe
+
+    :param features: list of GeoJSON feature dicts, as returned by getInfo
+    :param crs: coordinate reference system of the geometries
+    :return: gpd.GeoDataFrame
+    """
+    properties = pd.DataFrame.from_records([f.get("properties") or {} for f in features])
+    geometry = geojson_to_geometries([f.get("geometry") for f in features])
+    return gpd.GeoDataFrame(properties, geometry=geometry, crs=crs)
+
+
+def download_features(fc, page_size=None, max_workers=4, cache=None):
+    """
+    Download the features of a collection, in fixed-size pages fetched concurrently
+
+    :param fc: ee.FeatureCollection, or any object exposing getInfo, size and toList
+    :param page_size: number of features per request, None to download everything in one request
+    :param max_workers: maximum number of pages downloaded at the same time
+    :param cache: methane.ee_cache.ResultCache of the requests, defaults to the shared one
+    :return: list of gpd.GeoDataFrame, one per page
+    """
+    if page_size is None:
+        return [features_to_gdf(get_info(fc, cache)["features"])]
+
+    count = get_info(fc.size(), cache)
+
+    def page(offset):
+        return features_to_gdf(get_info(fc.toList(page_size, offset), cache))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(page, range(0, count, page_size)))
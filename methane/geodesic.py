@@ -0,0 +1,179 @@
+"""
+Geodesic computations
+------------------------------
+
+Distances and areas in metres for geometries in EPSG:4326, vectorized over whole arrays
+
+Coordinates follow the library convention: geometries are x=lng, y=lat while the
+functions taking scalar coordinates take lat before lng.
+"""
+import numpy as np
+import shapely
+
+# Mean and authalic radius of the earth, in metres
+EARTH_RADIUS = 6371008.8
+AUTHALIC_RADIUS = 6371007.2
+
+# WGS84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_B = WGS84_A * (1 - WGS84_F)
+
+
+def haversine(lat1, lng1, lat2, lng2):
+    """
+    Great-circle distance between points on a sphere
+
+    :param lat1: latitudes of the first points, in degrees
+    :param lng1: longitudes of the first points, in degrees
+    :param lat2: latitudes of the second points, in degrees
+    :param lng2: longitudes of the second points, in degrees
+    :return: np.ndarray of distances in metres, broadcast from the inputs
+    """
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(a, dtype=float)) for a in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+
+def vincenty(lat1, lng1, lat2, lng2, max_iter=200, tol=1e-12):
+    """
+    Distance between points on the WGS84 ellipsoid (Vincenty's inverse formula)
+
+    Pairs for which the iteration does not converge (nearly antipodal points) fall back
+    to the haversine distance.
+
+    :param lat1: latitudes of the first points, in degrees
+    :param lng1: longitudes of the first points, in degrees
+    :param lat2: latitudes of the second points, in degrees
+    :param lng2: longitudes of the second points, in degrees
+    :return: np.ndarray of distances in metres, broadcast from the inputs
+    """
+    lat1, lng1, lat2, lng2 = np.broadcast_arrays(*(np.asarray(a, dtype=float) for a in (lat1, lng1, lat2, lng2)))
+    f = WGS84_F
+    L = np.radians(lng2 - lng1)
+    U1 = np.arctan((1 - f) * np.tan(np.radians(lat1)))
+    U2 = np.arctan((1 - f) * np.tan(np.radians(lat2)))
+    sin_U1, cos_U1, sin_U2, cos_U2 = np.sin(U1), np.cos(U1), np.sin(U2), np.cos(U2)
+
+    lam = L.copy()
+    converged = np.zeros(lam.shape, dtype=bool)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for _ in range(max_iter):
+            sin_lam, cos_lam = np.sin(lam), np.cos(lam)
+            sin_sigma = np.hypot(cos_U2 * sin_lam, cos_U1 * sin_U2 - sin_U1 * cos_U2 * cos_lam)
+            cos_sigma = sin_U1 * sin_U2 + cos_U1 * cos_U2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            sin_alpha = np.where(sin_sigma == 0, 0., cos_U1 * cos_U2 * sin_lam / sin_sigma)
+            cos2_alpha = 1 - sin_alpha ** 2
+            cos_2sigma_m = np.where(cos2_alpha == 0, 0., cos_sigma - 2 * sin_U1 * sin_U2 / cos2_alpha)
+            C = f / 16 * cos2_alpha * (4 + f * (4 - 3 * cos2_alpha))
+            lam_prev = lam
+            lam = L + (1 - C) * f * sin_alpha * (
+                sigma + C * sin_sigma * (cos_2sigma_m + C * cos_sigma * (-1 + 2 * cos_2sigma_m ** 2))
+            )
+            converged = np.abs(lam - lam_prev) <= tol
+            if converged.all():
+                break
+
+        u2 = cos2_alpha * (WGS84_A ** 2 - WGS84_B ** 2) / WGS84_B ** 2
+        A = 1 + u2 / 16384 * (4096 + u2 * (-768 + u2 * (320 - 175 * u2)))
+        B = u2 / 1024 * (256 + u2 * (-128 + u2 * (74 - 47 * u2)))
+        delta_sigma = B * sin_sigma * (cos_2sigma_m + B / 4 * (
+            cos_sigma * (-1 + 2 * cos_2sigma_m ** 2)
+            - B / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma ** 2) * (-3 + 4 * cos_2sigma_m ** 2)
+        ))
+        distance = WGS84_B * A * (sigma - delta_sigma)
+
+    return np.where(converged, distance, haversine(lat1, lng1, lat2, lng2))
+
+
+def point_to_lines_distance(lat, lng, lines):
+    """
+    Distance from each point to the matching (multi)line string
+
+    Every segment is projected in a local equirectangular frame centred on its point to
+    find the closest location, which is then measured with the haversine formula.
+
+    :param lat: latitudes of the points, in degrees
+    :param lng: longitudes of the points, in degrees
+    :param lines: array of shapely (multi)line strings, same length as the points
+    :return: np.ndarray of distances in metres, NaN for missing or empty lines
+    """
+    lat = np.asarray(lat, dtype=float)
+    lng = np.asarray(lng, dtype=float)
+    lines = np.asarray(lines, dtype=object)
+    result = np.full(len(lines), np.nan)
+
+    parts, line_of_part = shapely.get_parts(lines, return_index=True)
+    coords, part_of_coord = shapely.get_coordinates(parts, return_index=True)
+    if len(coords) < 2:
+        return result
+
+    # Segments join consecutive vertices of the same part
+    start = np.flatnonzero(part_of_coord[:-1] == part_of_coord[1:])
+    owner = line_of_part[part_of_coord[start]]
+    lat0, lng0 = lat[owner], lng[owner]
+    scale = np.cos(np.radians(lat0))
+
+    def wrap(dlng):
+        return (dlng + 180) % 360 - 180
+
+    # The end of a segment is placed relative to its start, so both ends stay on the same
+    # side of the antimeridian of the point
+    a, b = coords[start], coords[start + 1]
+    dlng_a = wrap(a[:, 0] - lng0)
+    ax, ay = dlng_a * scale, a[:, 1] - lat0
+    bx, by = (dlng_a + wrap(b[:, 0] - a[:, 0])) * scale, b[:, 1] - lat0
+    dx, dy = bx - ax, by - ay
+    length2 = dx ** 2 + dy ** 2
+    with np.errstate(invalid="ignore", divide="ignore"):
+        t = np.clip(np.where(length2 > 0, -(ax * dx + ay * dy) / length2, 0.), 0, 1)
+    px, py = ax + t * dx, ay + t * dy
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        closest_lng = lng0 + np.where(scale > 0, px / scale, 0.)
+    distance = haversine(lat0, lng0, lat0 + py, closest_lng)
+
+    np.fmin.at(result, owner, distance)
+    return result
+
+
+def geodesic_distance(geometries_a, geometries_b):
+    """
+    Distance between pairs of geometries, measured between their closest points
+
+    Closest points are found in planar lng/lat and their distance is then measured with
+    the haversine formula, which is accurate for the few-kilometres distances used to
+    link hotspots and infrastructure.
+
+    :param geometries_a: array of shapely geometries
+    :param geometries_b: array of shapely geometries, same length
+    :return: np.ndarray of distances in metres, NaN where a geometry is missing
+    """
+    lines = shapely.shortest_line(np.asarray(geometries_a, dtype=object), np.asarray(geometries_b, dtype=object))
+    result = np.full(len(lines), np.nan)
+    valid = ~(shapely.is_missing(lines) | shapely.is_empty(lines))
+    coords = shapely.get_coordinates(lines[valid]).reshape(-1, 2, 2)
+    result[valid] = haversine(coords[:, 0, 1], coords[:, 0, 0], coords[:, 1, 1], coords[:, 1, 0])
+    return result
+
+
+def geodesic_area(geometries):
+    """
+    Area of polygons in square metres
+
+    Polygons are projected with the Lambert cylindrical equal-area projection on the
+    authalic sphere, which is exact for edges along meridians and parallels such as
+    the pixel outlines of vectorized rasters.
+
+    :param geometries: array of shapely geometries
+    :return: np.ndarray of areas in m2, NaN for missing geometries
+    """
+    def equal_area(coords):
+        return np.column_stack([
+            AUTHALIC_RADIUS * np.radians(coords[:, 0]),
+            AUTHALIC_RADIUS * np.sin(np.radians(coords[:, 1])),
+        ])
+
+    projected = shapely.transform(np.asarray(geometries, dtype=object), equal_area)
+    return shapely.area(projected)
@@ -0,0 +1,295 @@
+"""
+Hotspot history
+------------------------------
+
+Append-only archive of the daily detections, linked across days into tracks
+
+    <root>/detections/run_date=YYYY-MM-DD/hotspots.parquet   detections of a run with their track
+    <root>/tracks.parquet                                    one row per track
+
+A detection continues a track when it overlaps, or lies within `link_distance` metres of, the
+last footprint of a track seen in the previous `max_gap_days` days. The tracks are held
+in memory with a spatial index and sorted dates, so queries do not touch the detections.
+"""
+import logging
+import shutil
+import threading
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+from methane.geodesic import EARTH_RADIUS, geodesic_distance
+from methane.output import (
+    PARQUET_NAME, partition_path, read_geoparquet, read_hotspots, run_dates, write_geoparquet, write_hotspots
+)
+
+logger = logging.getLogger(__name__)
+
+DETECTIONS_DIR = "detections"
+TRACKS_NAME = "tracks.parquet"
+
+TRACK_COLUMNS = ["track_id", "first_seen", "last_seen", "n_detections", "max_criticality"]
+
+
+def _day(date):
+    return np.datetime64(date, "D")
+
+
+def _windows(geometries, distance):
+    # Boxes in degrees containing every point within distance metres of the geometries,
+    # as methane.render.window for points
+    bounds = shapely.bounds(geometries)
+    dlat = np.degrees(distance / EARTH_RADIUS)
+    south, north = np.maximum(bounds[:, 1] - dlat, -90.), np.minimum(bounds[:, 3] + dlat, 90.)
+    cos_lat = np.cos(np.radians(np.maximum(np.abs(south), np.abs(north))))
+    with np.errstate(divide="ignore"):
+        dlng = np.where(cos_lat > 0, dlat / cos_lat, 180.)
+    dlng = np.minimum(dlng, 180.)
+    return shapely.box(bounds[:, 0] - dlng, south, bounds[:, 2] + dlng, north)
+
+
+def link_detections(detections, tracks, link_distance=5000.):
+    """
+    Match detections to the track they overlap the most, or else to the closest one in range
+
+    :param detections: array of shapely geometries
+    :param tracks: array of shapely geometries, the last footprints of the candidate tracks
+    :param link_distance: maximum distance in metres between a detection and a track, see methane.geodesic
+    :return: np.ndarray with the position of the matched track of every detection, -1 if none
+    """
+    detections = np.asarray(detections, dtype=object)
+    tracks = np.asarray(tracks, dtype=object)
+    match = np.full(len(detections), -1)
+    if not len(detections) or not len(tracks):
+        return match
+
+    # Candidates in a window around each detection, then measured on the sphere
+    detection, track = shapely.STRtree(tracks).query(_windows(detections, link_distance), predicate="intersects")
+    distance = geodesic_distance(detections[detection], tracks[track])
+    in_range = distance <= link_distance
+    detection, track, distance = detection[in_range], track[in_range], distance[in_range]
+    if not len(detection):
+        return match
+    overlap = shapely.area(shapely.intersection(detections[detection], tracks[track]))
+    # Largest overlap first, then smallest distance
+    order = np.lexsort((distance, -overlap, detection))
+    detection, track = detection[order], track[order]
+    first = np.r_[True, detection[1:] != detection[:-1]]
+    match[detection[first]] = track[first]
+    return match
+
+
+class HotspotHistory:
+    """
+    Archive of the detections of every run and of the tracks linking them
+
+    Runs are appended in chronological order by a single writer. Appending the last run
+    again is idempotent: the same detections are skipped, different ones replace the run.
+    Readers in other processes pick up new runs through refresh.
+
+    :param root: directory of the archive
+    :param link_distance: maximum distance in metres between a detection and the track it continues
+    :param max_gap_days: number of days without detection after which a track is not continued
+    """
+
+    def __init__(self, root, link_distance=5000., max_gap_days=7):
+        self.root = Path(root)
+        self.link_distance = link_distance
+        self.max_gap_days = max_gap_days
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._load()
+
+    @property
+    def tracks_path(self):
+        return self.root / TRACKS_NAME
+
+    @property
+    def detections_root(self):
+        return self.root / DETECTIONS_DIR
+
+    def _load(self):
+        if self.tracks_path.exists():
+            self._mtime = self.tracks_path.stat().st_mtime_ns
+            tracks = read_geoparquet(self.tracks_path)
+        else:
+            self._mtime = None
+            tracks = gpd.GeoDataFrame({c: [] for c in TRACK_COLUMNS}, geometry=[], crs="EPSG:4326")
+        self._index(tracks)
+
+    def _index(self, tracks):
+        tracks = tracks.reset_index(drop=True)
+        self.tracks = tracks
+        self._geometries = np.asarray(tracks.geometry.values, dtype=object)
+        self._tree = shapely.STRtree(self._geometries)
+        self._first_seen = tracks["first_seen"].to_numpy().astype("datetime64[D]")
+        self._last_seen = tracks["last_seen"].to_numpy().astype("datetime64[D]")
+
+    def refresh(self):
+        """
+        Reload the tracks if another process appended runs since they were loaded
+        """
+        mtime = self.tracks_path.stat().st_mtime_ns if self.tracks_path.exists() else None
+        if mtime != self._mtime:
+            with self._lock:
+                self._load()
+
+    def run_dates(self):
+        return run_dates(self.detections_root)
+
+    def append(self, hotspots, run_date):
+        """
+        Archive the detections of a run and link them to the existing tracks
+
+        A rerun of the last archived run (a retry of the daily job) is skipped when its
+        detections are unchanged, and replaces the archived run otherwise.
+
+        :param hotspots: gpd.GeoDataFrame of hotspots, e.g. from hotspots_as_gdf
+        :param run_date: date of the run (str: 'YYYY-MM-dd'), not earlier than the archived runs
+        :return: the detections with their `track_id`
+        """
+        with self._lock:
+            dates = self.run_dates()
+            if dates and run_date < dates[-1]:
+                raise ValueError(f"Run {run_date} is earlier than the last archived run {dates[-1]}")
+            if dates and run_date == dates[-1]:
+                archived = self._archived(run_date)
+                if self._linked(run_date) and _same_detections(archived, hotspots):
+                    logger.info("Run %s is already archived", run_date)
+                    return archived
+                logger.info("Replacing the archived run %s", run_date)
+                shutil.rmtree(partition_path(self.detections_root, run_date))
+                self._rebuild()
+            return self._append(hotspots, run_date)
+
+    def _archived(self, run_date):
+        return read_geoparquet(partition_path(self.detections_root, run_date) / PARQUET_NAME)
+
+    def _linked(self, run_date):
+        # Detections are written before the tracks: tracks older than the detections of a
+        # run were not updated with them
+        detections = partition_path(self.detections_root, run_date) / PARQUET_NAME
+        return self.tracks_path.exists() and self.tracks_path.stat().st_mtime_ns >= detections.stat().st_mtime_ns
+
+    def _rebuild(self):
+        """
+        Link again every archived run into tracks, from the detections
+        """
+        self._index(gpd.GeoDataFrame({c: [] for c in TRACK_COLUMNS}, geometry=[], crs="EPSG:4326"))
+        for run_date in self.run_dates():
+            self._append(self._archived(run_date).drop(columns="track_id"), run_date)
+        if not self.run_dates():
+            write_geoparquet(self.tracks, self.tracks_path)
+            self._mtime = self.tracks_path.stat().st_mtime_ns
+
+    def _append(self, hotspots, run_date):
+        tracks = self.tracks
+        geometries = np.asarray(hotspots.geometry.values, dtype=object)
+        day = _day(run_date)
+
+        recent = np.flatnonzero(self._last_seen >= day - np.timedelta64(self.max_gap_days, "D"))
+        match = link_detections(geometries, self._geometries[recent], self.link_distance)
+        new = match < 0
+        next_id = int(tracks["track_id"].max()) + 1 if len(tracks) else 0
+        track_id = np.empty(len(hotspots), dtype=np.int64)
+        track_id[~new] = tracks["track_id"].to_numpy(dtype=np.int64)[recent[match[~new]]]
+        track_id[new] = np.arange(next_id, next_id + new.sum())
+
+        criticality = hotspots["criticality"] if "criticality" in hotspots else pd.Series(np.nan, index=hotspots.index)
+        detections = hotspots.assign(track_id=track_id)
+        seen = (
+            pd.DataFrame({"track_id": track_id, "criticality": criticality.to_numpy(dtype=float)})
+            .assign(geometry=geometries)
+            .groupby("track_id")
+            .agg(n_detections=("criticality", "size"), max_criticality=("criticality", "max"),
+                 geometry=("geometry", lambda g: shapely.union_all(np.asarray(g, dtype=object))))
+        )
+
+        updated = tracks.set_index("track_id")
+        continued = seen.index.intersection(updated.index)
+        updated.loc[continued, "last_seen"] = run_date
+        updated.loc[continued, "n_detections"] = updated.loc[continued, "n_detections"] + seen.loc[continued, "n_detections"]
+        updated.loc[continued, "max_criticality"] = np.fmax(updated.loc[continued, "max_criticality"], seen.loc[continued, "max_criticality"])
+        # The last footprint of a track is the one it is continued from
+        updated.loc[continued, updated.geometry.name] = seen.loc[continued, "geometry"].values
+        started = seen.drop(continued).assign(first_seen=run_date, last_seen=run_date)
+        tracks = gpd.GeoDataFrame(
+            pd.concat([updated.reset_index(), started.reset_index()], ignore_index=True)[TRACK_COLUMNS + ["geometry"]],
+            geometry="geometry", crs="EPSG:4326",
+        ).astype({"track_id": "int64", "n_detections": "int64", "max_criticality": "float64"})
+
+        # Detections first: a crash leaves the run archived but its tracks not updated,
+        # which a rerun detects and repairs instead of silently linking twice
+        write_hotspots(detections, self.detections_root, run_date, formats=("parquet",))
+        write_geoparquet(tracks, self.tracks_path)
+        self._mtime = self.tracks_path.stat().st_mtime_ns
+        self._index(tracks)
+        return detections
+
+    def active_tracks(self, bbox=None, days=90, until=None):
+        """
+        Tracks with a detection in the last `days` days intersecting a bounding box
+
+        :param bbox: optional (west, south, east, north)
+        :param days: length of the period, in days
+        :param until: last day of the period (str: 'YYYY-MM-dd'), defaults to the last archived run
+        :return: gpd.GeoDataFrame of tracks with their duration in days
+        """
+        if not len(self.tracks):
+            return self.tracks.assign(duration_days=[])
+        until = _day(until) if until is not None else self._last_seen.max()
+        since = until - np.timedelta64(days - 1, "D")
+
+        active = (self._last_seen >= since) & (self._first_seen <= until)
+        if bbox is not None:
+            in_bbox = np.zeros(len(active), dtype=bool)
+            in_bbox[self._tree.query(shapely.box(*bbox), predicate="intersects")] = True
+            active &= in_bbox
+        positions = np.flatnonzero(active)
+        return self.tracks.iloc[positions].assign(
+            duration_days=(self._last_seen[positions] - self._first_seen[positions]).astype(int) + 1
+        )
+
+    def track_detections(self, track_id):
+        """
+        Every archived detection of a track
+
+        :param track_id: id of the track
+        :return: gpd.GeoDataFrame of detections with their `run_date`
+        """
+        track = self.tracks[self.tracks["track_id"] == track_id]
+        if track.empty:
+            raise KeyError(track_id)
+        track = track.iloc[0]
+        detections = read_hotspots(
+            self.detections_root, start_date=track["first_seen"], end_date=track["last_seen"],
+        )
+        return detections[detections["track_id"] == track_id].reset_index(drop=True)
+
+
+def append_run(root, hotspots, run_date, **kwargs):
+    """
+    Archive the detections of a run in the history under root
+
+    :return: the detections with their `track_id`
+    """
+    return HotspotHistory(root, **kwargs).append(hotspots, run_date)
+
+
+def _same_detections(archived, hotspots):
+    """
+    Whether archived detections are the given hotspots, whatever their order
+    """
+    if len(archived) != len(hotspots):
+        return False
+    geometries = [np.sort(shapely.to_wkb(shapely.normalize(np.asarray(df.geometry.values, dtype=object)), hex=True))
+                  for df in (archived, hotspots)]
+    if not np.array_equal(*geometries):
+        return False
+    if "criticality" not in hotspots:
+        return True
+    criticality = [np.sort(df["criticality"].to_numpy(dtype=float)) for df in (archived, hotspots)]
+    return np.allclose(*criticality, equal_nan=True)
@@ -1,7 +1,13 @@
+import os
+from pathlib import Path
+
 import pandas as pd
 import numpy as np
 import geopandas as gpd
 
+from methane.routes import parse_routes
+from methane.store import load_compiled
+
 RENAME = {
     "latitude": 'lat',
     "longitude": 'lng',
@@ -9,25 +15,107 @@ RENAME = {
     'plant:source': 'plant_source'
 }
 
-BASE_PATH = "/mounted/data/"
+BASE_PATH = os.environ.get("METHANE_DATA_PATH", "/mounted/data/")
+
+COAL_MINES_CSV = "coal-mine-infrastructure-dataset.csv"
+FOSSIL_PIPELINES_CSV = "fossil-pipelines-infrastructure-dataset.csv"
+STEEL_PLANTS_CSV = "steel-plant-infrastructure-dataset.csv"
+POWER_PLANTS_CSV = "power-plant-infrastructure-dataset.csv"
+
+DIRTY_POWER_PLANTS = ['gas', 'oil', 'coal', 'oil;gas',
+                      'gas;oil', 'biogas', 'abandoned_mine_methane;oil']
+
+# Columns used by the pipeline and the web app, read with these dtypes in compact mode.
+# "bool" columns are OSM yes/no tags, free text columns (None) are kept as read.
+SCHEMAS = {
+    "coal_mines": {
+        "project": None, "owner": None, "operator": None, "status": "category",
+        "type": "category", "country": "category", "region": "category", "url": None,
+        "lat": "float32", "lng": "float32",
+    },
+    "steel_plants": {
+        "project": None, "owner": None, "status": "category", "country": "category",
+        "region": "category", "url": None, "lat": "float32", "lng": "float32",
+    },
+    "power_plants": {
+        "name": None, "operator": None, "plant:source": "category", "proposed": "bool",
+        "underground": "bool", "wikipedia": None, "latitude": "float32", "longitude": "float32",
+    },
+    # Pipelines are read from their compiled geometries, after renaming
+    "pipelines": {
+        "name": None, "owner": None, "status": "category", "countries": None,
+        "type": "category", "url": None, "asset_type": "category", "asset_id": None,
+        "route_error": None,
+    },
+}
+
+
+def asset_ids(dataset):
+    """
+    Stable identifier of each asset of a snapshot: asset type and row in the source dataset
+    """
+    return dataset.asset_type + "/" + dataset.index.astype(str)
+
+
+def osm_flag(dataset, tag):
+    """
+    Return an OSM yes/no tag as booleans, False where the tag is missing
+    """
+    if tag not in dataset:
+        return pd.Series(False, index=dataset.index)
+    if dataset[tag].dtype == bool:
+        return dataset[tag]
+    return dataset[tag].eq('yes')
+
+
+def apply_schema(dataset, schema):
+    """
+    Cast the columns of a dataset to the dtypes of its schema, adding missing columns as empty
+    """
+    columns = {}
+    for column, dtype in schema.items():
+        if dtype == "bool":
+            columns[column] = osm_flag(dataset, column)
+        elif column not in dataset:
+            columns[column] = pd.Series(np.nan, index=dataset.index, dtype=dtype or object)
+        elif dtype is not None:
+            columns[column] = dataset[column].astype(dtype)
+    return dataset.assign(**columns)
+
 
+def read_dataset(file_name, build=None, name="raw", base_path=None, schema=None, filters=None):
+    """
+    Read a dataset from its compiled artifact, see methane.store
+
+    :param file_name: name of the source CSV
+    :param base_path: directory of the datasets, defaults to BASE_PATH
+    :param schema: optional {column: dtype} mapping, only these columns are read (see SCHEMAS)
+    :param filters: optional row filters pushed down to the reader
+    """
+    columns = list(schema) if schema is not None else None
+    dataset = load_compiled(Path(base_path or BASE_PATH, file_name), build=build, name=name, columns=columns, filters=filters)
+    return apply_schema(dataset, schema) if schema is not None else dataset
+
+
+def load_coal_mines(base_path=None, compact=False):
+    dataset = read_dataset(COAL_MINES_CSV, base_path=base_path, schema=SCHEMAS["coal_mines"] if compact else None).assign(asset_type="coal_mine")
+    return dataset.rename(columns=RENAME).assign(asset_id=asset_ids)
 
-def load_coal_mines():
-    dataset = pd.read_csv(BASE_PATH + "coal-mine-infrastructure-dataset.csv").assign(asset_type="coal_mine")
-    return dataset.rename(columns=RENAME)
 
+def load_fossil_pipelines(base_path=None):
+    return _fossil_pipelines(read_dataset(FOSSIL_PIPELINES_CSV, base_path=base_path))
 
-def load_fossil_pipelines():
-    dataset = pd.read_csv(BASE_PATH + "fossil-pipelines-infrastructure-dataset.csv").assign(asset_type="fossil")
-    return dataset.rename(columns=RENAME)
 
+def _fossil_pipelines(dataset):
+    return dataset.assign(asset_type="fossil").rename(columns=RENAME).assign(asset_id=asset_ids)
 
-def load_steel_plants():
-    dataset = pd.read_csv(BASE_PATH + "steel-plan-infrastructure-dataset.csv").assign(asset_type="steel-plant")
-    return dataset.rename(columns=RENAME)
 
+def load_steel_plants(base_path=None, compact=False):
+    dataset = read_dataset(STEEL_PLANTS_CSV, base_path=base_path, schema=SCHEMAS["steel_plants"] if compact else None).assign(asset_type="steel-plant")
+    return dataset.rename(columns=RENAME).assign(asset_id=asset_ids)
 
-def load_power_plants():
+
+def load_power_plants(base_path=None, compact=False):
     """
     source: https://wiki.openstreetmap.org/wiki/Tag:power%3Dplant
     Plant sources available:
@@ -35,53 +123,62 @@ def load_power_plants():
        'solar;diesel', 'solar', 'oil;gas', 'biomass;oil', 'biomass',
        'gas;oil', 'biogas', 'nuclear', 'battery',
        'abandoned_mine_methane;oil'
+
+    In compact mode only the schema columns are read and the plant source filter is
+    applied while reading.
     """
-    DIRTY_POWER_PLANTS = ['gas', 'oil', 'coal', 'oil;gas',
-       'gas;oil', 'biogas', 'abandoned_mine_methane;oil']
-    dataset = pd.read_csv(BASE_PATH + "power-plant-infrastructure-dataset.csv")
+    if compact:
+        dataset = read_dataset(POWER_PLANTS_CSV, base_path=base_path, schema=SCHEMAS["power_plants"],
+                               filters=[("plant:source", "in", DIRTY_POWER_PLANTS)])
+    else:
+        dataset = read_dataset(POWER_PLANTS_CSV, base_path=base_path).dropna(axis=1, how="all")
     dataset = (dataset
         .rename(columns=RENAME)
-        .dropna(axis=1, how="all")
         .rename(columns={'plant:source': 'plant_source'})
         .assign(asset_type="power_plant")
+        .assign(asset_id=asset_ids)
         .query("plant_source in @DIRTY_POWER_PLANTS")
+        .assign(underground=lambda s: osm_flag(s, 'underground'))
+        .assign(proposed=lambda s: osm_flag(s, 'proposed'))
         # matches coal mine dataset
-        .assign(type= lambda s: np.where(s.underground == 'yes', 'underground', "surface"))
+        .assign(type= lambda s: np.where(s.underground, 'underground', "surface"))
     )
     return dataset
 
 
-def pipelines_as_gdf():
+def pipelines_as_gdf(base_path=None, compact=False):
     """
-    Return pipelines as geodataframes
+    Return pipelines as geodataframes, geometries are compiled once per version of the dataset
+
+    Geometries are in lng, lat like the rest of the infrastructure, see methane.routes
     """
-    from shapely import wkt
-    def wkt_loads(x):
-        try:
-            return wkt.loads(x)
-        except Exception:
-            return None
-    df_fossil_pipelines = load_fossil_pipelines().query("route==route")
-    # Manual transform to line string: 
-    # Input 43.5995, 16.3946: 43.6098, 16.5395:
-    # Output: LINESTRING (30 10, 10 30, 40 40)
-    df_fossil_pipelines['route'] = 'LINESTRING (' + df_fossil_pipelines['route'].str.replace(',', '').str.replace(':', ',') + ')'
-    df_fossil_pipelines['route'] = df_fossil_pipelines['route'].apply(wkt_loads)
-    return gpd.GeoDataFrame(df_fossil_pipelines, geometry=df_fossil_pipelines['route'])
+    return read_dataset(FOSSIL_PIPELINES_CSV, build=_build_pipelines, name="pipeline_routes",
+                        base_path=base_path, schema=SCHEMAS["pipelines"] if compact else None)
+
+
+def _build_pipelines(dataset):
+    df_fossil_pipelines = _fossil_pipelines(dataset).query("route==route")
+    # Input 43.5995, 16.3946: 43.6098, 16.5395; ...
+    # Output: LINESTRING / MULTILINESTRING in lng, lat, malformed routes are reported in route_error
+    geometries, errors = parse_routes(df_fossil_pipelines['route'])
+    df_fossil_pipelines = df_fossil_pipelines.assign(route=geometries, route_error=errors)
+    return gpd.GeoDataFrame(df_fossil_pipelines, geometry='route')
 
 
-def plants_as_gdf():
+def plants_as_gdf(base_path=None, compact=False):
     """
     Return coal mines an power plant as geopandas dataframe
+
+    In compact mode low-cardinality columns are categorical and coordinates float32
     """
     COLUMNS_TO_KEEP = [
         "name", "lat", "lng", "owner","status", "operator",
-         "country", "region", "url", "asset_type"
+         "country", "region", "url", "asset_type", "asset_id"
     ]
     # Keep only points
-    df_coal_mines = load_coal_mines()[COLUMNS_TO_KEEP]
+    df_coal_mines = load_coal_mines(base_path, compact)[COLUMNS_TO_KEEP]
     df_plants = (
-        load_power_plants()
+        load_power_plants(base_path, compact)
          .assign(country = "")
         .assign(region= "")
         .assign(owner= "")
@@ -90,6 +187,25 @@ def plants_as_gdf():
         [COLUMNS_TO_KEEP]
     )
     df_merged = pd.concat([df_plants, df_coal_mines])
+    if compact:
+        df_merged = df_merged.astype({column: "category" for column in ["status", "country", "region", "asset_type"]})
     return gpd.GeoDataFrame(
         df_merged, geometry=gpd.points_from_xy(df_merged.lng, df_merged.lat)
     )
+
+
+def compile_infrastructure(base_path=None):
+    """
+    Compile every infrastructure dataset, to run as a build step before deploying
+    """
+    for file_name in (COAL_MINES_CSV, FOSSIL_PIPELINES_CSV, STEEL_PLANTS_CSV, POWER_PLANTS_CSV):
+        if Path(base_path or BASE_PATH, file_name).exists():
+            read_dataset(file_name, base_path=base_path)
+    pipelines_as_gdf(base_path)
+
+
+def infrastructure_files(base_path=None):
+    """
+    Return the source files the plants and pipelines are built from
+    """
+    return [Path(base_path or BASE_PATH, file_name) for file_name in (COAL_MINES_CSV, POWER_PLANTS_CSV, FOSSIL_PIPELINES_CSV)]
@@ -0,0 +1,253 @@
+"""
+Local hotspot detection
+------------------------------
+
+The detection algorithm of methane.methane_hotspots applied to in-memory or archived
+rasters with NumPy and SciPy, without Earth Engine
+
+Rasters are 2D arrays of mean methane in EPSG:4326, NaN where there is no observation,
+located by a transform (west, north, pixel_width, pixel_height) in degrees.
+"""
+from concurrent.futures import ProcessPoolExecutor
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import ndimage
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+from methane.geodesic import AUTHALIC_RADIUS
+from methane.tiling import merge_seams
+
+# Parameters of methane_hotspots
+KERNEL_RADIUS = 20
+THRESHOLD = 70
+CONNECTEDNESS_RADIUS = 10
+MAX_SIZE = 128
+MIN_AREA = 10
+
+# Upper bound on the size of the neighbourhood windows materialised at once, in values
+_WINDOW_CHUNK = 2 ** 23
+
+
+def read_raster(path):
+    """
+    Read a raster archived with save_raster
+
+    :param path: path of a .npz file
+    :return: (image, transform)
+    """
+    with np.load(path) as archive:
+        return archive["ch4"], tuple(archive["transform"].tolist())
+
+
+def save_raster(path, image, transform):
+    """
+    Archive a raster as a .npz file
+
+    :param path: path of the file
+    :param image: 2D array of mean methane, NaN where masked
+    :param transform: (west, north, pixel_width, pixel_height) in degrees
+    """
+    np.savez_compressed(path, ch4=np.asarray(image, dtype=np.float32), transform=np.asarray(transform, dtype=float))
+
+
+def median_difference(image, radius=KERNEL_RADIUS):
+    """
+    Difference between each pixel and the median of its square neighbourhood
+
+    Masked pixels are ignored by the median, as reduceNeighborhood does.
+
+    :param image: 2D array, NaN where masked
+    :param radius: radius of the square kernel, in pixels
+    :return: 2D array of float32, NaN where the image is masked
+    """
+    image = np.asarray(image, dtype=np.float32)
+    padded = np.pad(image, radius, constant_values=np.nan)
+    size = 2 * radius + 1
+    windows = sliding_window_view(padded, (size, size))
+
+    smooth = np.full(image.shape, np.nan, dtype=np.float32)
+    rows = max(1, _WINDOW_CHUNK // (size * size * max(image.shape[1], 1)))
+    for start in range(0, image.shape[0], rows):
+        valid = ~np.isnan(image[start:start + rows])
+        if not valid.any():
+            continue
+        # Only the neighbourhoods of observed pixels are needed
+        block = windows[start:start + rows][valid].reshape(-1, size * size)
+        smooth[start:start + rows][valid] = _nanmedian_rows(block)
+    return image - smooth
+
+
+def _nanmedian_rows(values):
+    # np.nanmedian falls back to a Python loop over rows on wide arrays, sorting
+    # puts the NaNs last so the median is read at positions depending on the count
+    values = np.sort(values, axis=1)
+    count = np.count_nonzero(~np.isnan(values), axis=1)
+    rows = np.arange(len(values))
+    return (values[rows, (count - 1) // 2] + values[rows, count // 2]) / 2
+
+
+def _median_difference_tile(args):
+    image, radius = args
+    return median_difference(image, radius)
+
+
+def tiled_median_difference(image, radius=KERNEL_RADIUS, tile_rows=256, max_workers=None):
+    """
+    median_difference computed on row tiles in parallel processes
+
+    Tiles overlap by the kernel radius, so the result equals the one of median_difference.
+
+    :param tile_rows: number of rows per tile
+    :param max_workers: number of processes, defaults to the number of cores
+    """
+    image = np.asarray(image, dtype=np.float32)
+    starts = range(0, image.shape[0], tile_rows)
+    tiles = [(image[max(0, s - radius):s + tile_rows + radius], radius) for s in starts]
+    if len(tiles) <= 1:
+        return median_difference(image, radius)
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        diffs = list(executor.map(_median_difference_tile, tiles))
+    return np.concatenate([
+        diff[s - max(0, s - radius):][:tile_rows] for s, diff in zip(starts, diffs)
+    ])
+
+
+def label_components(mask, radius=CONNECTEDNESS_RADIUS, max_size=MAX_SIZE):
+    """
+    Label the objects of a mask, as connectedComponents with a plus-shaped connectedness kernel
+
+    Two pixels are connected when they lie on the same row or column at most `radius`
+    pixels apart. Objects of more than `max_size` pixels are left unlabelled.
+
+    :param mask: 2D boolean array
+    :return: 2D int array of labels starting at 1, 0 outside objects
+    """
+    rows, cols = np.nonzero(mask)
+    position = np.full(mask.shape, -1, dtype=np.int64)
+    position[rows, cols] = np.arange(len(rows))
+
+    left, right = [], []
+    for offset in range(1, radius + 1):
+        for shifted in (position[:, offset:], position[offset:, :]):
+            origin = position[:shifted.shape[0], :shifted.shape[1]]
+            linked = (origin >= 0) & (shifted >= 0)
+            left.append(origin[linked])
+            right.append(shifted[linked])
+    left, right = np.concatenate(left), np.concatenate(right)
+
+    graph = coo_matrix((np.ones(len(left), dtype=np.int8), (left, right)), shape=(len(rows), len(rows)))
+    _, component = connected_components(graph, directed=False)
+    sizes = np.bincount(component)
+    kept = sizes[component] <= max_size
+
+    labels = np.zeros(mask.shape, dtype=np.int64)
+    labels[rows[kept], cols[kept]] = component[kept] + 1
+    return labels
+
+
+def pixel_areas(transform, shape):
+    """
+    Area of the pixels of each row of a raster, in m2
+
+    :return: np.ndarray with one area per row
+    """
+    west, north, width, height = transform
+    edges = np.radians(north - height * np.arange(shape[0] + 1))
+    return AUTHALIC_RADIUS ** 2 * np.radians(width) * np.abs(np.sin(edges[:-1]) - np.sin(edges[1:]))
+
+
+def vectorize(labels, transform):
+    """
+    Polygons of the 4-connected regions of a label image, as reduceToVectors with eightConnected=False
+
+    :param labels: 2D int array, 0 outside objects
+    :return: gpd.GeoDataFrame with the label of each polygon in a `hotspots` column
+    """
+    regions, _ = ndimage.label(labels > 0)
+    rows, cols = np.nonzero(regions)
+    if not len(rows):
+        return gpd.GeoDataFrame({"hotspots": [], "mean": []}, geometry=[], crs="EPSG:4326")
+
+    west, north, width, height = transform
+    pixels = shapely.box(west + cols * width, north - (rows + 1) * height, west + (cols + 1) * width, north - rows * height)
+    region = regions[rows, cols]
+    order = np.argsort(region, kind="stable")
+    bounds = np.flatnonzero(np.diff(region[order])) + 1
+    geometries = [shapely.coverage_union_all(part) for part in np.split(pixels[order], bounds)]
+    first = order[np.concatenate([[0], bounds])]
+
+    return gpd.GeoDataFrame({
+        "hotspots": labels[rows[first], cols[first]],
+        # Mean of the thresholded band, as the reducer of reduceToVectors
+        "mean": np.ones(len(geometries)),
+    }, geometry=geometries, crs="EPSG:4326")
+
+
+def detect_hotspots(image, transform, threshold=THRESHOLD, kernel_radius=KERNEL_RADIUS,
+                    max_size=MAX_SIZE, min_area=MIN_AREA, tile_rows=256, max_workers=None):
+    """
+    Return detected methane leaks of a mean methane raster
+
+    Same steps as methane_hotspots: difference with the 20-pixel median, threshold,
+    connected components, area filter and vectorization, at the resolution of the raster.
+
+    :param image: 2D array of mean methane, NaN where masked
+    :param transform: (west, north, pixel_width, pixel_height) in degrees
+    :param threshold: minimum difference with the median of a hot pixel
+    :param max_workers: number of processes computing the median, defaults to the number of cores
+    :return: gpd.GeoDataFrame with the schema of the Earth Engine output (see fcToGdf)
+    """
+    diff = tiled_median_difference(image, kernel_radius, tile_rows=tile_rows, max_workers=max_workers)
+    with np.errstate(invalid="ignore"):
+        hot = diff > threshold
+    labels = label_components(hot, max_size=max_size)
+
+    # connectedPixelCount of the labels times the pixel area
+    regions, count = ndimage.label(labels > 0)
+    region_size = np.bincount(regions.ravel(), minlength=count + 1)
+    object_area = np.minimum(region_size[regions], max_size) * pixel_areas(transform, labels.shape)[:, None]
+    labels[object_area < min_area] = 0
+
+    return vectorize(labels, transform)
+
+
+def detect_hotspots_file(path, **kwargs):
+    """
+    detect_hotspots on a raster archived with save_raster
+    """
+    image, transform = read_raster(path)
+    return detect_hotspots(image, transform, **kwargs)
+
+
+def raster_bounds(transform, shape):
+    """
+    Bounds of a raster as (west, south, east, north)
+    """
+    west, north, width, height = transform
+    return west, north - shape[0] * height, west + shape[1] * width, north
+
+
+def local_methane_hotspots(paths, max_workers=None, **kwargs):
+    """
+    Return detected methane leaks of several archived rasters, e.g. the tiles of the world
+
+    Polygons cut at the borders of adjacent rasters are merged back, see methane.tiling.
+
+    :param paths: list of paths of rasters archived with save_raster
+    :return: gpd.GeoDataFrame of hotspots
+    """
+    results, tiles, pixel_sizes = [], [], []
+    for position, path in enumerate(paths):
+        image, transform = read_raster(path)
+        results.append(detect_hotspots(image, transform, max_workers=max_workers, **kwargs).assign(tile=position))
+        tiles.append(raster_bounds(transform, image.shape))
+        pixel_sizes.append(min(abs(transform[2]), abs(transform[3])))
+    hotspots = gpd.GeoDataFrame(pd.concat(results, ignore_index=True), crs="EPSG:4326")
+    # Adjacent pixels of two rasters touch, a fraction of a pixel is enough
+    return merge_seams(hotspots, tiles, tolerance=min(pixel_sizes) / 2)
@@ -4,45 +4,61 @@ Detect Methane hotspots
 
 Functions to load and detect methane hotspots
 """
+import logging
+
 import pandas as pd
-import numpy as np
 import geopandas as gpd
-import shapely
 import ee
 
-# Load infra
-from methane.infrastructure import plants_as_gdf, pipelines_as_gdf
+from methane.composites import incremental_methane_mean
+from methane.context import hotspot_ids, write_context
+from methane.features import download_features
+from methane.geodesic import geodesic_area
+from methane.history import append_run
+from methane.output import write_hotspots
+from methane.registry import get_infrastructure
+from methane.scoring import DEFAULT_PARAMETERS, distance_score, size_score
+from methane.tiling import make_tiles, merge_seams, run_tiles
+
+logger = logging.getLogger(__name__)
+
+# Whole world extracted, as (west, south, east, north)
+WORLD_BOUNDS = (-179.0, -58.0, 179.0, 78.0)
 
-df_plants = plants_as_gdf()
-df_pipelines = pipelines_as_gdf()
-df_pipelines = df_pipelines[df_pipelines.geometry.notnull()]
+# Directory of the binary outputs partitioned by run date, see methane.output
+HOTSPOTS_DIR = 'hotspots'
 
-def hotspots_as_gdf(hotspots_gpd, start_date, end_date):
+
+def hotspots_as_gdf(hotspots_gpd, start_date, end_date, infrastructure=None):
     """
     Merge hotspots with infrastructure data and return list of most critical 
     methane events linked to fossil fuel production site
 
     :param hotspots_gpd: a geopandas dataframe of detected methane events
+    :param infrastructure: optional methane.registry.Infrastructure, defaults to the shared registry
     :return: a geopandas dataframe with most critical events linked to fossil fule infrastructure
     """
+    infrastructure = infrastructure or get_infrastructure()
 
     return (hotspots_gpd
-        .assign(min_dist_plant = lambda _df: _df.apply(lambda _e: df_plants.geometry.distance(_e.geometry).min(), axis=1))
-        .assign(min_dist_pipeline = lambda _df: _df.apply(lambda _e: df_pipelines.geometry.distance(_e.geometry).min(), axis=1))
+        # Distances in metres, area in m2
+        .assign(min_dist_plant = lambda _df: infrastructure.plants_index.min_distance(_df.geometry, geodesic=True))
+        .assign(min_dist_pipeline = lambda _df: infrastructure.pipelines_index.min_distance(_df.geometry, geodesic=True))
         .assign(min_dist_infra = lambda _df: _df[["min_dist_plant", "min_dist_pipeline"]].min(axis=1))
-        .assign(area_m2 = lambda _df: _df.geometry.area)
+        .assign(area_m2 = lambda _df: geodesic_area(_df.geometry))
         # 0 criticality if more than 20km, linear in-between
-        .assign(infra_dist_score = lambda _df: (20 - _df.min_dist_infra.clip(0, 20) / 20) )
-        # log of size
-        .assign(criticality = lambda _df: np.log(_df.area_m2+1) / np.log(1.01) / _df.infra_dist_score)
+        .assign(infra_dist_score = lambda _df: distance_score(_df.min_dist_infra, DEFAULT_PARAMETERS["cutoff_km"], DEFAULT_PARAMETERS["power"]))
+        # log of size, see methane.scoring to compare other parameters
+        .assign(criticality = lambda _df: size_score(_df.area_m2, DEFAULT_PARAMETERS["log_base"]) * _df.infra_dist_score)
         .sort_values(by="criticality", ascending=False)
+        .assign(id = lambda _df: hotspot_ids(_df.geometry))
         .assign(start_date=start_date)
         .assign(end_date=end_date)
     )
 
 
 # Taken from: https://github.com/rutgerhofste/eeconvert/blob/master/eeconvert/__init__.py
-def fcToGdf(fc, crs = {'init' :'epsg:4326'}):
+def fcToGdf(fc, crs = {'init' :'epsg:4326'}, page_size=None, max_workers=4):
     """converts a featurecollection to a geoPandas GeoDataFrame. Use this function only if all features have a geometry.  
     
     caveats:
@@ -51,49 +67,43 @@ def fcToGdf(fc, crs = {'init' :'epsg:4326'}):
     
     :param fc (ee.FeatureCollection) : the earth engine feature collection to convert. 
     :param crs (dictionary, optional) : the coordinate reference system in geopandas format. Defaults to {'init' :'epsg:4326'}
+    :param page_size (int, optional) : download the collection in pages of this many features instead of one request
+    :param max_workers (int, optional) : number of pages downloaded concurrently
     :return: gdf (geoPandas.GeoDataFrame or pandas.DataFrame) : the corresponding (geo)dataframe. 
         
     """
-    crs = {'init' :'epsg:4326'}
-    features = fc.getInfo()['features']
-    dictarr = []
-
-    print("Got features")
-    
-    for f in features:
-        #geodesic = ee.Feature(f).geometry().edgesAreGeodesics()
-        #if geodesic:
-        attr = f['properties']
-        attr['geometry'] = f['geometry']
-        attr['geometry']
-        dictarr.append(attr)
+    pages = download_features(fc, page_size=page_size, max_workers=max_workers)
 
+    logger.info("Got %d features", sum(len(page) for page in pages))
 
-    gdf = gpd.GeoDataFrame(dictarr)
-    gdf['geometry'] = list(map(lambda s: shapely.geometry.shape(s), gdf.geometry))
-    gdf.crs = crs
-    return gdf
+    if not pages:
+        return gpd.GeoDataFrame(geometry=[], crs="EPSG:4326")
+    return gpd.GeoDataFrame(pd.concat(pages, ignore_index=True), crs="EPSG:4326")
 
-def methane_hotspots(start_date, end_date):
+def methane_hotspots(start_date, end_date, bounds=WORLD_BOUNDS, image=None):
     """
     Return detected methane leaks over period of interest
 
     :param start_date: Initial date of interest (str: 'YYYY-MM-dd')
     :param start_date: inal date of interest (str: 'YYYY-MM-dd')
+    :param bounds: area of interest as (west, south, east, north), defaults to the whole world
+    :param image: optional precomputed mean methane image (band `ch4`) of the period,
+        e.g. from methane.composites.incremental_methane_mean
     :return: ee.FeatureCollection with leaks detected
     """
-    methane_volume = 'CH4_column_volume_mixing_ratio_dry_air' 
-    imageCollection = ee.ImageCollection('COPERNICUS/S5P/OFFL/L3_CH4')
-
-    #Import a Landsat 8 image, subset the thermal band, and clip to the
-    # area of interest.
-    image = (
-        imageCollection
-    .select([methane_volume])
-    .filterDate(start_date, end_date)
-    .mean()
-    .rename('ch4')
-    )
+    if image is None:
+        methane_volume = 'CH4_column_volume_mixing_ratio_dry_air' 
+        imageCollection = ee.ImageCollection('COPERNICUS/S5P/OFFL/L3_CH4')
+
+        #Import a Landsat 8 image, subset the thermal band, and clip to the
+        # area of interest.
+        image = (
+            imageCollection
+        .select([methane_volume])
+        .filterDate(start_date, end_date)
+        .mean()
+        .rename('ch4')
+        )
 
     uniform_kernel = ee.Kernel.square(20, 'pixels')
     image_smooth = image.reduceNeighborhood(ee.Reducer.median(),uniform_kernel)
@@ -130,9 +140,9 @@ def methane_hotspots(start_date, end_date):
     # minimum area mask just defined.
     objects = objects.updateMask(areaMask)
 
-    # Whole world extracted
+    west, south, east, north = bounds
     aoi = ee.Geometry.Polygon(
-    [[[-179.0, 78.0], [-179.0, -58.0], [179.0, -58.0], [179.0, 78.0]]], None,
+    [[[west, north], [west, south], [east, south], [east, north]]], None,
     False)
     
     toVectors = objects.reduceToVectors(
@@ -149,34 +159,102 @@ def methane_hotspots(start_date, end_date):
     return toVectors
 
 
-def save_methane_hotspots(start_date, end_date):
+def tiled_methane_hotspots(start_date, end_date, tile_size=30, max_workers=4, retries=3,
+                           checkpoint_dir=None, page_size=None, bounds=WORLD_BOUNDS, image=None):
+    """
+    Return detected methane leaks over period of interest, extracted tile by tile
+
+    Tiles are extracted concurrently and retried on failure, polygons cut at tile
+    borders are merged back. With a checkpoint directory a rerun only extracts the
+    tiles that failed.
+
+    :param start_date: Initial date of interest (str: 'YYYY-MM-dd')
+    :param end_date: Final date of interest (str: 'YYYY-MM-dd')
+    :param tile_size: size of the tiles in degrees, a number or a (lon, lat) pair
+    :param max_workers: number of tiles extracted concurrently
+    :param retries: number of attempts per tile
+    :param checkpoint_dir: optional directory where extracted tiles are saved
+    :param page_size: page size of the download of each tile, see fcToGdf
+    :param bounds: area of interest as (west, south, east, north), defaults to the whole world
+    :param image: optional precomputed mean methane image of the period, see methane_hotspots
+    :return: gpd.GeoDataFrame of hotspots
+    """
+    tiles = make_tiles(bounds, tile_size)
+
+    def extract(tile):
+        return fcToGdf(methane_hotspots(start_date, end_date, bounds=tile, image=image), page_size=page_size)
+
+    hotspots = run_tiles(tiles, extract, max_workers=max_workers, retries=retries, checkpoint_dir=checkpoint_dir)
+    return merge_seams(hotspots, tiles)
+
+
+def write_outputs(hotspots_gpd, start_date, end_date, fdir='.', formats=('geojson',)):
+    """
+    Write hotspots in every requested format
+
+    :param formats: among "geojson" (one file per window in fdir), "parquet" and "fgb"
+        (partitioned by run date, the end date, under fdir/hotspots)
+    """
+    if 'geojson' in formats:
+        hotspots_gpd.to_file(f'{fdir}/methane_hotspots_start_date={start_date}_end_date={end_date}.geojson', driver='GeoJSON')
+    write_hotspots(hotspots_gpd, f'{fdir}/{HOTSPOTS_DIR}', end_date, formats=formats)
+
+
+def save_methane_hotspots(start_date, end_date, formats=('geojson',)):
     """
     Return detected methane leaks over period of interest as geopandas dataframe and save file
 
     :param start_date: Initial date of interest (str: 'YYYY-MM-dd')
     :param start_date: inal date of interest (str: 'YYYY-MM-dd')
+    :param formats: output formats, see write_outputs
     :return: 
     """
     methane_hotspots_vectors = methane_hotspots(start_date, end_date)
     gpd = fcToGdf(methane_hotspots_vectors)
-    gpd.to_file(f'methane_hotspots_start_date={start_date}_end_date={end_date}.geojson', driver='GeoJSON')
+    write_outputs(gpd, start_date, end_date, formats=formats)
 
     
-def run(start_date, end_date, fdir='/mounted/'):
+def run(start_date, end_date, fdir='/mounted/', page_size=None, tile_size=None, asset_root=None,
+        formats=('geojson',), history_dir=None, infrastructure=None, context_top_n=None):
     """
     Return detected methane leaks over period of interest as geopandas dataframe and save file
 
     :param start_date: Initial date of interest (str: 'YYYY-MM-dd')
     :param start_date: inal date of interest (str: 'YYYY-MM-dd')
+    :param page_size: download hotspots in concurrent pages of this size, see fcToGdf
+    :param tile_size: extract hotspots in tiles of this size in degrees, checkpointed
+        under fdir/checkpoints, see tiled_methane_hotspots
+    :param asset_root: Earth Engine folder of the daily aggregates, the mean over the period
+        is then updated incrementally from the previous run once its aggregates are
+        stored, see methane.composites
+    :param formats: output formats, see write_outputs
+    :param history_dir: optional directory of the hotspot history the run is appended to,
+        linking its hotspots to the ones of previous runs, see methane.history
+    :param infrastructure: optional methane.registry.Infrastructure, defaults to the shared registry
+    :param context_top_n: precompute the context bundles of this many most critical hotspots
+        next to the outputs, see methane.context
     :return: 
     """
+    image = None
+    if asset_root is not None:
+        image = incremental_methane_mean(start_date, end_date, asset_root, WORLD_BOUNDS)
     # From GEE
-    methane_hotspots_vectors = methane_hotspots(start_date, end_date)
-    # Transform to geopandas
-    hotspots_gpd = fcToGdf(methane_hotspots_vectors)
+    if tile_size is not None:
+        hotspots_gpd = tiled_methane_hotspots(
+            start_date, end_date, tile_size=tile_size, page_size=page_size, image=image,
+            checkpoint_dir=f'{fdir}/checkpoints/start_date={start_date}_end_date={end_date}',
+        )
+    else:
+        methane_hotspots_vectors = methane_hotspots(start_date, end_date, image=image)
+        # Transform to geopandas
+        hotspots_gpd = fcToGdf(methane_hotspots_vectors, page_size=page_size)
     # Link with infra
-    hotspot_w_infra = hotspots_as_gdf(hotspots_gpd, start_date, end_date)
+    hotspot_w_infra = hotspots_as_gdf(hotspots_gpd, start_date, end_date, infrastructure=infrastructure)
     # write to disk
-    hotspot_w_infra.to_file(f'{fdir}/methane_hotspots_start_date={start_date}_end_date={end_date}.geojson', driver='GeoJSON')
+    write_outputs(hotspot_w_infra, start_date, end_date, fdir=fdir, formats=formats)
+    if history_dir is not None:
+        append_run(history_dir, hotspot_w_infra, end_date)
+    if context_top_n:
+        write_context(hotspot_w_infra, f'{fdir}/{HOTSPOTS_DIR}', end_date, top_n=context_top_n, infrastructure=infrastructure)
     
     return "Success"
@@ -0,0 +1,139 @@
+"""
+Nearest infrastructure
+------------------------------
+
+Spatial index used to link methane hotspots to the closest infrastructure assets
+"""
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.strtree import STRtree
+
+from methane.geodesic import geodesic_distance
+
+NEAREST_COLUMNS = ["hotspot", "rank", "asset_id", "asset_type", "distance"]
+
+
+class NearestAssetIndex:
+    """
+    STRtree over a snapshot of infrastructure assets, built once and queried
+    for whole batches of hotspots at a time.
+
+    Distances are expressed in the units of the geometries' coordinates, or in
+    metres in geodesic mode.
+
+    :param assets: geopandas dataframe of assets (points or lines)
+    :param id_col: column holding the asset identifier
+    :param type_col: column holding the asset type
+    """
+
+    def __init__(self, assets, id_col="asset_id", type_col="asset_type"):
+        geometries = np.asarray(assets.geometry.values, dtype=object)
+        valid = ~(shapely.is_missing(geometries) | shapely.is_empty(geometries))
+
+        self.geometries = geometries[valid]
+        self.asset_ids = assets[id_col].to_numpy()[valid]
+        self.asset_types = assets[type_col].to_numpy()[valid]
+        self.tree = STRtree(self.geometries)
+
+    def __len__(self):
+        return len(self.geometries)
+
+    def nearest(self, geometries, k=1, max_distance=None, geodesic=False, candidates=8):
+        """
+        Return the k nearest assets of every geometry in one vectorized call
+
+        :param geometries: array-like of shapely geometries (e.g. a GeoSeries of hotspots)
+        :param k: number of assets to return per geometry
+        :param max_distance: optional cut-off, assets further away are dropped
+        :param geodesic: measure distances in metres (see methane.geodesic) instead of
+            coordinate units, assets are then ranked among the `candidates` nearest in
+            coordinate units
+        :param candidates: number of planar candidates re-ranked per geometry in geodesic mode
+        :return: pd.DataFrame with one row per (hotspot, rank), `hotspot` being the
+            position of the geometry in the input
+        """
+        if k < 1:
+            raise ValueError("k must be a positive integer")
+
+        geometries = np.asarray(geometries, dtype=object)
+        valid = ~(shapely.is_missing(geometries) | shapely.is_empty(geometries))
+        if len(self) == 0 or not valid.any():
+            return pd.DataFrame(columns=NEAREST_COLUMNS)
+
+        query_pos = np.flatnonzero(valid)
+        if geodesic:
+            hotspot, asset, _ = self._query(geometries[query_pos], query_pos, max(k, candidates), None)
+            distance = geodesic_distance(geometries[hotspot], self.geometries[asset])
+            if max_distance is not None:
+                in_range = distance <= max_distance
+                hotspot, asset, distance = hotspot[in_range], asset[in_range], distance[in_range]
+        else:
+            hotspot, asset, distance = self._query(geometries[query_pos], query_pos, k, max_distance)
+
+        df = pd.DataFrame({
+            "hotspot": hotspot,
+            "asset_id": self.asset_ids[asset],
+            "asset_type": self.asset_types[asset],
+            "distance": distance,
+        }).sort_values(["hotspot", "distance"], kind="mergesort")
+        df["rank"] = df.groupby("hotspot").cumcount()
+        return df[df["rank"] < k][NEAREST_COLUMNS].reset_index(drop=True)
+
+    def min_distance(self, geometries, max_distance=None, geodesic=False):
+        """
+        Return the distance to the nearest asset, aligned with the input geometries
+
+        :param geometries: array-like of shapely geometries
+        :param max_distance: optional cut-off, geometries without asset in range get NaN
+        :param geodesic: measure distances in metres instead of coordinate units
+        :return: np.ndarray of float, NaN where no asset was found
+        """
+        geometries = np.asarray(geometries, dtype=object)
+        result = np.full(len(geometries), np.nan)
+        nearest = self.nearest(geometries, k=1, max_distance=max_distance, geodesic=geodesic)
+        result[nearest.hotspot.to_numpy(dtype=int)] = nearest.distance.to_numpy(dtype=float)
+        return result
+
+    def _query(self, geometries, query_pos, k, max_distance):
+        if k == 1:
+            (hotspot, asset), distance = self.tree.query_nearest(
+                geometries, max_distance=max_distance, return_distance=True, all_matches=False
+            )
+            return query_pos[hotspot], asset, distance
+        return self._k_nearest(geometries, query_pos, k, max_distance)
+
+    def _k_nearest(self, geometries, query_pos, k, max_distance):
+        # The k nearest assets of a geometry all lie within any radius that already
+        # contains k assets: grow the radius from the nearest distance until it does.
+        k = min(k, len(self))
+        (_, _), radius = self.tree.query_nearest(geometries, return_distance=True, all_matches=False)
+        radius = np.maximum(radius, 1e-9)
+        if max_distance is not None:
+            radius = np.minimum(radius, max_distance)
+
+        pending = np.arange(len(geometries))
+        hotspots, assets = [], []
+        while len(pending):
+            q, t = self.tree.query(geometries[pending], predicate="dwithin", distance=radius[pending])
+            counts = np.bincount(q, minlength=len(pending))
+            done = counts >= k
+            if max_distance is not None:
+                done |= radius[pending] >= max_distance
+            keep = done[q]
+            hotspots.append(pending[q[keep]])
+            assets.append(t[keep])
+            pending = pending[~done]
+            radius[pending] *= 2
+            if max_distance is not None:
+                radius[pending] = np.minimum(radius[pending], max_distance)
+
+        hotspot = np.concatenate(hotspots)
+        asset = np.concatenate(assets)
+        distance = shapely.distance(geometries[hotspot], self.geometries[asset])
+
+        order = np.lexsort((distance, hotspot))
+        hotspot, asset, distance = hotspot[order], asset[order], distance[order]
+        rank = np.arange(len(hotspot)) - np.searchsorted(hotspot, hotspot)
+        keep = rank < k
+        return query_pos[hotspot[keep]], asset[keep], distance[keep]
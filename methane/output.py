@@ -0,0 +1,248 @@
+"""
+Hotspot outputs
+------------------------------
+
+Binary outputs of the daily runs, partitioned by run date:
+
+    <root>/run_date=YYYY-MM-DD/hotspots.parquet   GeoParquet with a bbox covering column
+    <root>/run_date=YYYY-MM-DD/hotspots.fgb       FlatGeobuf with its packed R-tree
+
+Rows of the GeoParquet files are ordered along a Z-order curve and written in small row
+groups, so the statistics of the bbox column let readers skip the rest of the file.
+"""
+import json
+import os
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+PARTITION = "run_date"
+PARQUET_NAME = "hotspots.parquet"
+FLATGEOBUF_NAME = "hotspots.fgb"
+ROW_GROUP_SIZE = 1024
+
+
+def partition_path(root, run_date):
+    return Path(root) / f"{PARTITION}={run_date}"
+
+
+def run_dates(root, start_date=None, end_date=None):
+    """
+    Return the run dates of the partitions under a root, optionally within a date range
+
+    :param root: directory of the partitions
+    :param start_date: first run date included (str: 'YYYY-MM-dd')
+    :param end_date: last run date included (str: 'YYYY-MM-dd')
+    :return: sorted list of str
+    """
+    root = Path(root)
+    if not root.exists():
+        return []
+    dates = sorted(p.name.split("=", 1)[1] for p in root.glob(f"{PARTITION}=*") if p.is_dir())
+    # ISO dates compare as strings
+    return [d for d in dates if (start_date is None or d >= start_date) and (end_date is None or d <= end_date)]
+
+
+def _zorder(geometries):
+    # Interleave the bits of the quantized bbox centres
+    bounds = shapely.bounds(geometries)
+    x = ((bounds[:, 0] + bounds[:, 2]) / 2 + 180) / 360
+    y = ((bounds[:, 1] + bounds[:, 3]) / 2 + 90) / 180
+    x = (np.nan_to_num(np.clip(x, 0, 1)) * 0xFFFF).astype(np.uint64)
+    y = (np.nan_to_num(np.clip(y, 0, 1)) * 0xFFFF).astype(np.uint64)
+    key = np.zeros(len(geometries), dtype=np.uint64)
+    for bit in range(16):
+        key |= ((x >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit)
+        key |= ((y >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit + 1)
+    return key
+
+
+def _replace(tmp, path):
+    os.replace(tmp, path)
+    return path
+
+
+def write_geoparquet(gdf, path, row_group_size=ROW_GROUP_SIZE):
+    """
+    Write a GeoParquet file with a `bbox` covering column (GeoParquet 1.1)
+
+    :param gdf: gpd.GeoDataFrame in EPSG:4326
+    :param path: path of the file
+    :return: Path
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    path = Path(path)
+    geometry = gdf.geometry.name
+    geometries = np.asarray(gdf.geometry.values, dtype=object)
+    order = np.argsort(_zorder(geometries), kind="stable")
+    geometries = geometries[order]
+    bounds = shapely.bounds(geometries)
+
+    table = pa.Table.from_pandas(pd.DataFrame(gdf.drop(columns=geometry)).iloc[order], preserve_index=False)
+    table = table.append_column(geometry, pa.array(shapely.to_wkb(geometries), type=pa.binary()))
+    table = table.append_column("bbox", pa.StructArray.from_arrays(
+        [pa.array(bounds[:, i]) for i in range(4)], names=["xmin", "ymin", "xmax", "ymax"]
+    ))
+
+    valid = ~np.isnan(bounds).any(axis=1)
+    geo = {
+        "version": "1.1.0",
+        "primary_column": geometry,
+        "columns": {geometry: {
+            "encoding": "WKB",
+            "geometry_types": sorted({g.geom_type for g in geometries[valid]}),
+            "crs": gdf.crs.to_json_dict() if gdf.crs is not None else None,
+            "bbox": [
+                float(bounds[valid, 0].min()), float(bounds[valid, 1].min()),
+                float(bounds[valid, 2].max()), float(bounds[valid, 3].max()),
+            ] if valid.any() else [],
+            "covering": {"bbox": {c: ["bbox", c] for c in ("xmin", "ymin", "xmax", "ymax")}},
+        }},
+    }
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), b"geo": json.dumps(geo).encode()})
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    pq.write_table(table, tmp, row_group_size=row_group_size)
+    return _replace(tmp, path)
+
+
+def write_flatgeobuf(gdf, path):
+    """
+    Write a FlatGeobuf file with a spatial index
+
+    :param gdf: gpd.GeoDataFrame
+    :param path: path of the file
+    :return: Path
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    gdf.to_file(tmp, driver="FlatGeobuf", SPATIAL_INDEX="YES")
+    return _replace(tmp, path)
+
+
+def write_hotspots(gdf, root, run_date, formats=("parquet", "fgb")):
+    """
+    Write the hotspots of a run in its partition, replacing a previous output of the same date
+
+    :param gdf: gpd.GeoDataFrame of hotspots, e.g. from hotspots_as_gdf
+    :param root: directory of the partitions
+    :param run_date: date of the run (str: 'YYYY-MM-dd')
+    :param formats: formats written among "parquet" and "fgb"
+    :return: list of Path written
+    """
+    partition = partition_path(root, run_date)
+    paths = []
+    if "parquet" in formats:
+        paths.append(write_geoparquet(gdf, partition / PARQUET_NAME))
+    if "fgb" in formats:
+        paths.append(write_flatgeobuf(gdf, partition / FLATGEOBUF_NAME))
+    return paths
+
+
+def _bbox_filter(bbox):
+    import pyarrow.dataset as ds
+
+    west, south, east, north = bbox
+    overlaps_x = (ds.field("bbox", "xmin") <= east) & (ds.field("bbox", "xmax") >= west)
+    overlaps_y = (ds.field("bbox", "ymin") <= north) & (ds.field("bbox", "ymax") >= south)
+    return overlaps_x & overlaps_y
+
+
+def read_hotspots(root, bbox=None, start_date=None, end_date=None, columns=None):
+    """
+    Read the GeoParquet hotspots of a date range intersecting a bounding box
+
+    Only the partitions of the date range are opened, and only the row groups whose
+    bbox statistics overlap the bounding box are decoded.
+
+    :param root: directory of the partitions
+    :param bbox: optional (west, south, east, north)
+    :param start_date: first run date included (str: 'YYYY-MM-dd')
+    :param end_date: last run date included (str: 'YYYY-MM-dd')
+    :param columns: optional subset of attribute columns to read
+    :return: gpd.GeoDataFrame with the run date of each hotspot in a `run_date` column
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    files = [
+        str(partition_path(root, d) / PARQUET_NAME) for d in run_dates(root, start_date, end_date)
+        if (partition_path(root, d) / PARQUET_NAME).exists()
+    ]
+    if not files:
+        return gpd.GeoDataFrame({PARTITION: []}, geometry=[], crs="EPSG:4326")
+
+    # Runs without hotspots have columns of null type, the schemas of the runs are merged
+    schema = pa.unify_schemas([pq.read_schema(f) for f in files])
+    if PARTITION not in schema.names:
+        schema = schema.append(pa.field(PARTITION, pa.string()))
+    dataset = ds.dataset(files, schema=schema, format="parquet", partitioning=ds.partitioning(flavor="hive"),
+                         partition_base_dir=str(root))
+    metadata = json.loads(dataset.schema.metadata[b"geo"])
+    geometry = metadata["primary_column"]
+    if columns is not None:
+        columns = [c for c in columns if c in dataset.schema.names and c not in (geometry, "bbox", PARTITION)]
+        columns = columns + [geometry, PARTITION]
+
+    table = dataset.to_table(columns=columns, filter=_bbox_filter(bbox) if bbox is not None else None)
+    gdf = _table_to_gdf(table, metadata, bbox)
+    return gdf.assign(**{PARTITION: gdf[PARTITION].astype(str)})
+
+
+def read_geoparquet(path, bbox=None, columns=None):
+    """
+    Read a file written by write_geoparquet, only decoding the rows intersecting a bounding box
+
+    :param path: path of the file
+    :param bbox: optional (west, south, east, north)
+    :param columns: optional subset of attribute columns to read
+    :return: gpd.GeoDataFrame
+    """
+    import pyarrow.dataset as ds
+
+    dataset = ds.dataset(str(path), format="parquet")
+    metadata = json.loads(dataset.schema.metadata[b"geo"])
+    if columns is not None:
+        columns = [c for c in columns if c in dataset.schema.names and c != metadata["primary_column"]]
+        columns = columns + [metadata["primary_column"]]
+    table = dataset.to_table(columns=columns, filter=_bbox_filter(bbox) if bbox is not None else None)
+    return _table_to_gdf(table, metadata, bbox)
+
+
+def _table_to_gdf(table, metadata, bbox):
+    geometry = metadata["primary_column"]
+    df = table.drop([c for c in ["bbox"] if c in table.column_names]).to_pandas()
+    geometries = shapely.from_wkb(df.pop(geometry).to_numpy())
+    crs = metadata["columns"][geometry].get("crs") or "EPSG:4326"
+    gdf = gpd.GeoDataFrame(df, geometry=geometries, crs=crs)
+    if bbox is not None:
+        gdf = gdf[shapely.intersects(np.asarray(gdf.geometry.values, dtype=object), shapely.box(*bbox))]
+    return gdf.reset_index(drop=True)
+
+
+def read_hotspots_fgb(root, bbox=None, start_date=None, end_date=None):
+    """
+    Read the FlatGeobuf hotspots of a date range, using their spatial index for the bounding box
+
+    :param root: directory of the partitions
+    :param bbox: optional (west, south, east, north)
+    :param start_date: first run date included (str: 'YYYY-MM-dd')
+    :param end_date: last run date included (str: 'YYYY-MM-dd')
+    :return: gpd.GeoDataFrame with the run date of each hotspot in a `run_date` column
+    """
+    frames = [
+        gpd.read_file(partition_path(root, d) / FLATGEOBUF_NAME, bbox=bbox).assign(**{PARTITION: d})
+        for d in run_dates(root, start_date, end_date)
+        if (partition_path(root, d) / FLATGEOBUF_NAME).exists()
+    ]
+    if not frames:
+        return gpd.GeoDataFrame({PARTITION: []}, geometry=[], crs="EPSG:4326")
+    return gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), crs=frames[0].crs)
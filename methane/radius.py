@@ -0,0 +1,88 @@
+"""
+Radius queries
+------------------------------
+
+Spatial index answering "which assets lie within r metres of this point" in haversine
+distance, without scanning the whole table
+
+Points are stored as unit vectors in a k-d tree: the great-circle distance d between two
+points is a monotonic function of their chord 2 * sin(d / 2R), so a haversine radius is
+a euclidean ball in 3D. Candidates of the ball are then measured with the haversine
+formula of methane.geodesic, which makes the results exactly those of a full scan.
+"""
+import numpy as np
+from scipy.spatial import cKDTree
+
+from methane.geodesic import EARTH_RADIUS, haversine
+
+
+def unit_vectors(lat, lng):
+    """
+    Points on the unit sphere
+
+    :param lat: latitudes in degrees
+    :param lng: longitudes in degrees
+    :return: np.ndarray of shape (n, 3)
+    """
+    lat, lng = np.radians(np.asarray(lat, dtype=float)), np.radians(np.asarray(lng, dtype=float))
+    return np.stack([np.cos(lat) * np.cos(lng), np.cos(lat) * np.sin(lng), np.sin(lat)], axis=-1)
+
+
+class RadiusIndex:
+    """
+    k-d tree over the positions of point assets, built once and queried for every map render
+
+    Rows with a missing coordinate are not indexed. Results are positions in the rows
+    given at construction, to be used with `df.iloc`.
+
+    :param lat: latitudes of the assets, in degrees
+    :param lng: longitudes of the assets, in degrees
+    """
+
+    def __init__(self, lat, lng):
+        lat, lng = np.asarray(lat, dtype=float), np.asarray(lng, dtype=float)
+        valid = np.isfinite(lat) & np.isfinite(lng)
+
+        self.positions = np.flatnonzero(valid)
+        self.lat = lat[valid]
+        self.lng = lng[valid]
+        self.tree = cKDTree(unit_vectors(self.lat, self.lng))
+
+    @classmethod
+    def from_frame(cls, df, lat_col="lat", lng_col="lng"):
+        return cls(df[lat_col].to_numpy(dtype=float), df[lng_col].to_numpy(dtype=float))
+
+    def __len__(self):
+        return len(self.positions)
+
+    def query(self, lat, lng, radius, limit=None):
+        """
+        Assets within radius metres of a point, nearest first
+
+        :param lat: latitude of the center, in degrees
+        :param lng: longitude of the center, in degrees
+        :param radius: radius in metres
+        :param limit: optional maximum number of assets returned, the nearest are kept
+        :return: (positions, distances) arrays, distances in metres
+        """
+        if len(self) == 0:
+            return np.empty(0, dtype=int), np.empty(0)
+
+        chord = 2 * np.sin(min(radius / EARTH_RADIUS, np.pi) / 2)
+        # The tolerance keeps points on the boundary that rounding puts just outside the ball
+        candidates = np.asarray(self.tree.query_ball_point(unit_vectors(lat, lng), chord * (1 + 1e-9)), dtype=int)
+        distance = haversine(self.lat[candidates], self.lng[candidates], lat, lng)
+
+        in_range = distance <= radius
+        candidates, distance = candidates[in_range], distance[in_range]
+        order = np.argsort(distance, kind="stable")[:limit]
+        return self.positions[candidates[order]], distance[order]
+
+    def within(self, df, lat, lng, radius, limit=None):
+        """
+        Rows of df within radius metres of a point, nearest first, with their `distance`
+
+        :param df: the dataframe the index was built from
+        """
+        positions, distance = self.query(lat, lng, radius, limit)
+        return df.iloc[positions].assign(distance=distance)
@@ -0,0 +1,113 @@
+"""
+Infrastructure registry
+------------------------------
+
+Lazily loaded, memoised infrastructure shared by every caller of the process
+"""
+import threading
+import time
+from collections import namedtuple
+
+from methane.infrastructure import infrastructure_files, pipelines_as_gdf, plants_as_gdf
+from methane.nearest import NearestAssetIndex
+from methane.store import dataset_fingerprint
+
+Infrastructure = namedtuple("Infrastructure", ["version", "plants", "pipelines", "plants_index", "pipelines_index"])
+
+
+def load_infrastructure(base_path=None):
+    """
+    Load plants and pipelines and build their spatial indexes
+
+    :param base_path: directory of the datasets, defaults to methane.infrastructure.BASE_PATH
+    :return: Infrastructure
+    """
+    version = dataset_fingerprint(infrastructure_files(base_path))
+    df_plants = plants_as_gdf(base_path, compact=True)
+    df_pipelines = pipelines_as_gdf(base_path, compact=True)
+    df_pipelines = df_pipelines[df_pipelines.geometry.notnull()]
+    return Infrastructure(
+        version=version,
+        plants=df_plants,
+        pipelines=df_pipelines,
+        plants_index=NearestAssetIndex(df_plants),
+        pipelines_index=NearestAssetIndex(df_pipelines),
+    )
+
+
+class InfrastructureRegistry:
+    """
+    Holds one infrastructure snapshot, loaded on first use and reloaded when the datasets change
+
+    Snapshots are immutable once built: readers keep using the one they got while a
+    reload builds the next one, only one thread loads at a time.
+
+    :param base_path: directory of the datasets, defaults to methane.infrastructure.BASE_PATH
+    :param check_interval: minimum number of seconds between two checks of the dataset
+        version, None to never check
+    """
+
+    def __init__(self, base_path=None, check_interval=60):
+        self.base_path = base_path
+        self.check_interval = check_interval
+        self._snapshot = None
+        self._checked_at = 0.
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Return the current snapshot, loading it if needed
+
+        :return: Infrastructure
+        """
+        snapshot = self._snapshot
+        if snapshot is not None and not self._check_due():
+            return snapshot
+
+        with self._lock:
+            if self._snapshot is None:
+                self._snapshot = load_infrastructure(self.base_path)
+                self._checked_at = time.monotonic()
+            elif self._check_due():
+                self._checked_at = time.monotonic()
+                if self.version() != self._snapshot.version:
+                    self._snapshot = load_infrastructure(self.base_path)
+            return self._snapshot
+
+    def version(self):
+        """
+        Return the version of the datasets currently on disk
+        """
+        return dataset_fingerprint(infrastructure_files(self.base_path))
+
+    def invalidate(self):
+        """
+        Drop the current snapshot, the next call to get loads a fresh one
+        """
+        with self._lock:
+            self._snapshot = None
+
+    def reload(self):
+        """
+        Load a fresh snapshot now and return it
+
+        :return: Infrastructure
+        """
+        snapshot = load_infrastructure(self.base_path)
+        with self._lock:
+            self._snapshot = snapshot
+            self._checked_at = time.monotonic()
+        return snapshot
+
+    def _check_due(self):
+        return self.check_interval is not None and time.monotonic() - self._checked_at >= self.check_interval
+
+
+registry = InfrastructureRegistry()
+
+
+def get_infrastructure():
+    """
+    Return the infrastructure snapshot of the default registry
+    """
+    return registry.get()
@@ -0,0 +1,115 @@
+"""
+Map rendering
+------------------------------
+
+Render-ready line layers (pipelines) for the web maps
+
+Lines are prepared once: an STRtree finds the lines in the window of a map, and every
+line is simplified at a few tolerances and serialized to GeoJSON ahead of time, so a
+render only filters the window and joins the strings of the level of detail of the zoom.
+Coordinates are in lng, lat like GeoJSON, no flip is needed when drawing.
+"""
+import json
+
+import numpy as np
+import shapely
+from shapely.strtree import STRtree
+
+from methane.geodesic import EARTH_RADIUS, point_to_lines_distance
+
+# Simplification tolerances, in degrees (1e-3 is about 100 m)
+TOLERANCES = (0., 0.0005, 0.002, 0.008, 0.03)
+# Coordinates are rounded on a grid of this size, in degrees (about 1 m)
+MIN_GRID_SIZE = 1e-5
+TILE_SIZE = 256
+
+
+def tolerance_for_zoom(zoom, tolerances=TOLERANCES, pixels=0.5):
+    """
+    Largest tolerance under `pixels` pixels at a web mercator zoom level, the smallest
+    tolerance without zoom
+    """
+    if zoom is None:
+        return min(tolerances)
+    pixel_degrees = 360 / (TILE_SIZE * 2 ** zoom)
+    return max([t for t in tolerances if t <= pixels * pixel_degrees], default=min(tolerances))
+
+
+def window(lat, lng, radius):
+    """
+    Bounding box in degrees (west, south, east, north) containing every point within radius metres
+
+    West and east can go past the antimeridian, see LineRenderLayer.query.
+    """
+    dlat = np.degrees(radius / EARTH_RADIUS)
+    south, north = max(lat - dlat, -90.), min(lat + dlat, 90.)
+    cos_lat = np.cos(np.radians(max(abs(south), abs(north))))
+    if north >= 90. or south <= -90. or cos_lat <= 0 or dlat / cos_lat >= 180:
+        return -180., south, 180., north
+    dlng = dlat / cos_lat
+    return lng - dlng, south, lng + dlng, north
+
+
+class LineRenderLayer:
+    """
+    Lines with a window index and precomputed GeoJSON at several levels of detail
+
+    :param lines: gpd.GeoDataFrame of (multi)line strings in EPSG:4326
+    :param label_col: column shown in the popup of the lines
+    :param tolerances: simplification tolerances in degrees, 0 keeps the full resolution
+    """
+
+    def __init__(self, lines, label_col, tolerances=TOLERANCES):
+        geometries = np.asarray(lines.geometry.values, dtype=object)
+        valid = ~(shapely.is_missing(geometries) | shapely.is_empty(geometries))
+
+        self.geometries = geometries[valid]
+        labels = lines[label_col].to_numpy()[valid]
+        self.labels = np.array(["" if label is None or label != label else str(label) for label in labels],
+                               dtype=object)
+        self.tree = STRtree(self.geometries)
+        self.tolerances = tuple(sorted(tolerances))
+        self.features = {t: self._features(t) for t in self.tolerances}
+
+    def __len__(self):
+        return len(self.geometries)
+
+    def _features(self, tolerance):
+        geometries = shapely.simplify(self.geometries, tolerance) if tolerance else self.geometries
+        geometries = shapely.set_precision(geometries, max(tolerance / 10, MIN_GRID_SIZE), mode="pointwise")
+        return np.array([
+            f'{{"type":"Feature","properties":{{"label":{json.dumps(label)}}},"geometry":{geometry}}}'
+            for label, geometry in zip(self.labels, shapely.to_geojson(geometries))
+        ], dtype=object)
+
+    def query(self, lat, lng, radius):
+        """
+        Positions of the lines within radius metres of a point
+
+        The window of the point is searched in the tree, then the candidates are measured
+        geodesically at full resolution.
+        """
+        if len(self) == 0:
+            return np.empty(0, dtype=int)
+        west, south, east, north = window(lat, lng, radius)
+        boxes = [shapely.box(west, south, east, north)]
+        if west < -180:
+            boxes.append(shapely.box(west + 360, south, 180, north))
+        if east > 180:
+            boxes.append(shapely.box(-180, south, east - 360, north))
+        candidates = np.unique(self.tree.query(boxes)[1])
+        distance = point_to_lines_distance(
+            np.full(len(candidates), lat), np.full(len(candidates), lng), self.geometries[candidates]
+        )
+        return np.sort(candidates[distance < radius])
+
+    def geojson(self, positions, zoom=None):
+        """
+        GeoJSON FeatureCollection of lines
+
+        :param positions: positions of the lines, e.g. from query
+        :param zoom: zoom level the lines are drawn at, picks the level of detail
+        :return: str, the features have a `label` property
+        """
+        features = self.features[tolerance_for_zoom(zoom, self.tolerances)][positions]
+        return '{"type":"FeatureCollection","features":[' + ",".join(features) + "]}"
@@ -0,0 +1,107 @@
+"""
+Pipeline routes
+------------------------------
+
+Parse the `route` column of the pipelines dataset into shapely geometries
+
+Routes are written as `lat, lng: lat, lng: ...`, with `;` separating the
+segments of a pipeline with several branches. Geometries are built with
+x=lng and y=lat, like every other geometry of the library.
+"""
+import logging
+
+import numpy as np
+import pandas as pd
+import shapely
+from shapely import GeometryType
+
+logger = logging.getLogger(__name__)
+
+
+def tokenize_routes(routes):
+    """
+    Split routes into flat coordinate and offset arrays
+
+    :param routes: pd.Series of route strings
+    :return: tuple (coords, segment_offsets, route_offsets, errors) where coords is a (n, 2)
+        array of lng/lat, segment_offsets the ragged offsets of the points of each segment,
+        route_offsets the ragged offsets of the segments of each route and errors a
+        pd.Series of error messages indexed like routes
+    """
+    routes = pd.Series(routes)
+    text = routes.fillna("").astype(str).reset_index(drop=True)
+    errors = pd.Series(None, index=text.index, dtype=object)
+
+    segments = text.str.split(";").explode()
+    segment_route = segments.index.to_numpy()
+    segments = segments.reset_index(drop=True)
+
+    points = segments.str.split(":").explode()
+    point_segment = points.index.to_numpy()
+    points = points.str.strip().reset_index(drop=True)
+    point_route = segment_route[point_segment]
+
+    # Trailing separators leave empty tokens behind, they are not errors
+    non_empty = (points != "").to_numpy()
+    lat, _, lng = (points.str.partition(",")[i] for i in range(3))
+    lat = pd.to_numeric(lat, errors="coerce").to_numpy(dtype=float)
+    lng = pd.to_numeric(lng, errors="coerce").to_numpy(dtype=float)
+    bad_point = non_empty & ~((np.abs(lat) <= 90) & (np.abs(lng) <= 180))
+
+    first_bad = pd.Series(points[bad_point].to_numpy(), index=point_route[bad_point]).groupby(level=0).first()
+    errors[first_bad.index] = "invalid coordinate " + first_bad.map(repr)
+    bad_route = np.zeros(len(text), dtype=bool)
+    bad_route[first_bad.index] = True
+
+    keep = non_empty & ~bad_route[point_route]
+    points_per_segment = np.bincount(point_segment[keep], minlength=len(segments))
+
+    # A segment needs two points to be a line, degenerate segments are dropped
+    single = points_per_segment == 1
+    single_route = np.unique(segment_route[single])
+    errors[single_route] = errors[single_route].fillna("segment with a single point")
+    keep &= ~single[point_segment]
+    points_per_segment[single] = 0
+
+    empty_route = (text.str.strip() == "").to_numpy()
+    segments_per_route = np.bincount(segment_route[points_per_segment > 0], minlength=len(text))
+    no_segment = (segments_per_route == 0) & ~empty_route & ~bad_route
+    errors[no_segment] = errors[no_segment].fillna("no coordinates")
+
+    coords = np.column_stack([lng[keep], lat[keep]])
+    segment_offsets = np.concatenate([[0], np.cumsum(points_per_segment[points_per_segment > 0])])
+    route_offsets = np.concatenate([[0], np.cumsum(segments_per_route)])
+    errors.index = routes.index
+    return coords, segment_offsets, route_offsets, errors.dropna()
+
+
+def parse_routes(routes):
+    """
+    Build the geometries of pipeline routes in bulk
+
+    Routes with a single segment become LineStrings, routes with several become
+    MultiLineStrings. Malformed routes are reported and get no geometry.
+
+    :param routes: pd.Series of route strings
+    :return: tuple (geometries, errors) with geometries a np.ndarray of shapely geometries
+        (None for missing or malformed routes) aligned with routes, and errors a pd.Series
+        of error messages indexed like routes
+    """
+    routes = pd.Series(routes)
+    coords, segment_offsets, route_offsets, errors = tokenize_routes(routes)
+
+    geometries = np.full(len(routes), None, dtype=object)
+    segments_per_route = np.diff(route_offsets)
+    has_geometry = segments_per_route > 0
+    if has_geometry.any():
+        lines = shapely.from_ragged_array(
+            GeometryType.MULTILINESTRING, coords, (segment_offsets, np.unique(route_offsets))
+        )
+        single = segments_per_route[has_geometry] == 1
+        lines[single] = shapely.get_geometry(lines[single], 0)
+        geometries[has_geometry] = lines
+
+    if len(errors):
+        logger.warning("%d malformed pipeline routes: %s", len(errors), errors.head().to_dict())
+
+    return geometries, errors
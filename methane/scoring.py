@@ -0,0 +1,138 @@
+"""
+Criticality scoring
+------------------------------
+
+Criticality of hotspots for one or many parameter sets
+
+The criticality of a hotspot is the log of its area times a score of its distance to
+the nearest infrastructure, 1 on the asset and decreasing to 0 at a cutoff distance:
+
+    criticality = log(area_m2 + 1) / log(log_base) * (1 - min(distance, cutoff) / cutoff) ** power
+
+Scenarios are evaluated together by broadcasting the distances and areas of the hotspots
+against the parameters of the scenarios, so a sweep costs one pass over the arrays.
+"""
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from methane.geodesic import geodesic_area
+from methane.registry import get_infrastructure
+
+PARAMETERS = ["cutoff_km", "log_base", "power"]
+DEFAULT_PARAMETERS = {"cutoff_km": 20., "log_base": 1.01, "power": 1.}
+
+
+def distance_score(distance_m, cutoff_km=20., power=1.):
+    """
+    1 on the asset, decreasing to 0 at the cutoff (linearly with power=1), 0 without asset
+
+    Arguments broadcast, e.g. distances as a column against cutoffs as a row.
+    """
+    distance_km = np.asarray(distance_m, dtype=float) / 1000
+    cutoff_km = np.asarray(cutoff_km, dtype=float)
+    score = ((cutoff_km - np.clip(distance_km, 0, cutoff_km)) / cutoff_km) ** np.asarray(power, dtype=float)
+    return np.nan_to_num(score, nan=0.)
+
+
+def size_score(area_m2, log_base=1.01):
+    """
+    Log of the area, in base log_base
+    """
+    return np.log(np.asarray(area_m2, dtype=float) + 1) / np.log(np.asarray(log_base, dtype=float))
+
+
+def parameter_grid(**values):
+    """
+    Every combination of the given parameter values, missing parameters keep their default
+
+        parameter_grid(cutoff_km=[5, 10, 20], power=[0.5, 1, 2])
+
+    :return: pd.DataFrame with one scenario per row and one column per parameter
+    """
+    unknown = set(values) - set(PARAMETERS)
+    if unknown:
+        raise ValueError(f"Unknown parameters {sorted(unknown)}, expected some of {PARAMETERS}")
+    grid = {p: np.atleast_1d(values.get(p, DEFAULT_PARAMETERS[p])) for p in PARAMETERS}
+    return pd.DataFrame(list(itertools.product(*grid.values())), columns=PARAMETERS).rename_axis("scenario")
+
+
+def scoring_inputs(hotspots, infrastructure=None):
+    """
+    Distances to the nearest asset and areas of hotspots, computed once for every scenario
+
+    Columns already computed by hotspots_as_gdf are reused.
+
+    :param hotspots: gpd.GeoDataFrame of hotspots
+    :param infrastructure: optional methane.registry.Infrastructure, defaults to the shared registry
+    :return: (distance_m, area_m2) arrays
+    """
+    if "min_dist_infra" in hotspots:
+        distance = hotspots["min_dist_infra"].to_numpy(dtype=float)
+    else:
+        infrastructure = infrastructure or get_infrastructure()
+        distance = np.fmin(
+            infrastructure.plants_index.min_distance(hotspots.geometry, geodesic=True),
+            infrastructure.pipelines_index.min_distance(hotspots.geometry, geodesic=True),
+        )
+    area = hotspots["area_m2"].to_numpy(dtype=float) if "area_m2" in hotspots else geodesic_area(hotspots.geometry)
+    return distance, area
+
+
+def criticality_matrix(distance_m, area_m2, scenarios):
+    """
+    Criticality of every hotspot in every scenario
+
+    :param distance_m: distance of each hotspot to the nearest asset in metres, NaN without asset
+    :param area_m2: area of each hotspot in m2
+    :param scenarios: pd.DataFrame of parameters, e.g. from parameter_grid
+    :return: np.ndarray of shape (hotspots, scenarios)
+    """
+    params = {p: scenarios[p].to_numpy(dtype=float)[None, :] if p in scenarios else DEFAULT_PARAMETERS[p]
+              for p in PARAMETERS}
+    distance = np.asarray(distance_m, dtype=float)[:, None]
+    area = np.asarray(area_m2, dtype=float)[:, None]
+    return size_score(area, params["log_base"]) * distance_score(distance, params["cutoff_km"], params["power"])
+
+
+def top_k(matrix, k=10):
+    """
+    Positions of the k most critical hotspots of every scenario, most critical first
+
+    :param matrix: np.ndarray of shape (hotspots, scenarios)
+    :return: np.ndarray of shape (min(k, hotspots), scenarios)
+    """
+    k = min(k, matrix.shape[0])
+    if k == 0:
+        return np.empty((0, matrix.shape[1]), dtype=int)
+    candidates = np.argpartition(-matrix, k - 1, axis=0)[:k]
+    order = np.argsort(-np.take_along_axis(matrix, candidates, axis=0), axis=0, kind="stable")
+    return np.take_along_axis(candidates, order, axis=0)
+
+
+def sweep(hotspots, scenarios, k=10, infrastructure=None):
+    """
+    Score hotspots in every scenario and rank the k most critical of each
+
+    :param hotspots: gpd.GeoDataFrame of hotspots, e.g. from hotspots_as_gdf
+    :param scenarios: pd.DataFrame of parameters, e.g. from parameter_grid
+    :param k: number of hotspots ranked per scenario
+    :param infrastructure: optional methane.registry.Infrastructure, used when the
+        distances are not in the hotspots yet
+    :return: (criticality, rankings): a pd.DataFrame of hotspots x scenarios indexed like
+        the hotspots, and a pd.DataFrame with the `scenario`, `rank`, `hotspot` index and
+        `criticality` of the top k of every scenario
+    """
+    distance, area = scoring_inputs(hotspots, infrastructure)
+    matrix = criticality_matrix(distance, area, scenarios)
+    best = top_k(matrix, k)
+
+    criticality = pd.DataFrame(matrix, index=hotspots.index, columns=scenarios.index)
+    rankings = pd.DataFrame({
+        "scenario": np.tile(scenarios.index.to_numpy(), best.shape[0]),
+        "rank": np.repeat(np.arange(best.shape[0]), best.shape[1]),
+        "hotspot": hotspots.index.to_numpy()[best.ravel()],
+        "criticality": np.take_along_axis(matrix, best, axis=0).ravel(),
+    }).sort_values(["scenario", "rank"], kind="stable").reset_index(drop=True)
+    return criticality, rankings
@@ -0,0 +1,151 @@
+"""
+Compiled infrastructure store
+------------------------------
+
+Compile the raw infrastructure CSVs into (Geo)Parquet artifacts keyed by the
+content hash of their source, so loaders stop re-parsing CSV and WKT
+"""
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+import geopandas as gpd
+import pandas as pd
+
+# Bump when the layout of compiled artifacts changes to invalidate all of them
+FORMAT_VERSION = 2
+
+COMPILED_DIR = ".compiled"
+
+_digests = {}
+
+
+def file_digest(path):
+    """
+    Return the sha256 of a file content, memoised on its size and modification time
+
+    :param path: path of the file
+    :return: str, hex digest
+    """
+    path = Path(path)
+    stat = path.stat()
+    key = (str(path.resolve()), stat.st_size, stat.st_mtime_ns)
+    if key not in _digests:
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+        _digests[key] = sha.hexdigest()
+    return _digests[key]
+
+
+def dataset_fingerprint(paths):
+    """
+    Return a short fingerprint of a set of source files, changing whenever one of them does
+
+    :param paths: iterable of file paths
+    :return: str
+    """
+    sha = hashlib.sha256(str(FORMAT_VERSION).encode())
+    for path in sorted(str(p) for p in paths):
+        sha.update(Path(path).name.encode())
+        sha.update(file_digest(path).encode())
+    return sha.hexdigest()[:16]
+
+
+def artifact_path(csv_path, name="raw", cache_dir=None):
+    """
+    Return the location of the compiled artifact of a CSV for its current content
+
+    :param csv_path: path of the source CSV
+    :param name: name of the build applied to the CSV
+    :param cache_dir: directory of the artifacts, defaults to `.compiled/` next to the CSV
+    :return: Path
+    """
+    csv_path = Path(csv_path)
+    cache_dir = Path(cache_dir) if cache_dir is not None else csv_path.parent / COMPILED_DIR
+    key = file_digest(csv_path)[:16]
+    return cache_dir / f"{csv_path.stem}.{name}.v{FORMAT_VERSION}.{key}.parquet"
+
+
+def load_compiled(csv_path, build=None, name="raw", cache_dir=None, columns=None, filters=None, **read_csv_kwargs):
+    """
+    Load a CSV from its compiled artifact, compiling it first if the source changed
+
+    :param csv_path: path of the source CSV
+    :param build: optional function applied to the parsed CSV before it is stored,
+        may return a pandas or geopandas dataframe
+    :param name: name of the build, part of the artifact key
+    :param cache_dir: directory of the artifacts, defaults to `.compiled/` next to the CSV
+    :param columns: optional subset of columns to read, see read_artifact
+    :param filters: optional pyarrow row filters applied while reading
+    :param read_csv_kwargs: forwarded to pd.read_csv when compiling
+    :return: pd.DataFrame or gpd.GeoDataFrame
+    """
+    artifact = artifact_path(csv_path, name, cache_dir)
+    if not artifact.exists():
+        compile_dataset(csv_path, build, name, cache_dir, **read_csv_kwargs)
+    return read_artifact(artifact, columns=columns, filters=filters)
+
+
+def read_artifact(artifact, columns=None, filters=None):
+    """
+    Read a compiled artifact, as a GeoDataFrame when it holds geometries
+
+    Only the requested columns are read from disk and row filters are pushed down to
+    the parquet reader. The index of the source rows is always restored.
+
+    :param artifact: path of the artifact
+    :param columns: optional subset of columns to read, columns missing from the artifact are skipped
+    :param filters: optional pyarrow row filters, e.g. [("status", "in", ["operating"])]
+    :return: pd.DataFrame or gpd.GeoDataFrame
+    """
+    import pyarrow.parquet as pq
+
+    schema = pq.read_schema(artifact)
+    if columns is not None:
+        columns = [column for column in columns if column in schema.names]
+    metadata = schema.metadata or {}
+    if b"geo" in metadata:
+        if columns is not None:
+            geometry = json.loads(metadata[b"geo"])["primary_column"]
+            columns = columns + [geometry] * (geometry not in columns)
+        return gpd.read_parquet(artifact, columns=columns, filters=filters)
+    return pd.read_parquet(artifact, columns=columns, filters=filters)
+
+
+def compile_dataset(csv_path, build=None, name="raw", cache_dir=None, **read_csv_kwargs):
+    """
+    Compile a CSV into its artifact and remove the artifacts of previous versions of the source
+
+    :param csv_path: path of the source CSV
+    :param build: optional function applied to the parsed CSV before it is stored
+    :param name: name of the build, part of the artifact key
+    :param cache_dir: directory of the artifacts, defaults to `.compiled/` next to the CSV
+    :param read_csv_kwargs: forwarded to pd.read_csv
+    :return: Path of the artifact
+    """
+    artifact = artifact_path(csv_path, name, cache_dir)
+    artifact.parent.mkdir(parents=True, exist_ok=True)
+
+    df = pd.read_csv(csv_path, low_memory=False, **read_csv_kwargs)
+    if build is not None:
+        df = build(df)
+
+    # Write next to the target and rename so concurrent readers never see a partial file,
+    # under a name unique to the process and thread as threads may compile the same source.
+    # The index is stored as a column so it survives filtered reads.
+    tmp = artifact.with_name(f"{artifact.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    df.to_parquet(tmp, index=True)
+    os.replace(tmp, artifact)
+
+    for stale in artifact.parent.glob(f"{Path(csv_path).stem}.{name}.v*.parquet"):
+        if stale != artifact:
+            try:
+                stale.unlink()
+            except FileNotFoundError:
+                pass
+
+    return artifact
@@ -0,0 +1,21 @@
+"""
+Local stand-ins of Earth Engine objects shared by the tests
+"""
+
+
+class Expression:
+    """
+    Stands for an Earth Engine expression, counting its getInfo calls
+    """
+
+    def __init__(self, graph, result=None):
+        self.graph = graph
+        self.result = result
+        self.calls = 0
+
+    def serialize(self):
+        return self.graph
+
+    def getInfo(self):
+        self.calls += 1
+        return self.result
@@ -0,0 +1,17 @@
+import unittest
+
+import shapely
+
+from methane.context import hotspot_ids
+
+
+class TestHotspotIds(unittest.TestCase):
+
+    def test_ids_from_the_centroid(self):
+        ids = hotspot_ids([shapely.box(90.2, 23.6, 90.4, 23.8), shapely.box(-10.1, -5.1, -9.9, -4.9)])
+        self.assertEqual(ids.tolist(), ["+2370+9030", "-0500-1000"])
+
+    def test_hotspots_at_the_same_position_get_a_suffix(self):
+        ids = hotspot_ids([shapely.Point(1, 1), shapely.Point(2, 2), shapely.Point(1.001, 1.001), shapely.Point(1, 1)])
+        self.assertEqual(ids.tolist(), ["+0100+0100", "+0200+0200", "+0100+0100-1", "+0100+0100-2"])
+        self.assertEqual(len(set(ids)), len(ids))
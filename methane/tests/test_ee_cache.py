@@ -0,0 +1,99 @@
+import os
+import pickle
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+from methane.ee_cache import ResultCache, expression_key
+from methane.tests.fakes import Expression
+
+
+class TestExpressionKey(unittest.TestCase):
+
+    def test_key_of_the_graph_and_namespace(self):
+        self.assertEqual(expression_key(Expression("a")), expression_key(Expression("a")))
+        self.assertNotEqual(expression_key(Expression("a")), expression_key(Expression("b")))
+        self.assertNotEqual(expression_key(Expression("a"), "getInfo"), expression_key(Expression("a"), "getMapId"))
+
+
+class TestResultCache(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.cache_dir = Path(self._dir.name)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def entries(self):
+        return sorted(path.stem for path in self.cache_dir.glob("*/*.pkl"))
+
+    def test_values_are_computed_once(self):
+        cache = ResultCache(self.cache_dir, enabled=True)
+        calls = []
+        for _ in range(3):
+            self.assertEqual(cache.get_or_compute("aa1", lambda: calls.append(1) or "value"), "value")
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.get_or_compute("aa1", lambda: "new", refresh=True), "new")
+        self.assertEqual(ResultCache(self.cache_dir, enabled=True).get("aa1"), "new")
+
+    def test_none_is_not_cached(self):
+        cache = ResultCache(self.cache_dir, enabled=True)
+        self.assertIsNone(cache.get_or_compute("aa1", lambda: None))
+        self.assertEqual(self.entries(), [])
+
+    def test_disabled_cache_always_computes(self):
+        cache = ResultCache(self.cache_dir, enabled=False)
+        calls = []
+        cache.get_or_compute("aa1", lambda: calls.append(1) or "value")
+        cache.get_or_compute("aa1", lambda: calls.append(1) or "value")
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(self.entries(), [])
+
+    def test_entries_expire(self):
+        cache = ResultCache(self.cache_dir, ttl=60, enabled=True)
+        cache.put("aa1", "value")
+        self.assertEqual(cache.get("aa1"), "value")
+        with open(self.cache_dir / "aa" / "aa1.pkl", "wb") as f:
+            pickle.dump((time.time() - 120, "value"), f)
+        self.assertIsNone(cache.get("aa1"))
+
+    def test_least_recently_used_entries_are_evicted(self):
+        cache = ResultCache(self.cache_dir, ttl=None, max_bytes=10 ** 6, enabled=True)
+        for i, key in enumerate(["aa1", "bb2", "cc3"]):
+            cache.put(key, "x" * 1000)
+            os.utime(self.cache_dir / key[:2] / f"{key}.pkl", (1000 + i, 1000 + i))
+        entry_size = (self.cache_dir / "aa" / "aa1.pkl").stat().st_size
+        # aa1 is read, bb2 becomes the least recently used
+        cache.get("aa1")
+
+        cache.max_bytes = 3 * entry_size
+        cache.put("dd4", "x" * 1000)
+        self.assertEqual(self.entries(), ["aa1", "cc3", "dd4"])
+
+    def test_directory_is_listed_only_over_the_budget(self):
+        cache = ResultCache(self.cache_dir, ttl=None, max_bytes=10 ** 6, enabled=True)
+        listings = []
+        entries = cache._entries
+        cache._entries = lambda: listings.append(1) or entries()
+        for i in range(20):
+            cache.put(f"aa{i}", "x" * 100)
+        # The first write counts the existing entries, the others keep a running total
+        self.assertEqual(len(listings), 1)
+        cache.put("aa0", "x" * 10)
+        self.assertEqual(cache._total, sum(path.stat().st_size for path in self.cache_dir.glob("*/*.pkl")))
+
+        cache.max_bytes = cache._total
+        cache.put("bb0", "x" * 100)
+        self.assertEqual(len(listings), 2)
+        self.assertLessEqual(cache._total, cache.max_bytes)
+        self.assertEqual(cache._total, sum(path.stat().st_size for path in self.cache_dir.glob("*/*.pkl")))
+
+    def test_cache_is_opt_in(self):
+        with mock.patch.dict(os.environ, {"METHANE_EE_CACHE": ""}):
+            del os.environ["METHANE_EE_CACHE"]
+            self.assertFalse(ResultCache(self.cache_dir).enabled)
+        with mock.patch.dict(os.environ, {"METHANE_EE_CACHE": "on"}):
+            self.assertTrue(ResultCache(self.cache_dir).enabled)
@@ -0,0 +1,109 @@
+import tempfile
+import threading
+import unittest
+
+from methane.ee_cache import ResultCache
+from methane.ee_client import EEClient, is_transient
+from methane.tests.fakes import Expression
+
+
+class Response:
+    def __init__(self, status):
+        self.status = status
+
+
+class HttpError(Exception):
+    def __init__(self, status, message=""):
+        super().__init__(message)
+        self.resp = Response(status)
+
+
+def client(**kwargs):
+    return EEClient(max_workers=4, rate=1000., backoff=0., **kwargs)
+
+
+class TestIsTransient(unittest.TestCase):
+
+    def test_status_of_the_response_decides(self):
+        self.assertTrue(is_transient(HttpError(429)))
+        self.assertTrue(is_transient(HttpError(503)))
+        self.assertFalse(is_transient(HttpError(400, "Too many requests 503")))
+
+    def test_rate_limits_and_server_errors_are_transient(self):
+        self.assertTrue(is_transient(Exception("Too many concurrent aggregations, 429")))
+        self.assertTrue(is_transient(Exception("Service unavailable")))
+        self.assertTrue(is_transient(ConnectionError("Connection reset by peer")))
+
+    def test_computation_limits_are_permanent(self):
+        self.assertFalse(is_transient(Exception("Computation timed out.")))
+        self.assertFalse(is_transient(Exception("Collection query aborted after accumulating over 5000 elements.")))
+        self.assertFalse(is_transient(Exception("User memory limit exceeded.")))
+        self.assertFalse(is_transient(TimeoutError("Computation timed out.")))
+
+    def test_codes_are_word_bounded(self):
+        self.assertFalse(is_transient(Exception("Image.select: band 5003 not found")))
+
+
+class TestEEClient(unittest.TestCase):
+
+    def test_retries_transient_errors(self):
+        attempts = []
+
+        def request():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise HttpError(503)
+            return "ok"
+
+        self.assertEqual(client(retries=5).call(request), "ok")
+        self.assertEqual(len(attempts), 3)
+
+    def test_does_not_retry_permanent_errors(self):
+        attempts = []
+
+        def request():
+            attempts.append(1)
+            raise Exception("Computation timed out.")
+
+        with self.assertRaises(Exception):
+            client(retries=5).call(request)
+        self.assertEqual(len(attempts), 1)
+
+    def test_gives_up_after_retries(self):
+        attempts = []
+
+        def request():
+            attempts.append(1)
+            raise HttpError(429)
+
+        with self.assertRaises(HttpError):
+            client(retries=3).call(request)
+        self.assertEqual(len(attempts), 3)
+
+    def test_coalesces_requests_in_flight(self):
+        release = threading.Event()
+        calls = []
+
+        def request():
+            calls.append(1)
+            release.wait(5)
+            return len(calls)
+
+        ee = client()
+        first = ee.submit(request, key="same")
+        second = ee.submit(request, key="same")
+        release.set()
+        self.assertIs(first, second)
+        self.assertEqual(first.result(), 1)
+        self.assertEqual(len(calls), 1)
+
+    def test_get_info_goes_through_the_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = ResultCache(cache_dir, enabled=True)
+            ee = client()
+            expression = Expression("graph", {"features": []})
+            self.assertEqual(ee.get_info(expression, cache), {"features": []})
+            self.assertEqual(ee.get_info(Expression("graph", "other"), cache), {"features": []})
+            self.assertEqual(expression.calls, 1)
+            self.assertEqual(ee.get_info(expression, cache, refresh=True), {"features": []})
+            self.assertEqual(expression.calls, 2)
@@ -0,0 +1,82 @@
+import tempfile
+import unittest
+
+import shapely
+
+from methane.ee_cache import ResultCache
+from methane.features import download_features, features_to_gdf, geojson_to_geometries
+from methane.tests.fakes import Expression
+
+
+class FeatureCollection(Expression):
+    """
+    Stands for an ee.FeatureCollection, recording the pages requested
+    """
+
+    def __init__(self, features):
+        super().__init__("fc", {"type": "FeatureCollection", "features": features})
+        self.features = features
+        self.pages = []
+
+    def size(self):
+        return Expression("fc.size", len(self.features))
+
+    def toList(self, count, offset):
+        self.pages.append((count, offset))
+        return Expression(f"fc.toList({count}, {offset})", self.features[offset:offset + count])
+
+
+def square(i):
+    return {
+        "type": "Feature",
+        "properties": {"label": i},
+        "geometry": {"type": "Polygon", "coordinates": [[[i, 0], [i + 1, 0], [i + 1, 1], [i, 1], [i, 0]]]},
+    }
+
+
+class TestGeometries(unittest.TestCase):
+
+    def test_geometries_of_every_type(self):
+        geometries = geojson_to_geometries([
+            {"type": "Polygon", "coordinates": [[[0, 0], [1, 0], [1, 1], [0, 0]]]},
+            None,
+            {"type": "MultiPolygon", "coordinates": [[[[0, 0], [1, 0], [1, 1], [0, 0]]], [[[2, 2], [3, 2], [3, 3], [2, 2]]]]},
+            {"type": "Point", "coordinates": [1, 2]},
+        ])
+        self.assertTrue(geometries[0].equals(shapely.Polygon([(0, 0), (1, 0), (1, 1)])))
+        self.assertIsNone(geometries[1])
+        self.assertEqual(len(geometries[2].geoms), 2)
+        self.assertTrue(geometries[3].equals(shapely.Point(1, 2)))
+
+    def test_features_to_gdf(self):
+        gdf = features_to_gdf([square(0), square(1)])
+        self.assertEqual(gdf["label"].tolist(), [0, 1])
+        self.assertEqual(shapely.area(gdf.geometry.values).tolist(), [1., 1.])
+        self.assertEqual(gdf.crs, "EPSG:4326")
+
+
+class TestDownloadFeatures(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.cache = ResultCache(self._dir.name, enabled=True)
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_pages_cover_the_collection_once(self):
+        fc = FeatureCollection([square(i) for i in range(10)])
+        pages = download_features(fc, page_size=4, cache=self.cache)
+        self.assertEqual(sorted(fc.pages), [(4, 0), (4, 4), (4, 8)])
+        self.assertEqual([len(page) for page in pages], [4, 4, 2])
+        self.assertEqual([label for page in pages for label in page["label"]], list(range(10)))
+
+    def test_single_request_without_page_size(self):
+        fc = FeatureCollection([square(i) for i in range(3)])
+        pages = download_features(fc, cache=self.cache)
+        self.assertEqual(fc.pages, [])
+        self.assertEqual(len(pages), 1)
+        self.assertEqual(pages[0]["label"].tolist(), [0, 1, 2])
+
+    def test_empty_collection(self):
+        self.assertEqual(download_features(FeatureCollection([]), page_size=4, cache=self.cache), [])
@@ -0,0 +1,96 @@
+import os
+import tempfile
+import unittest
+
+import geopandas as gpd
+import shapely
+
+from methane.history import HotspotHistory, append_run, link_detections
+
+
+def hotspots(*boxes, criticality=None):
+    criticality = criticality if criticality is not None else [1.] * len(boxes)
+    return gpd.GeoDataFrame({"criticality": criticality}, geometry=[shapely.box(*b) for b in boxes], crs="EPSG:4326")
+
+
+class TestHotspotHistory(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.root = self._dir.name
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_links_detections_across_days(self):
+        append_run(self.root, hotspots((0, 0, 1, 1), (10, 10, 11, 11)), "2021-01-01")
+        detections = append_run(self.root, hotspots((0.5, 0.5, 1.5, 1.5), (20, 20, 21, 21)), "2021-01-02")
+
+        history = HotspotHistory(self.root)
+        self.assertEqual(len(history.tracks), 3)
+        self.assertEqual(detections["track_id"].tolist()[0], 0)
+        active = history.active_tracks(bbox=(-1, -1, 2, 2))
+        self.assertEqual(active["n_detections"].tolist(), [2])
+        self.assertEqual(active["duration_days"].tolist(), [2])
+        self.assertEqual(len(history.track_detections(0)), 2)
+
+    def test_tracks_are_not_continued_after_the_gap(self):
+        append_run(self.root, hotspots((0, 0, 1, 1)), "2021-01-01", max_gap_days=3)
+        detections = append_run(self.root, hotspots((0, 0, 1, 1)), "2021-01-10", max_gap_days=3)
+        self.assertEqual(detections["track_id"].tolist(), [1])
+
+    def test_rerun_with_the_same_detections_is_skipped(self):
+        append_run(self.root, hotspots((0, 0, 1, 1)), "2021-01-01")
+        append_run(self.root, hotspots((0, 0, 1, 1), (5, 5, 6, 6)), "2021-01-02")
+        tracks_mtime = os.stat(HotspotHistory(self.root).tracks_path).st_mtime_ns
+
+        detections = append_run(self.root, hotspots((5, 5, 6, 6), (0, 0, 1, 1)), "2021-01-02")
+
+        history = HotspotHistory(self.root)
+        self.assertEqual(sorted(detections["track_id"].tolist()), [0, 1])
+        self.assertEqual(os.stat(history.tracks_path).st_mtime_ns, tracks_mtime)
+        self.assertEqual(history.tracks["n_detections"].tolist(), [2, 1])
+
+    def test_rerun_with_other_detections_replaces_the_run(self):
+        append_run(self.root, hotspots((0, 0, 1, 1)), "2021-01-01")
+        append_run(self.root, hotspots((0, 0, 1, 1), (5, 5, 6, 6)), "2021-01-02")
+
+        append_run(self.root, hotspots((0, 0, 1, 1)), "2021-01-02")
+
+        history = HotspotHistory(self.root)
+        self.assertEqual(history.run_dates(), ["2021-01-01", "2021-01-02"])
+        self.assertEqual(history.tracks["n_detections"].tolist(), [2])
+        self.assertEqual(len(history.track_detections(0)), 2)
+
+    def test_earlier_runs_are_rejected(self):
+        append_run(self.root, hotspots((0, 0, 1, 1)), "2021-01-02")
+        with self.assertRaises(ValueError):
+            append_run(self.root, hotspots((0, 0, 1, 1)), "2021-01-01")
+
+    def test_rerun_repairs_a_run_archived_without_its_tracks(self):
+        append_run(self.root, hotspots((0, 0, 1, 1)), "2021-01-01")
+        history = HotspotHistory(self.root)
+        # A crash between the detections and the tracks leaves the tracks older than the detections
+        detections_path = history.detections_root / "run_date=2021-01-01" / "hotspots.parquet"
+        tracks_mtime = os.stat(history.tracks_path).st_mtime_ns
+        os.utime(detections_path, ns=(tracks_mtime + 10 ** 9, tracks_mtime + 10 ** 9))
+
+        append_run(self.root, hotspots((0, 0, 1, 1)), "2021-01-01")
+
+        self.assertGreater(os.stat(history.tracks_path).st_mtime_ns, tracks_mtime)
+        self.assertEqual(HotspotHistory(self.root).tracks["n_detections"].tolist(), [1])
+
+
+class TestLinkDetections(unittest.TestCase):
+
+    def test_link_distance_is_in_metres_at_every_latitude(self):
+        # 0.1 degree of longitude is about 11 km at the equator and 1.9 km at 80N
+        for lat, expected in ((0, -1), (80, 0)):
+            track = shapely.box(0, lat, 0.01, lat + 0.01)
+            detection = shapely.box(0.11, lat, 0.12, lat + 0.01)
+            self.assertEqual(link_detections([detection], [track], link_distance=5000).tolist(), [expected])
+
+    def test_largest_overlap_wins(self):
+        tracks = [shapely.box(0, 0, 1, 1), shapely.box(0.8, 0, 2, 1), shapely.box(5, 5, 6, 6)]
+        detections = [shapely.box(0.7, 0, 1.9, 1), shapely.box(6.01, 5, 7, 6), shapely.box(20, 20, 21, 21)]
+        self.assertEqual(link_detections(detections, tracks).tolist(), [1, 2, -1])
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from methane.local_detection import (detect_hotspots, label_components, local_methane_hotspots, median_difference,
+                                     read_raster, save_raster, tiled_median_difference)
+
+TRANSFORM = (10., 50., 0.1, 0.1)
+
+
+def raster(shape=(30, 40), seed=0):
+    """
+    Background methane with noise well under the threshold
+    """
+    rng = np.random.default_rng(seed)
+    image = 1850 + rng.normal(0, 5, shape).astype(np.float32)
+    image[:3, :5] = np.nan
+    return image
+
+
+class TestMedianDifference(unittest.TestCase):
+
+    def test_matches_nanmedian(self):
+        image = raster((12, 15))
+        radius = 2
+        padded = np.pad(image, radius, constant_values=np.nan)
+        expected = np.full(image.shape, np.nan, dtype=np.float32)
+        for i, j in zip(*np.nonzero(~np.isnan(image))):
+            expected[i, j] = image[i, j] - np.nanmedian(padded[i:i + 2 * radius + 1, j:j + 2 * radius + 1])
+        np.testing.assert_allclose(median_difference(image, radius), expected, atol=1e-3)
+
+    def test_tiles_give_the_same_result(self):
+        image = raster((25, 10))
+        np.testing.assert_array_equal(tiled_median_difference(image, radius=3, tile_rows=7, max_workers=2),
+                                      median_difference(image, radius=3))
+
+
+class TestLabelComponents(unittest.TestCase):
+
+    def test_pixels_on_a_row_or_column_within_the_radius_are_connected(self):
+        mask = np.zeros((10, 10), dtype=bool)
+        mask[0, 0] = mask[0, 3] = mask[4, 3] = True
+        mask[9, 9] = True
+        labels = label_components(mask, radius=4)
+        self.assertEqual(len({labels[0, 0], labels[0, 3], labels[4, 3]}), 1)
+        self.assertNotEqual(labels[9, 9], labels[0, 0])
+        self.assertEqual(np.count_nonzero(labels), 4)
+
+    def test_large_objects_are_dropped(self):
+        mask = np.zeros((10, 10), dtype=bool)
+        mask[2:8, 2:8] = True
+        self.assertEqual(np.count_nonzero(label_components(mask, radius=1, max_size=35)), 0)
+
+
+class TestDetectHotspots(unittest.TestCase):
+
+    def test_detects_a_plume(self):
+        image = raster()
+        image[10:13, 20:22] += 200
+        hotspots = detect_hotspots(image, TRANSFORM, kernel_radius=5, max_workers=1)
+        self.assertEqual(len(hotspots), 1)
+        # 3 x 2 pixels of 0.1 degree at (12, 49)
+        np.testing.assert_allclose(hotspots.total_bounds, [12., 48.7, 12.2, 49.], atol=1e-9)
+
+    def test_background_has_no_hotspot(self):
+        self.assertEqual(len(detect_hotspots(raster(), TRANSFORM, kernel_radius=5, max_workers=1)), 0)
+
+    def test_plumes_across_rasters_are_merged(self):
+        west, east = raster(seed=1), raster(seed=2)
+        west[10:13, -2:] += 200
+        east[10:13, :2] += 200
+        with tempfile.TemporaryDirectory() as directory:
+            paths = [os.path.join(directory, "west.npz"), os.path.join(directory, "east.npz")]
+            save_raster(paths[0], west, TRANSFORM)
+            save_raster(paths[1], east, (TRANSFORM[0] + 4., *TRANSFORM[1:]))
+            image, transform = read_raster(paths[1])
+            self.assertEqual(transform, (14., 50., 0.1, 0.1))
+            np.testing.assert_array_equal(image, east)
+
+            hotspots = local_methane_hotspots(paths, kernel_radius=5, max_workers=1)
+        self.assertEqual(len(hotspots), 1)
+        np.testing.assert_allclose(hotspots.total_bounds, [13.8, 48.7, 14.2, 49.], atol=1e-9)
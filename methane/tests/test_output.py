@@ -0,0 +1,82 @@
+import json
+import tempfile
+import unittest
+
+import geopandas as gpd
+import numpy as np
+import pyarrow.parquet as pq
+import shapely
+
+from methane.output import (FLATGEOBUF_NAME, PARQUET_NAME, partition_path, read_geoparquet, read_hotspots,
+                            read_hotspots_fgb, run_dates, write_hotspots)
+
+
+def hotspots(*boxes):
+    return gpd.GeoDataFrame({
+        "id": np.array([f"h{i}" for i in range(len(boxes))], dtype=object),
+        "criticality": np.arange(len(boxes), dtype=float),
+    }, geometry=[shapely.box(*b) for b in boxes], crs="EPSG:4326")
+
+
+class TestOutput(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.root = self._dir.name
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_round_trip(self):
+        gdf = hotspots((100, 10, 101, 11), (-50, -20, -49, -19), (0, 0, 1, 1))
+        paths = write_hotspots(gdf, self.root, "2021-01-01")
+        self.assertEqual([p.name for p in paths], [PARQUET_NAME, FLATGEOBUF_NAME])
+
+        for read in (read_hotspots, read_hotspots_fgb):
+            result = read(self.root).sort_values("id").reset_index(drop=True)
+            self.assertEqual(result["id"].tolist(), ["h0", "h1", "h2"])
+            self.assertEqual(result["criticality"].tolist(), [0., 1., 2.])
+            self.assertEqual(result["run_date"].tolist(), ["2021-01-01"] * 3)
+            self.assertTrue(result.geometry.geom_equals(gdf.geometry).all())
+            self.assertTrue(result.crs.equals(gdf.crs))
+
+    def test_geoparquet_layout(self):
+        gdf = hotspots((100, 10, 101, 11), (-50, -20, -49, -19), (0, 0, 1, 1))
+        path = write_hotspots(gdf, self.root, "2021-01-01", formats=("parquet",))[0]
+        table = pq.read_table(path)
+        # Rows along the Z-order curve: south-west first
+        self.assertEqual(table.column("id").to_pylist(), ["h1", "h2", "h0"])
+        self.assertEqual(table.column("bbox").to_pylist()[0], {"xmin": -50., "ymin": -20., "xmax": -49., "ymax": -19.})
+
+        geo = json.loads(table.schema.metadata[b"geo"])
+        column = geo["columns"][geo["primary_column"]]
+        self.assertEqual(geo["version"], "1.1.0")
+        self.assertEqual(column["encoding"], "WKB")
+        self.assertEqual(column["geometry_types"], ["Polygon"])
+        self.assertEqual(column["bbox"], [-50., -20., 101., 11.])
+        self.assertEqual(column["covering"]["bbox"]["xmin"], ["bbox", "xmin"])
+
+    def test_bbox_filter(self):
+        gdf = hotspots((100, 10, 101, 11), (-50, -20, -49, -19), (0, 0, 1, 1))
+        write_hotspots(gdf, self.root, "2021-01-01")
+        bbox = (-60, -30, 0.5, 0.5)
+        for read in (read_hotspots, read_hotspots_fgb):
+            self.assertEqual(sorted(read(self.root, bbox=bbox)["id"]), ["h1", "h2"])
+        path = partition_path(self.root, "2021-01-01") / PARQUET_NAME
+        self.assertEqual(read_geoparquet(path, bbox=bbox, columns=["id"]).columns.tolist(), ["id", "geometry"])
+
+    def test_date_range(self):
+        for day in ("2021-01-01", "2021-01-02", "2021-01-03"):
+            write_hotspots(hotspots((0, 0, 1, 1)), self.root, day)
+        self.assertEqual(run_dates(self.root, start_date="2021-01-02"), ["2021-01-02", "2021-01-03"])
+        for read in (read_hotspots, read_hotspots_fgb):
+            result = read(self.root, start_date="2021-01-02", end_date="2021-01-02")
+            self.assertEqual(result["run_date"].tolist(), ["2021-01-02"])
+        self.assertEqual(len(read_hotspots(self.root, start_date="2022-01-01")), 0)
+
+    def test_empty_run(self):
+        write_hotspots(hotspots(), self.root, "2021-01-01")
+        for read in (read_hotspots, read_hotspots_fgb):
+            self.assertEqual(len(read(self.root)), 0)
+        write_hotspots(hotspots((0, 0, 1, 1)), self.root, "2021-01-02")
+        self.assertEqual(read_hotspots(self.root)["run_date"].tolist(), ["2021-01-02"])
@@ -0,0 +1,163 @@
+"""
+Tiled extraction
+------------------------------
+
+Split an area of interest in lat/lon tiles, process them concurrently with retries and
+checkpoints, and merge back the polygons cut at tile borders
+"""
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import shapely
+
+logger = logging.getLogger(__name__)
+
+
+def make_tiles(bounds, tile_size):
+    """
+    Split a bounding box in a grid of tiles
+
+    :param bounds: (west, south, east, north) in degrees
+    :param tile_size: size of the tiles in degrees, a number or a (lon, lat) pair
+    :return: list of (west, south, east, north) tuples
+    """
+    west, south, east, north = bounds
+    lon_step, lat_step = np.broadcast_to(tile_size, 2)
+    lons = np.append(np.arange(west, east, lon_step), east)
+    lats = np.append(np.arange(south, north, lat_step), north)
+    return [
+        (float(w), float(s), float(e), float(n))
+        for s, n in zip(lats[:-1], lats[1:]) if n > s
+        for w, e in zip(lons[:-1], lons[1:]) if e > w
+    ]
+
+
+def tile_name(tile):
+    return "tile_{}_{}_{}_{}".format(*(f"{c:g}" for c in tile))
+
+
+def run_tiles(tiles, extract, max_workers=4, retries=3, backoff=5., checkpoint_dir=None):
+    """
+    Run an extraction on every tile concurrently
+
+    Each tile is retried with exponential backoff. With a checkpoint directory, the result
+    of every successful tile is saved and reused by later runs, so a rerun only redoes
+    the tiles that failed.
+
+    :param tiles: list of (west, south, east, north) tuples
+    :param extract: function taking a tile and returning a gpd.GeoDataFrame
+    :param max_workers: maximum number of tiles processed at the same time
+    :param retries: number of attempts per tile
+    :param backoff: seconds to wait before the first retry, doubled at each retry
+    :param checkpoint_dir: optional directory of the tile checkpoints
+    :return: gpd.GeoDataFrame of all tiles, with the position of its tile in a `tile` column
+    """
+    checkpoint_dir = Path(checkpoint_dir) if checkpoint_dir is not None else None
+    if checkpoint_dir is not None:
+        checkpoint_dir.mkdir(parents=True, exist_ok=True)
+
+    def process(tile):
+        checkpoint = checkpoint_dir / f"{tile_name(tile)}.parquet" if checkpoint_dir is not None else None
+        if checkpoint is not None and checkpoint.exists():
+            return gpd.read_parquet(checkpoint)
+
+        for attempt in range(retries):
+            try:
+                result = extract(tile)
+                break
+            except Exception:
+                if attempt == retries - 1:
+                    raise
+                logger.warning("Tile %s failed, retrying (%d/%d)", tile_name(tile), attempt + 1, retries, exc_info=True)
+                time.sleep(backoff * 2 ** attempt)
+
+        if checkpoint is not None:
+            tmp = checkpoint.with_suffix(".tmp")
+            result.to_parquet(tmp)
+            tmp.replace(checkpoint)
+        return result
+
+    results, failed = [], []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(process, tile) for tile in tiles]
+        for position, (tile, future) in enumerate(zip(tiles, futures)):
+            try:
+                results.append(future.result().assign(tile=position))
+            except Exception:
+                logger.exception("Tile %s failed", tile_name(tile))
+                failed.append(tile)
+
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(tiles)} tiles failed: {[tile_name(t) for t in failed]}")
+
+    results = [r for r in results if len(r)]
+    if not results:
+        return gpd.GeoDataFrame({"tile": []}, geometry=[], crs="EPSG:4326")
+    return gpd.GeoDataFrame(pd.concat(results, ignore_index=True), crs=results[0].crs)
+
+
+def merge_seams(gdf, tiles, tolerance=0.02, weighted_columns=("mean",)):
+    """
+    Merge the polygons cut at tile borders
+
+    Polygons lying within `tolerance` of the border of their tile are merged with the
+    polygons of other tiles they are within `tolerance` of.
+
+    :param gdf: gpd.GeoDataFrame with the tile position of each polygon in a `tile` column
+    :param tiles: list of (west, south, east, north) tuples the polygons were extracted from
+    :param tolerance: distance in degrees under which polygons are considered touching,
+        about a pixel of the extraction
+    :param weighted_columns: columns averaged with area weights when polygons are merged,
+        other columns keep the value of the largest part
+    :return: gpd.GeoDataFrame without the `tile` column
+    """
+    if gdf.empty:
+        return gdf.drop(columns="tile")
+
+    geometries = np.asarray(gdf.geometry.values, dtype=object)
+    tile = gdf["tile"].to_numpy()
+    borders = shapely.boundary(shapely.box(*np.asarray(tiles, dtype=float).T))
+    at_seam = np.flatnonzero(shapely.dwithin(geometries, borders[tile], tolerance))
+
+    # Union-find over the pairs of seam polygons from different tiles
+    parent = np.arange(len(gdf))
+
+    def root(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    if len(at_seam):
+        left, right = shapely.STRtree(geometries[at_seam]).query(
+            geometries[at_seam], predicate="dwithin", distance=tolerance
+        )
+        left, right = at_seam[left], at_seam[right]
+        for i, j in zip(left[tile[left] != tile[right]], right[tile[left] != tile[right]]):
+            parent[root(i)] = root(j)
+
+    groups = np.array([root(i) for i in range(len(gdf))])
+    if (groups == np.arange(len(gdf))).all():
+        return gdf.drop(columns="tile")
+
+    # Polygons away from the seams are kept as they are
+    single = np.bincount(groups, minlength=len(gdf))[groups] == 1
+    merged = [gdf[single]]
+    parts = gdf[~single].assign(_area=shapely.area(geometries[~single]))
+    for _, part in parts.groupby(groups[~single], sort=False):
+        row = part.sort_values("_area", ascending=False).iloc[[0]].copy()
+        for column in weighted_columns:
+            if column in part:
+                row[column] = np.average(part[column], weights=part["_area"])
+        # Close the gap left between the parts by the pixel grid before the union
+        union = shapely.union_all(shapely.buffer(part.geometry.values, tolerance / 2, join_style="mitre"))
+        row[gdf.geometry.name] = [shapely.buffer(union, -tolerance / 2, join_style="mitre")]
+        merged.append(row.drop(columns="_area"))
+
+    result = pd.concat(merged).drop(columns="tile").reset_index(drop=True)
+    return gpd.GeoDataFrame(result, geometry=gdf.geometry.name, crs=gdf.crs)
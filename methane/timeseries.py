@@ -0,0 +1,105 @@
+"""
+Methane time series
+------------------------------
+
+Daily methane statistics over a polygon, reduced by Earth Engine
+
+Each day of the collection is reduced over the polygon on the server (mean, percentiles
+and number of valid pixels), so one small row per day is downloaded instead of every
+pixel of every image. The date range is requested in chunks fetched concurrently.
+"""
+import datetime
+
+import ee
+import numpy as np
+import pandas as pd
+
+from methane.ee_client import default_client
+
+METHANE_COLLECTION = 'COPERNICUS/S5P/OFFL/L3_CH4'
+METHANE_BAND = 'CH4_column_volume_mixing_ratio_dry_air'
+
+FMT = "%Y-%m-%d"
+PERCENTILES = (10, 50, 90)
+
+
+def stats_reducer(percentiles=PERCENTILES):
+    return (
+        ee.Reducer.mean()
+        .combine(ee.Reducer.percentile(list(percentiles)), sharedInputs=True)
+        .combine(ee.Reducer.count(), sharedInputs=True)
+    )
+
+
+def daily_stats(geometry, start_date, end_date, scale=2000, percentiles=PERCENTILES,
+                collection=METHANE_COLLECTION, band=METHANE_BAND):
+    """
+    Server-side daily statistics of a band over a geometry
+
+    :param geometry: ee.Geometry of the area
+    :param start_date: first day (str: 'YYYY-MM-dd')
+    :param end_date: day after the last day (str: 'YYYY-MM-dd')
+    :param scale: scale of the reduction in metres
+    :return: ee.FeatureCollection with one feature per day, without geometry
+    """
+    images = ee.ImageCollection(collection).select([band]).filterBounds(geometry)
+    start = ee.Date(start_date)
+    n_days = ee.Date(end_date).difference(start, 'day').round()
+    reducer = stats_reducer(percentiles)
+
+    def day_stats(offset):
+        day = start.advance(offset, 'day')
+        # The orbits of a day are averaged before the reduction
+        image = images.filterDate(day, day.advance(1, 'day')).mean()
+        stats = image.reduceRegion(reducer=reducer, geometry=geometry, scale=scale, maxPixels=1e9)
+        return ee.Feature(None, stats).set('date', day.format('YYYY-MM-dd'))
+
+    return ee.FeatureCollection(ee.List.sequence(0, n_days.subtract(1)).map(day_stats))
+
+
+def _chunks(start_date, end_date, chunk_days):
+    start = datetime.datetime.strptime(start_date, FMT).date()
+    end = datetime.datetime.strptime(end_date, FMT).date()
+    while start < end:
+        stop = min(end, start + datetime.timedelta(days=chunk_days))
+        yield start.strftime(FMT), stop.strftime(FMT)
+        start = stop
+
+
+def stats_to_df(features, band=METHANE_BAND, percentiles=PERCENTILES):
+    """
+    Decode daily statistics features into a dataframe
+
+    :param features: list of GeoJSON features from daily_stats
+    :return: pd.DataFrame indexed by day with columns mean, p<percentile>... and count,
+        NaN means and count 0 on days without valid pixel
+    """
+    columns = {f'{band}_mean': 'mean', **{f'{band}_p{p}': f'p{p}' for p in percentiles}, f'{band}_count': 'count'}
+    properties = [f['properties'] for f in features]
+    df = pd.DataFrame({
+        name: np.array([p.get(key) for p in properties], dtype=float)
+        for key, name in columns.items()
+    }, index=pd.DatetimeIndex([p['date'] for p in properties], name='date'))
+    return df.assign(count=df['count'].fillna(0).astype(np.int64))
+
+
+def methane_time_series(geometry, start_date, end_date, scale=2000, percentiles=PERCENTILES,
+                        chunk_days=60, client=None):
+    """
+    Daily methane statistics over a geometry, requested in concurrent chunks of days
+
+    :param geometry: ee.Geometry of the area
+    :param start_date: first day (str: 'YYYY-MM-dd')
+    :param end_date: day after the last day (str: 'YYYY-MM-dd')
+    :param scale: scale of the reduction in metres
+    :param chunk_days: number of days per request
+    :param client: methane.ee_client.EEClient, defaults to the shared one
+    :return: pd.DataFrame indexed by day, see stats_to_df
+    """
+    client = client or default_client()
+    futures = [
+        client.get_info_async(daily_stats(geometry, start, end, scale, percentiles))
+        for start, end in _chunks(start_date, end_date, chunk_days)
+    ]
+    features = [f for future in futures for f in future.result()['features']]
+    return stats_to_df(features, percentiles=percentiles)
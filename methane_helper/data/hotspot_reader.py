@@ -0,0 +1,160 @@
+"""
+Hotspot reader
+------------------------------
+
+Hotspots shown by the web application, read from the latest output of the daily job
+
+The hotspots of the latest run are loaded once per process into a columnar table ranked
+by criticality, with an index from hotspot id to rank. The run directory is checked at
+most every check_interval seconds and the table is reloaded only when a newer run, or a
+rewrite of the latest one, appears. Without output of the daily job (METHANE_HOTSPOTS_DIR
+unset or empty), the hotspots bundled with the app are used.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+import geojson
+import geopandas as gpd
+
+from methane.context import hotspot_ids
+from methane.methane_hotspots import hotspots_as_gdf
+from methane.output import PARQUET_NAME, partition_path, read_hotspots, run_dates
+from methane_helper.data import infra_data, methane_hotspots
+
+logger = logging.getLogger(__name__)
+
+HOTSPOTS_DIR = os.environ.get("METHANE_HOTSPOTS_DIR")
+
+# Columns of the bundled hotspots kept, the others are computed again
+BUNDLED_COLUMNS = ["hotspots", "mean", "geometry"]
+
+
+class HotspotTable:
+    """
+    Hotspots of one run, ranked by criticality, most critical first
+
+    Features are built from the columns on first access and kept.
+
+    :param hotspots: gpd.GeoDataFrame of hotspots, identified by their `id` column when they have one
+    :param run_date: run the hotspots come from, None for the bundled hotspots
+    """
+
+    def __init__(self, hotspots, run_date=None):
+        if "id" not in hotspots:
+            hotspots = hotspots.assign(id=hotspot_ids(hotspots.geometry))
+        if "criticality" in hotspots:
+            hotspots = hotspots.sort_values("criticality", ascending=False, kind="stable")
+        self.hotspots = hotspots.reset_index(drop=True)
+        self.run_date = run_date
+        self.ids = self.hotspots["id"].astype(str).to_numpy()
+        self._ranks = {hotspot_id: rank for rank, hotspot_id in enumerate(self.ids)}
+        self._features = [None] * len(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rank(self, hotspot_id):
+        """
+        Position of a hotspot in the table, None if it is not in the run
+        """
+        return self._ranks.get(hotspot_id)
+
+    def label(self, hotspot_id):
+        return f"Hotspot {self._ranks[hotspot_id]} - {hotspot_id}"
+
+    def feature(self, rank):
+        """
+        Hotspot at a rank as a GeoJSON Feature, its attributes in `properties`
+        """
+        if self._features[rank] is None:
+            row = self.hotspots.iloc[[rank]]
+            properties = json.loads(row.drop(columns=row.geometry.name).to_json(orient="records", date_format="iso"))[0]
+            self._features[rank] = geojson.loads(json.dumps({
+                "type": "Feature",
+                "properties": properties,
+                "geometry": row.geometry.iloc[0].__geo_interface__,
+            }))
+        return self._features[rank]
+
+
+def bundled_hotspots(infrastructure=None):
+    """
+    Hotspots bundled with the app, see methane_helper.data.methane_hotspots
+
+    The attributes of the bundled hotspots predate the geodesic distances and were measured
+    against pipelines with swapped coordinates, only their polygons and dates are kept.
+    Distances, areas and criticality are computed again as the daily job does.
+
+    :param infrastructure: optional methane.registry.Infrastructure, defaults to the datasets of the app
+    """
+    features = json.loads(methane_hotspots.HOTSPOTS)["features"]
+    bundled = gpd.GeoDataFrame.from_features(features, crs="EPSG:4326")
+    hotspots = hotspots_as_gdf(
+        bundled[BUNDLED_COLUMNS],
+        bundled["start_date"].iloc[0],
+        bundled["end_date"].iloc[0],
+        infrastructure=infrastructure or infra_data.get_infrastructure(),
+    )
+    return HotspotTable(hotspots)
+
+
+class HotspotReader:
+    """
+    Latest hotspots of the daily job, reloaded when a newer run appears
+
+    :param root: directory of the run partitions, see methane.output
+    :param check_interval: minimum number of seconds between two checks of the runs
+    """
+
+    def __init__(self, root=HOTSPOTS_DIR, check_interval=60):
+        self.root = root
+        self.check_interval = check_interval
+        self._table = None
+        self._version = None
+        self._checked_at = 0.
+        self._lock = threading.Lock()
+
+    def version(self):
+        """
+        Return the latest run and the modification time of its hotspots, None without run
+        """
+        if self.root is None:
+            return None
+        for run_date in reversed(run_dates(self.root)):
+            path = partition_path(self.root, run_date) / PARQUET_NAME
+            if path.exists():
+                return run_date, path.stat().st_mtime_ns
+        return None
+
+    def get(self):
+        """
+        Return the hotspots of the latest run
+
+        :return: HotspotTable
+        """
+        table = self._table
+        if table is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return table
+
+        with self._lock:
+            if self._table is None or time.monotonic() - self._checked_at >= self.check_interval:
+                version = self.version()
+                if self._table is None or version != self._version:
+                    self._table = self._load(version)
+                    self._version = version
+                self._checked_at = time.monotonic()
+            return self._table
+
+    def _load(self, version):
+        if version is None:
+            return bundled_hotspots()
+        run_date = version[0]
+        hotspots = read_hotspots(self.root, start_date=run_date, end_date=run_date)
+        logger.info("Loaded %d hotspots of the run of %s", len(hotspots), run_date)
+        return HotspotTable(hotspots.drop(columns="run_date"), run_date)
+
+
+hotspot_reader = HotspotReader()
@@ -0,0 +1,196 @@
+"""
+Infrastructure cache
+------------------------------
+
+Map-ready infrastructure shared by every session of the web application
+
+Streamlit reruns the page script on every interaction, but imported modules live as long
+as the process: the cache below is built once and read by all sessions. Entries are
+versioned by the fingerprint of their source dataset and rebuilt when it changes, one
+build at a time per entry however many sessions ask for it. Entries over the memory
+budget are evicted, least recently used first, and rebuilt on their next use.
+
+Cached values are shared between sessions and must not be modified.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import shapely
+from scipy.spatial import cKDTree
+from shapely.strtree import STRtree
+
+from methane.radius import RadiusIndex
+from methane.render import LineRenderLayer
+from methane.store import dataset_fingerprint
+from methane_helper.data import infra_data
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_BYTES = int(os.environ.get("METHANE_INFRA_CACHE_BYTES", 1 << 30))
+
+
+def _indexed(load):
+    def build():
+        df = load()
+        return df, RadiusIndex.from_frame(df)
+    return build
+
+
+# name: (source dataset, build returning the cached value)
+ENTRIES = {
+    "coal_mines": ("coal-mine-infrastructure-dataset.csv", _indexed(infra_data.load_coal_mines)),
+    "power_plants": ("power-plant-infrastructure-dataset.csv", _indexed(infra_data.load_power_plants)),
+    "steel_plants": ("steel-plant-infrastructure-dataset.csv", _indexed(infra_data.load_steel_plants)),
+    "pipelines": ("fossil-pipelines-infrastructure-dataset.csv",
+                  lambda: LineRenderLayer(infra_data.pipelines_as_gdf(), "name")),
+}
+
+
+def estimate_size(value):
+    """
+    Approximate memory used by a cached value, in bytes
+    """
+    if isinstance(value, (tuple, list)):
+        return sum(estimate_size(v) for v in value)
+    if isinstance(value, dict):
+        return sum(estimate_size(v) for v in value.values())
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        if value.dtype != object:
+            return value.nbytes
+        # Geometries live in GEOS memory, about 16 bytes per coordinate
+        geometries = np.fromiter((isinstance(v, shapely.Geometry) for v in value), dtype=bool, count=len(value))
+        return (value.nbytes + int(shapely.get_num_coordinates(value[geometries]).sum()) * 16
+                + sum(sys.getsizeof(v) for v in value[~geometries]))
+    if isinstance(value, cKDTree):
+        return value.data.nbytes + value.indices.nbytes
+    if isinstance(value, STRtree):
+        return len(value) * 64
+    if hasattr(value, "__dict__"):
+        return estimate_size(vars(value))
+    return sys.getsizeof(value)
+
+
+class InfraCache:
+    """
+    Process-wide cache of map-ready infrastructure
+
+    :param entries: dict of name: (source dataset, build), see ENTRIES
+    :param datasets_path: directory of the source datasets
+    :param max_bytes: memory budget of the cache, the entry just built is kept even if it
+        does not fit
+    :param check_interval: minimum number of seconds between two checks of the version
+        of a dataset, None to never check
+    """
+
+    def __init__(self, entries=None, datasets_path=None, max_bytes=DEFAULT_MAX_BYTES, check_interval=60):
+        self.entries = entries if entries is not None else ENTRIES
+        self.datasets_path = datasets_path
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        # name: (version, value, size), least recently used first
+        self._values = OrderedDict()
+        self._versions = {}
+        self._lock = threading.Lock()
+        self._build_locks = {name: threading.Lock() for name in self.entries}
+        self._warmup = None
+
+    def version(self, name):
+        """
+        Return the fingerprint of the dataset of an entry, checked at most every check_interval
+        """
+        checked_at, version = self._versions.get(name, (None, None))
+        if version is None or (self.check_interval is not None
+                               and time.monotonic() - checked_at >= self.check_interval):
+            datasets_path = self.datasets_path or infra_data.DATASETS_PATH
+            version = dataset_fingerprint([os.path.join(datasets_path, self.entries[name][0])])
+            self._versions[name] = (time.monotonic(), version)
+        return version
+
+    def version_key(self):
+        """
+        Return the versions of every dataset of the cache as one string, e.g. to key what is built from them
+        """
+        return "-".join(self.version(name) for name in self.entries)
+
+    def get(self, name):
+        """
+        Return the value of an entry, building it if it is missing or out of date
+        """
+        version = self.version(name)
+        value = self._lookup(name, version)
+        if value is not None:
+            return value
+
+        # Sessions asking for an entry being built wait for that build instead of starting theirs
+        with self._build_locks[name]:
+            value = self._lookup(name, version)
+            if value is not None:
+                return value
+            start = time.monotonic()
+            value = self.entries[name][1]()
+            size = estimate_size(value)
+            logger.info("Built %s (%s) in %.1fs, %.1f MB", name, version, time.monotonic() - start, size / 1e6)
+            self._store(name, version, value, size)
+            return value
+
+    def _lookup(self, name, version):
+        with self._lock:
+            cached = self._values.get(name)
+            if cached is None or cached[0] != version:
+                return None
+            self._values.move_to_end(name)
+            return cached[1]
+
+    def _store(self, name, version, value, size):
+        with self._lock:
+            self._values[name] = (version, value, size)
+            self._values.move_to_end(name)
+            total = self.size()
+            for other in list(self._values):
+                if total <= self.max_bytes or other == name:
+                    break
+                total -= self._values.pop(other)[2]
+                logger.info("Evicted %s from the infrastructure cache", other)
+
+    def size(self):
+        """
+        Return the estimated memory used by the cached values, in bytes
+        """
+        return sum(size for _, _, size in self._values.values())
+
+    def warmup(self):
+        """
+        Build every entry in a background thread, once per cache
+
+        :return: threading.Thread
+        """
+        with self._lock:
+            if self._warmup is None:
+                self._warmup = threading.Thread(target=self._warm, name="infra-cache-warmup", daemon=True)
+                self._warmup.start()
+            return self._warmup
+
+    def _warm(self):
+        for name in self.entries:
+            try:
+                self.get(name)
+            except Exception:
+                logger.exception("Warmup of %s failed, it will be built on first use", name)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+            self._versions.clear()
+
+
+infra_cache = InfraCache()
@@ -0,0 +1,41 @@
+import json
+import unittest
+
+import geopandas as gpd
+
+from methane.methane_hotspots import hotspots_as_gdf
+from methane_helper.data import infra_data, methane_hotspots
+from methane_helper.data.hotspot_reader import HotspotTable, bundled_hotspots
+
+
+class TestBundledHotspots(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.infrastructure = infra_data.get_infrastructure()
+        cls.table = bundled_hotspots(cls.infrastructure)
+
+    def test_bundled_hotspots_are_computed_as_the_daily_job(self):
+        feature = next(f for f in json.loads(methane_hotspots.HOTSPOTS)["features"] if f["properties"]["id"] == "+5026+1316")
+        fresh = hotspots_as_gdf(gpd.GeoDataFrame.from_features([feature], crs="EPSG:4326")[["geometry"]],
+                                "20200301", "20200314", infrastructure=self.infrastructure).iloc[0]
+
+        properties = self.table.feature(self.table.rank(fresh["id"])).properties
+        for column in ["min_dist_plant", "min_dist_pipeline", "min_dist_infra", "area_m2", "criticality"]:
+            self.assertAlmostEqual(properties[column], fresh[column], places=6)
+        # The legacy attribute measured 29 degrees to the nearest pipeline, against swapped coordinates
+        self.assertLess(properties["min_dist_pipeline"], 20000)
+        self.assertEqual((properties["start_date"], properties["end_date"]), ("20200301", "20200314"))
+
+    def test_ranked_by_criticality(self):
+        criticality = self.table.hotspots["criticality"].tolist()
+        self.assertEqual(criticality, sorted(criticality, reverse=True))
+        self.assertEqual(len(set(self.table.ids)), len(self.table))
+
+
+class TestHotspotTable(unittest.TestCase):
+
+    def test_empty_table(self):
+        table = HotspotTable(gpd.GeoDataFrame({"id": [], "criticality": []}, geometry=[], crs="EPSG:4326"))
+        self.assertEqual(len(table), 0)
+        self.assertIsNone(table.rank("+0000+0000"))
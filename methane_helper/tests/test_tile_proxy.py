@@ -0,0 +1,137 @@
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+
+from methane.ee_cache import ResultCache
+from methane_helper.utils.map_cache import MapIdCache
+from methane_helper.utils.tile_proxy import TileProxy
+
+
+class StubTileServer:
+    """
+    Stands for the Earth Engine tile server: serves tiles for the current token only,
+    404 for tiles of zoom 9
+    """
+
+    def __init__(self):
+        self.token = "t1"
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.requests.append(self.path)
+                if self.path.startswith("/9/"):
+                    return self.send_error(404)
+                if not self.path.endswith(f"token={stub.token}"):
+                    return self.send_error(403)
+                body = b"\x89PNG" + self.path.encode()
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def map_id(self, image, vis_params):
+        tile_fetcher = mock.Mock(url_format=f"http://127.0.0.1:{self.server.server_port}/{{z}}/{{x}}/{{y}}?token={self.token}")
+        return {"tile_fetcher": tile_fetcher}
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class Image:
+    def __init__(self, graph):
+        self.graph = graph
+
+    def serialize(self):
+        return self.graph
+
+
+class TestTileProxy(unittest.TestCase):
+
+    def setUp(self):
+        self.upstream = StubTileServer()
+        patcher = mock.patch("methane_helper.utils.map_cache.get_map_id", side_effect=self.upstream.map_id)
+        self.get_map_id = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.upstream.close)
+
+        self._dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self._dir.cleanup)
+        self.cache = ResultCache(self._dir.name, ttl=None, max_bytes=1000, enabled=True)
+        self.proxy = self.start_proxy()
+        self.url = self.register(self.proxy, Image("ch4"))
+
+    def start_proxy(self, **kwargs):
+        proxy = TileProxy(public_url="http://127.0.0.1", map_ids=MapIdCache(), cache=self.cache, load_image=Image, **kwargs)
+        proxy.serve("127.0.0.1", 0)
+        self.addCleanup(proxy.shutdown)
+        return proxy
+
+    def register(self, proxy, image):
+        return proxy.register(image, {"min": 1}).replace("127.0.0.1", f"127.0.0.1:{proxy.serve().server_port}")
+
+    def get(self, z, x, y):
+        try:
+            with urllib.request.urlopen(self.url.format(z=z, x=x, y=y)) as response:
+                return response.status, response.read()
+        except urllib.error.HTTPError as e:
+            return e.code, None
+
+    def test_tiles_are_served_from_disk_after_the_first_request(self):
+        self.assertEqual(self.get(3, 1, 2), (200, b"\x89PNG/3/1/2?token=t1"))
+        self.assertEqual(self.get(3, 1, 2), (200, b"\x89PNG/3/1/2?token=t1"))
+        self.assertEqual(len(self.upstream.requests), 1)
+        self.assertEqual(self.get_map_id.call_count, 1)
+
+    def test_expired_token_is_renewed(self):
+        self.get(3, 1, 2)
+        self.upstream.token = "t2"
+        self.assertEqual(self.get(3, 1, 3), (200, b"\x89PNG/3/1/3?token=t2"))
+        self.assertEqual(self.get_map_id.call_count, 2)
+
+    def test_missing_tiles_are_not_cached(self):
+        self.assertEqual(self.get(9, 0, 0)[0], 404)
+        self.assertEqual(self.get(9, 0, 0)[0], 404)
+        self.assertEqual(len(self.upstream.requests), 2)
+
+    def test_cache_stays_under_its_budget(self):
+        for i in range(20):
+            self.assertEqual(self.get(5, i, i)[0], 200)
+        size = sum(path.stat().st_size for path in Path(self._dir.name).glob("*/*.pkl"))
+        self.assertLessEqual(size, self.cache.max_bytes)
+
+    def test_unknown_layers_are_not_found(self):
+        self.assertEqual(self.proxy.tile("unknown", 1, 1, 1), None)
+        with self.assertRaises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(self.url.rsplit("/tiles/", 1)[0] + "/tiles/unknown/1/1/1.png")
+        self.assertEqual(error.exception.code, 404)
+
+    def test_registrations_are_bounded_and_read_back(self):
+        proxy = self.start_proxy(max_layers=2)
+        urls = [self.register(proxy, Image(f"layer{i}")) for i in range(3)]
+        self.assertEqual(len(proxy._layers), 2)
+
+        with urllib.request.urlopen(urls[0].format(z=3, x=1, y=2)) as response:
+            self.assertEqual(response.status, 200)
+        self.assertEqual(len(proxy._layers), 2)
+        self.assertEqual(self.get_map_id.call_args[0][0].graph, "layer0")
+
+    def test_registrations_survive_a_restart(self):
+        self.proxy.shutdown()
+        restarted = self.start_proxy()
+        url = self.url.rsplit("/tiles/", 1)[1]
+        with urllib.request.urlopen(f"http://127.0.0.1:{restarted.serve().server_port}/tiles/{url}".format(z=3, x=1, y=2)) as response:
+            self.assertEqual(response.read(), b"\x89PNG/3/1/2?token=t1")
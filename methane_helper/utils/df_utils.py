@@ -1,27 +1,6 @@
-import pandas as pd
+from methane.earth_engine import ee_array_to_df as _ee_array_to_df
 
 
 def ee_array_to_df(arr, list_of_bands, keep_geo=True):
     """Transforms client-side ee.Image.getRegion array to pandas.DataFrame."""
-    df = pd.DataFrame(arr)
-
-    # Rearrange the header.
-    headers = df.iloc[0]
-    df = pd.DataFrame(df.values[1:], columns=headers)
-
-    # Remove rows without data inside.
-    df = df[['longitude', 'latitude', 'time', *list_of_bands]].dropna()
-
-    # Convert the data to numeric values.
-    for band in list_of_bands:
-        df[band] = pd.to_numeric(df[band], errors='coerce')
-
-    # Convert the time field into a datetime.
-    df['datetime'] = pd.to_datetime(df['time'], unit='ms')
-
-    # Keep the columns of interest.
-    if keep_geo:
-        list_of_bands += ['longitude', 'latitude']
-    df = df[['time', 'datetime', *list_of_bands]]
-
-    return df
+    return _ee_array_to_df(arr, list_of_bands, keep_geo=keep_geo)
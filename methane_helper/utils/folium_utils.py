@@ -1,66 +1,85 @@
 import ee
 import folium
-from shapely.geometry import Point
+from folium.plugins import FastMarkerCluster
 
 import io
 import base64
+import html
 
-from methane_helper.utils.geo_utils import point_distance, shape_distance, flip_geojson_coordinates
+from methane.ee_client import get_map_id
+from methane.radius import RadiusIndex
+from methane.render import LineRenderLayer
+
+# Markers of a cluster layer are created in the browser from rows of [lat, lng, label],
+# Leaflet renders the label as HTML so it is escaped when the rows are built
+MARKER_CALLBACK = """
+function (row) {{
+    var icon = L.AwesomeMarkers.icon({{icon: '{icon}', prefix: 'fa', markerColor: '{color}'}});
+    return L.marker(new L.LatLng(row[0], row[1]), {{icon: icon}}).bindPopup(row[2]);
+}}
+"""
 
 
 def add_ee_layer(self, ee_image_object, vis_params, name, opacity=0.5, show=True):
-    map_id_dict = ee.Image(ee_image_object).getMapId(vis_params)
+    map_id_dict = get_map_id(ee.Image(ee_image_object), vis_params)
+    add_tile_layer(self, map_id_dict['tile_fetcher'].url_format, name, opacity, show)
+
 
+def add_tile_layer(folium_map, url_format, name, opacity=0.5, show=True):
     folium.raster_layers.TileLayer(
-        tiles=map_id_dict['tile_fetcher'].url_format,
+        tiles=url_format,
         attr="Map Data © Google Earth Engine",
         name=name,
         overlay=True,
         control=True,
         opacity=opacity,
         show=show
-    ).add_to(self)
+    ).add_to(folium_map)
 
 
 def add_geo_markers_to_map(folium_map, center, max_distance, df,
                            group_name: str, label_col: str, icon: str, color: str,
-                           show: bool = True):
-    feature_group = folium.map.FeatureGroup(name=group_name, show=show)
-    folium_map.add_child(feature_group)
-    latitudes = list(df.lat)
-    longitudes = list(df.lng)
-    labels = list(df[label_col])
-
-    for lat, lng, label in zip(latitudes, longitudes, labels):
-        if point_distance([lat, lng], center) < max_distance:
-            folium.Marker(
-                location=[lat, lng],
-                popup=label,
-                icon=folium.Icon(color=color, icon=icon, prefix='fa')
-            ).add_to(feature_group)
-
-
-def add_geo_polygons_to_map(folium_map, center, max_distance, df, polygon_col,
-                            group_name: str, label_col: str, color: str,
-                            show: bool = True):
-    feature_group = folium.map.FeatureGroup(name=group_name, show=show)
-    folium_map.add_child(feature_group)
-    polygons = list(df[df[polygon_col].notnull()][polygon_col])
-    labels = list(df[label_col])
+                           show: bool = True, index: RadiusIndex = None, max_markers: int = 5000):
+    """
+    Add the assets within max_distance metres of the center as a clustered marker layer
+
+    :param index: RadiusIndex built from df, built on the fly when not given
+    :param max_markers: maximum number of markers, the nearest assets are kept
+    """
+    index = index if index is not None else RadiusIndex.from_frame(df)
+    df = index.within(df, center[0], center[1], max_distance, limit=max_markers)
+    labels = df[label_col].astype(object).where(df[label_col].notnull(), '').astype(str)
+    data = [[lat, lng, html.escape(label)] for lat, lng, label in zip(df.lat.tolist(), df.lng.tolist(), labels.tolist())]
+
+    FastMarkerCluster(
+        data,
+        callback=MARKER_CALLBACK.format(icon=icon, color=color),
+        name=group_name,
+        show=show,
+    ).add_to(folium_map)
 
-    style = {'fillColor': color, 'color': color}
 
-    for polygon, label in zip(polygons, labels):
-        distance_to_center = shape_distance(Point(center[0], center[1]), polygon)
-        flipped_line = flip_geojson_coordinates(polygon)
-
-        if (distance_to_center or 1e10) < max_distance/4e5:
-            folium.GeoJson(
-                flipped_line,
-                style_function=lambda x: style,
-                popup=label,
-                tooltip=label
-            ).add_to(feature_group)
+def add_geo_polygons_to_map(folium_map, center, max_distance, layer: LineRenderLayer,
+                            group_name: str, color: str, show: bool = True, zoom: int = None):
+    """
+    Add the lines of a render layer within max_distance metres of the center as one GeoJson layer
+
+    :param zoom: zoom level the lines are drawn at, picks their level of detail
+    """
+    positions = layer.query(center[0], center[1], max_distance)
+    style = {'fillColor': color, 'color': color}
+    details = {}
+    if len(positions):
+        details = dict(popup=folium.GeoJsonPopup(fields=['label'], labels=False),
+                       tooltip=folium.GeoJsonTooltip(fields=['label'], labels=False))
+
+    folium.GeoJson(
+        layer.geojson(positions, zoom),
+        name=group_name,
+        show=show,
+        style_function=lambda x: style,
+        **details
+    ).add_to(folium_map)
 
 
 def add_circle(folium_map, center, radius, label='search-radius'):
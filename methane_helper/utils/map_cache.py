@@ -0,0 +1,126 @@
+"""
+Map cache
+------------------------------
+
+Rendered maps of the web application, shared by every session of the process
+
+A map is the same for every user as long as its hotspot, the infrastructure datasets
+and the Earth Engine tiles are: its HTML is cached under those three, and rendered
+again only when one changes. Tile URLs carry an Earth Engine token that expires, so
+map ids are memoised for MAP_ID_TTL seconds and a rendered map expires with the tokens
+it embeds. The least recently used maps are evicted over max_entries.
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from methane.ee_cache import expression_key
+from methane.ee_client import get_map_id
+
+# Lifetime of the tile tokens of a map id, kept under the one of Earth Engine
+MAP_ID_TTL = int(os.environ.get("METHANE_MAP_ID_TTL", 3600))
+
+
+class MapIdCache:
+    """
+    Tile URLs of Earth Engine images, memoised until their token expires
+
+    :param ttl: seconds a map id is used for
+    """
+
+    def __init__(self, ttl=MAP_ID_TTL):
+        self.ttl = ttl
+        self._ids = {}
+        self._lock = threading.Lock()
+
+    def get(self, image, vis_params):
+        """
+        Return the tile URL format of an image and the time it expires at
+
+        :param image: ee.Image
+        :param vis_params: visualization parameters of the image
+        :return: (url_format, expires_at), expires_at a time.time() timestamp
+        """
+        key = self._key(image, vis_params)
+        with self._lock:
+            entry = self._ids.get(key)
+        if entry is not None and entry[1] > time.time():
+            return entry
+
+        map_id = get_map_id(image, vis_params)
+        entry = (map_id['tile_fetcher'].url_format, time.time() + self.ttl)
+        with self._lock:
+            self._ids[key] = entry
+        return entry
+
+    def invalidate(self, image, vis_params):
+        """
+        Drop the map id of an image, e.g. when its token was rejected
+        """
+        with self._lock:
+            self._ids.pop(self._key(image, vis_params), None)
+
+    @staticmethod
+    def _key(image, vis_params):
+        return expression_key(image, "getMapId" + json.dumps(vis_params, sort_keys=True))
+
+
+class RenderCache:
+    """
+    LRU cache of rendered HTML with a per-entry expiry
+
+    :param max_entries: number of maps kept
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        # key: (html, expires_at), least recently used first
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        Return the HTML of a key, None if it is missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, html, expires_at):
+        with self._lock:
+            now = time.time()
+            for expired in [k for k, (_, expiry) in self._entries.items() if expiry <= now]:
+                del self._entries[expired]
+            self._entries[key] = (html, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_render(self, key, expires_at, render):
+        """
+        Return the cached HTML of a key, rendering and storing it if needed
+
+        :param key: hashable key, e.g. (hotspot id, infrastructure version, tile URLs)
+        :param expires_at: time.time() timestamp after which the HTML is rendered again
+        :param render: function without argument returning the HTML
+        """
+        html = self.get(key)
+        if html is None:
+            html = render()
+            self.put(key, html, expires_at)
+        return html
+
+
+map_ids = MapIdCache()
+rendered_maps = RenderCache()
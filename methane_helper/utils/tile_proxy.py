@@ -0,0 +1,216 @@
+"""
+Tile proxy
+------------------------------
+
+Local caching proxy of Earth Engine map tiles, served next to the web application
+
+Layers are registered with their image and visualization parameters and get a stable URL
+on the proxy, without Earth Engine token. The proxy fetches a tile from Earth Engine the
+first time it is asked for, with a memoised map id renewed when its token expires, and
+serves it from a size-bounded disk cache afterwards, for every browser.
+
+Registrations are kept in memory for the most recently used layers and stored in the tile
+cache, so the URLs of maps rendered earlier, or before a restart, keep working.
+
+The proxy listens on METHANE_TILE_PROXY_PORT and browsers reach it at
+METHANE_TILE_PROXY_URL, the app only uses it when that URL is set.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from methane.ee_cache import ResultCache, expression_key
+from methane_helper.utils import map_cache
+
+logger = logging.getLogger(__name__)
+
+PROXY_PORT = int(os.environ.get("METHANE_TILE_PROXY_PORT", 8502))
+PROXY_URL = os.environ.get("METHANE_TILE_PROXY_URL")
+TILE_CACHE_DIR = os.environ.get("METHANE_TILE_CACHE_DIR", str(Path.home() / ".cache" / "methane" / "tiles"))
+TILE_CACHE_BYTES = int(os.environ.get("METHANE_TILE_CACHE_BYTES", 512 << 20))
+TILE_TTL = 24 * 3600
+MAX_LAYERS = 256
+
+TILE_PATH = re.compile(r"^/tiles/(\w+)/(\d+)/(\d+)/(\d+)(?:\.png)?$")
+
+
+def tile_key(layer_id, z, x, y):
+    return hashlib.sha256(f"{layer_id}/{z}/{x}/{y}".encode()).hexdigest()
+
+
+def layer_key(layer_id):
+    return hashlib.sha256(f"layer/{layer_id}".encode()).hexdigest()
+
+
+def load_image(serialized):
+    """
+    Earth Engine image of a serialized expression, as stored with the registrations
+    """
+    import ee
+    return ee.Image(ee.deserializer.fromJSON(serialized))
+
+
+class TileProxy:
+    """
+    Earth Engine layers served through a disk cache of tiles
+
+    :param public_url: URL of the proxy for the browsers, e.g. "http://localhost:8502"
+    :param map_ids: MapIdCache memoising the map ids of the layers, defaults to the shared one
+    :param cache: methane.ee_cache.ResultCache of the tiles and of the registrations
+    :param timeout: seconds to wait for a tile from Earth Engine
+    :param max_layers: number of registrations kept in memory, the others are read back from the cache
+    :param load_image: function building an image from its serialized expression
+    """
+
+    def __init__(self, public_url=PROXY_URL, map_ids=None, cache=None, timeout=30, max_layers=MAX_LAYERS,
+                 load_image=load_image):
+        self.public_url = (public_url or f"http://localhost:{PROXY_PORT}").rstrip("/")
+        self.map_ids = map_ids or map_cache.map_ids
+        self.cache = cache or ResultCache(TILE_CACHE_DIR, ttl=TILE_TTL, max_bytes=TILE_CACHE_BYTES, enabled=True)
+        self.timeout = timeout
+        self.max_layers = max_layers
+        self.load_image = load_image
+        # layer_id: (image, vis_params), least recently used first
+        self._layers = OrderedDict()
+        self._layers_lock = threading.Lock()
+        self._server = None
+        self._lock = threading.Lock()
+
+    def register(self, image, vis_params):
+        """
+        Serve a layer through the proxy
+
+        The layer is identified by its expression, which includes its time window, so each
+        window of a layer has its own map id and tiles.
+
+        :param image: ee.Image
+        :param vis_params: visualization parameters of the image
+        :return: tile URL format of the layer on the proxy
+        """
+        layer_id = expression_key(image, "tiles" + json.dumps(vis_params, sort_keys=True))[:32]
+        self._remember(layer_id, image, vis_params)
+        # Stored again at every registration so layers still displayed outlive the cache TTL
+        self.cache.put(layer_key(layer_id), (image.serialize(), vis_params))
+        return f"{self.public_url}/tiles/{layer_id}/{{z}}/{{x}}/{{y}}.png"
+
+    def _remember(self, layer_id, image, vis_params):
+        with self._layers_lock:
+            self._layers[layer_id] = (image, vis_params)
+            self._layers.move_to_end(layer_id)
+            while len(self._layers) > self.max_layers:
+                self._layers.popitem(last=False)
+
+    def layer(self, layer_id):
+        """
+        Return the image and visualization parameters of a layer, None if it was never registered
+        """
+        with self._layers_lock:
+            layer = self._layers.get(layer_id)
+            if layer is not None:
+                self._layers.move_to_end(layer_id)
+                return layer
+        stored = self.cache.get(layer_key(layer_id))
+        if stored is None:
+            return None
+        serialized, vis_params = stored
+        image = self.load_image(serialized)
+        self._remember(layer_id, image, vis_params)
+        return image, vis_params
+
+    def tile(self, layer_id, z, x, y):
+        """
+        Return the PNG of a tile, None if the layer is unknown or Earth Engine has no tile
+        """
+        layer = self.layer(layer_id)
+        if layer is None:
+            return None
+        return self.cache.get_or_compute(tile_key(layer_id, z, x, y), lambda: self._fetch(layer, z, x, y))
+
+    def _fetch(self, layer, z, x, y):
+        image, vis_params = layer
+        for attempt in range(2):
+            url_format, _ = self.map_ids.get(image, vis_params)
+            try:
+                with urllib.request.urlopen(url_format.format(z=z, x=x, y=y), timeout=self.timeout) as response:
+                    return response.read()
+            except urllib.error.HTTPError as e:
+                if e.code == 404:
+                    return None
+                # An expired or revoked token, the map id is renewed once
+                if e.code in (401, 403) and attempt == 0:
+                    self.map_ids.invalidate(image, vis_params)
+                    continue
+                raise
+
+    def serve(self, host="0.0.0.0", port=PROXY_PORT):
+        """
+        Start serving tiles in a background thread, once per proxy
+
+        :return: http.server.ThreadingHTTPServer
+        """
+        with self._lock:
+            if self._server is None:
+                self._server = ThreadingHTTPServer((host, port), _handler(self))
+                self._server.daemon_threads = True
+                threading.Thread(target=self._server.serve_forever, name="tile-proxy", daemon=True).start()
+                logger.info("Serving tiles on %s:%d", host, self._server.server_port)
+            return self._server
+
+    def shutdown(self):
+        with self._lock:
+            if self._server is not None:
+                self._server.shutdown()
+                self._server.server_close()
+                self._server = None
+
+
+def _handler(proxy):
+    class TileHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            match = TILE_PATH.match(self.path)
+            if match is None:
+                return self.send_error(404)
+            layer_id, z, x, y = match.group(1), *map(int, match.group(2, 3, 4))
+            try:
+                png = proxy.tile(layer_id, z, x, y)
+            except Exception:
+                logger.exception("Failed to fetch tile %s", self.path)
+                return self.send_error(502)
+            if png is None:
+                return self.send_error(404)
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(png)))
+            self.send_header("Cache-Control", f"public, max-age={TILE_TTL}")
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.end_headers()
+            self.wfile.write(png)
+
+        def log_message(self, format, *args):
+            logger.debug(format, *args)
+
+    return TileHandler
+
+
+_default_proxy = None
+_default_lock = threading.Lock()
+
+
+def default_proxy():
+    """
+    Return the proxy shared by the process, serving once it is first asked for
+    """
+    global _default_proxy
+    with _default_lock:
+        if _default_proxy is None:
+            _default_proxy = TileProxy()
+            _default_proxy.serve()
+        return _default_proxy
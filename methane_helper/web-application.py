@@ -1,4 +1,8 @@
 # Import streamlit pandas and geopandas
+import copy
+import hashlib
+import json
+import math
 import os
 from datetime import datetime, timedelta
 
@@ -9,14 +13,16 @@ import streamlit as st
 import streamlit.components.v1 as components
 from altair import Scale, Y
 
-from methane_helper.data import methane_hotspots
-from methane_helper.data.infra_data import *
+from methane.context import SERIES_DAYS, load_context
+from methane_helper.data.hotspot_reader import hotspot_reader
+from methane_helper.data.infra_cache import infra_cache
 from methane_helper.utils import geo_utils
 from methane_helper.utils.ee_utils import (
     get_image_collection, get_methane_ts_from_polygon
 )
-from methane_helper.utils.folium_utils import add_ee_layer, add_circle, add_geo_markers_to_map, add_geo_polygons_to_map
-from methane_helper.utils.geo_utils import str_to_geoson
+from methane_helper.utils.folium_utils import add_tile_layer, add_circle, add_geo_markers_to_map, add_geo_polygons_to_map
+from methane_helper.utils.map_cache import map_ids, rendered_maps
+from methane_helper.utils.tile_proxy import PROXY_URL, default_proxy
 
 
 @st.cache
@@ -39,31 +45,32 @@ def load_ir_data():
     )
 
 
-def add_infra_markers(folium_map, center, max_distance):
+def add_infra_markers(folium_map, center, max_distance, zoom=None):
     add_circle(folium_map, center, max_distance)
 
     # TODO improve labeling
-    add_geo_markers_to_map(folium_map, center, max_distance, load_coal_mines(), 'Coal Mines', 'operator', 'fire', 'gray')
-    add_geo_markers_to_map(folium_map, center, max_distance, load_power_plants(), 'Power Plants', 'name', 'plug', 'blue')
-    add_geo_markers_to_map(folium_map, center, max_distance, load_steel_plants(), 'Steel Plants', 'name', 'industry', 'green')
+    for name, group_name, label_col, icon, color in [
+        ('coal_mines', 'Coal Mines', 'operator', 'fire', 'gray'),
+        ('power_plants', 'Power Plants', 'name', 'plug', 'blue'),
+        ('steel_plants', 'Steel Plants', 'name', 'industry', 'green'),
+    ]:
+        df, index = infra_cache.get(name)
+        add_geo_markers_to_map(folium_map, center, max_distance, df, group_name, label_col, icon, color, index=index)
 
-    add_geo_polygons_to_map(folium_map, center, max_distance, pipelines_as_gdf(), 'route', 'Pipelines', 'name', '#A06B2B')
+    add_geo_polygons_to_map(folium_map, center, max_distance, infra_cache.get('pipelines'), 'Pipelines', '#A06B2B', zoom=zoom)
 
 
-def extract_hotspot_repr():
-    return str_to_geoson(methane_hotspots.HOTSPOTS)
-
-
-def repr_hotspot(meth_img, ir_img, hotspot):
-    feature = hotspot
+def repr_hotspot(layers, hotspot):
+    # The hotspot is shared by every session through the HotspotTable, only a copy is styled
+    feature = copy.copy(hotspot)
     feature['fill_color'] = 'red'
     map_center = geo_utils.get_feature_center(feature)
 
-    folium.Map.add_ee_layer = add_ee_layer
-    folium_map = folium.Map(map_center, tiles='OpenStreetMap', zoom_start=7)
+    zoom = 7
+    folium_map = folium.Map(map_center, tiles='OpenStreetMap', zoom_start=zoom)
 
-    add_methane_to_map(meth_img, folium_map)
-    add_ir_to_map(ir_img, folium_map)
+    add_methane_to_map(layers['S5P CH4'][0], folium_map)
+    add_ir_to_map(layers['Infrared'][0], folium_map)
 
     style = {'fillColor': '#e80e0e', 'color': '#911414', 'fillOpacity': 1}
     folium.GeoJson(
@@ -73,58 +80,105 @@ def repr_hotspot(meth_img, ir_img, hotspot):
     ).add_to(folium_map)
 
     # Add markers for all NEARBY infrastructure
-    add_infra_markers(folium_map, map_center, 5e4)
+    # Lines keep their detail for two levels of zoom in
+    add_infra_markers(folium_map, map_center, 5e4, zoom=zoom + 2)
 
     return folium_map
 
 
-def add_methane_to_map(image_col, fol_map):
-    image_col = image_col.mean()
+# Set visualization parameters.
+METHANE_VIS = {
+    'min': 1750,
+    'max': 1970,
+    'palette': ['black', 'blue', 'purple', 'cyan', 'green', 'yellow', 'red']
+}
+
+IR_VIS = {
+    'min': 0,
+    'max': 8300,
+    'bands': 'B11',
+    'palette': ['black', 'blue', 'purple', 'cyan', 'green', 'yellow', 'red']
+}
+
+
+def ee_layers(meth_img, ir_img):
+    """
+    Tile URLs of the Earth Engine layers, with the time their token expires at
 
-    # Set visualization parameters.
-    vis_params = {
-        'min': 1750,
-        'max': 1970,
-        'palette': ['black', 'blue', 'purple', 'cyan', 'green', 'yellow', 'red']
+    Behind the tile proxy, URLs have no token and do not expire.
+    """
+    images = {
+        'S5P CH4': (meth_img.mean(), METHANE_VIS),
+        'Infrared': (ir_img.max(), IR_VIS),
     }
+    if PROXY_URL:
+        proxy = default_proxy()
+        return {name: (proxy.register(image, vis), math.inf) for name, (image, vis) in images.items()}
+    return {name: map_ids.get(image, vis) for name, (image, vis) in images.items()}
 
-    # Add the elevation model to the map object.
-    fol_map.add_ee_layer(image_col, vis_params, 'S5P CH4')
 
+def add_methane_to_map(url_format, fol_map):
+    add_tile_layer(fol_map, url_format, 'S5P CH4')
 
-def add_ir_to_map(image_col, fol_map):
-    image_col = image_col.max()
 
-    # Set visualization parameters.
-    band_viz_B11 = {
-        'min': 0,
-        'max': 8300,
-        'bands': 'B11',
-        'palette': ['black', 'blue', 'purple', 'cyan', 'green', 'yellow', 'red']
-    }
+def add_ir_to_map(url_format, fol_map):
+    add_tile_layer(fol_map, url_format, 'Infrared', show=False)
 
-    # Add the elevation model to the map object.
-    fol_map.add_ee_layer(image_col, band_viz_B11, 'Infrared', show=False)
 
+def hotspot_key(hotspot):
+    """
+    Key of the map of a hotspot: its id and a hash of its polygon
 
-def display_map(meth_img, ir_img, hotspot):
-    m = repr_hotspot(meth_img, ir_img, hotspot)
+    Ids come from rounded centroids, a rewrite of a run may keep the id of a hotspot
+    while changing its polygon.
+    """
+    digest = hashlib.sha256(json.dumps(hotspot.geometry, sort_keys=True).encode()).hexdigest()
+    return hotspot.properties.get('id'), digest
+
+
+def render_map(layers, hotspot):
+    m = repr_hotspot(layers, hotspot)
     # Add a layer control panel to the map.
     m.add_child(folium.LayerControl())
 
-    html_string = m.get_root().render()
+    return m.get_root().render()
+
+
+def display_map(meth_img, ir_img, hotspot):
+    layers = ee_layers(meth_img, ir_img)
+    # The map changes with the hotspot, the infrastructure datasets or the tile tokens,
+    # and expires with the first token to expire
+    key = (hotspot_key(hotspot), infra_cache.version_key(), tuple(url for url, _ in layers.values()))
+    expires_at = min(expires_at for _, expires_at in layers.values())
+    html_string = rendered_maps.get_or_render(key, expires_at, lambda: render_map(layers, hotspot))
 
     return components.html(html_string, height=600, width=900)
 
 
-def display_methane_ts(hotspot):
-    df = get_methane_ts_from_polygon(
-        hotspot,
-        (datetime.now() - timedelta(days=365)).strftime("%Y-%m-%d"),
-        datetime.now().strftime("%Y-%m-%d")
-    )
+def load_hotspot_context(hotspot, run_date):
+    """
+    Context precomputed by the daily job for a hotspot of its run, see methane.context
+    """
+    if run_date is None:
+        return None
+    return load_context(hotspot_reader.root, run_date, hotspot.properties['id'])
+
 
-    st.line_chart(df['methane_level'])
+def display_methane_ts(hotspot, run_date=None):
+    context = load_hotspot_context(hotspot, run_date)
+    if context is not None:
+        df = context['series'].rename(columns={'mean': 'methane_level'})
+    else:
+        # Same window as the precomputed series: the SERIES_DAYS days before the run
+        end = datetime.strptime(run_date, "%Y-%m-%d") if run_date is not None else datetime.now()
+        df = get_methane_ts_from_polygon(
+            hotspot,
+            (end - timedelta(days=SERIES_DAYS)).strftime("%Y-%m-%d"),
+            end.strftime("%Y-%m-%d"),
+            aggregated=True,
+        )
+
+    st.line_chart(df[['methane_level', 'p10', 'p90']].dropna())
 
 
 ## Adding a background to streamlit page
@@ -159,6 +213,8 @@ PAGES = {
 def main():
     authenticate_google_service_account()
     st.set_page_config(layout="wide")
+    # Shared by every session, built in the background on the first run of the process
+    infra_cache.warmup()
 
     # Page Navigation
     st.sidebar.title("Navigation")
@@ -166,16 +222,19 @@ def main():
 
     page = PAGES[selection]
 
-    hotspots = extract_hotspot_repr()
+    hotspots = hotspot_reader.get()
 
     with st.spinner(f"Loading {page} ..."):
         if page == 'hotspots':
-            hotspot_names = {'Hotspot {} - {}'.format(i, hotspots.features[i].geometry.coordinates[0][0]): i for i in range(0, len(hotspots.features))}
+            if not len(hotspots):
+                st.header("Detecting major methane hotspots around the World")
+                st.info("No hotspot was detected in the latest run")
+                return
+
             sel_hotspot = st.sidebar.selectbox(
-                "Select Hotspot", options=list(hotspot_names.keys())
+                "Select Hotspot", options=list(hotspots.ids), format_func=hotspots.label
             )
-            hotspot_index = hotspot_names[sel_hotspot]
-            hotspot = hotspots[hotspot_index]
+            hotspot = hotspots.feature(hotspots.rank(sel_hotspot))
 
             # Load csv data
             meth_img = load_methane_data()
@@ -191,20 +250,25 @@ def main():
             # Create and add the folium map by passing the gee image and hotspot feature
             display_map(meth_img, ir_img, hotspot)
 
+            # Distances are in metres, see methane.methane_hotspots.hotspots_as_gdf
             st.text(
-                "Criticality: {:.2f}; Plant Distance: {:.2f}; Pipeline Distance: {:.2f}; Infra Distance: {:.2f}; Start Date: {}; End Date: {}"
+                "Criticality: {:.2f}; Plant Distance: {:.1f} km; Pipeline Distance: {:.1f} km; Infra Distance: {:.1f} km; Start Date: {}; End Date: {}"
                 .format(
-                    hotspot.properties['criticality']*1000,
-                    hotspot.properties['min_distance_to_plant'],
-                    hotspot.properties['min_distance_to_pipeline'],
-                    hotspot.properties['min_distance_to_infra'],
+                    hotspot.properties['criticality'],
+                    hotspot.properties['min_dist_plant'] / 1000,
+                    hotspot.properties['min_dist_pipeline'] / 1000,
+                    hotspot.properties['min_dist_infra'] / 1000,
                     hotspot.properties['start_date'],
                     hotspot.properties['end_date'],
                 )
             )
+            if hotspots.run_date is None:
+                st.text("Sample hotspots bundled with the app, of March 2020")
+            else:
+                st.text(f"Hotspots of the run of {hotspots.run_date}")
 
             # Create the timeseries for overall methane in polygon in last month
-            display_methane_ts(hotspot)
+            display_methane_ts(hotspot, hotspots.run_date)
 
         else:
             st.header("Detecting major methane hotspots around the World")
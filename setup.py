@@ -10,7 +10,7 @@ setup(
     name="MethaneHotspotLibrary",
     description='Library developed for Hacktheclimate by Unit8 for the Ember & Subak challenge',
     version="dev",
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     install_requires=read_requirements('requirements/main.txt'),
     packages=find_packages(),
 )